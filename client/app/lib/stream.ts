@@ -0,0 +1,41 @@
+export type SectionEvent =
+  | { event: "delta"; section: string; text: string }
+  | { event: "section"; section: string; result: any }
+  | { event: "error"; error: string };
+
+// POSTs to one of the server's /stream endpoints and calls onEvent for every
+// Server-Sent Event until the server sends "done".
+export async function streamSections(url: string, body: unknown, onEvent: (e: SectionEvent) => void) {
+  const res = await fetch(url, {
+    method: "POST",
+    headers: { "Content-Type": "application/json", Accept: "text/event-stream" },
+    body: JSON.stringify(body),
+  });
+  if (!res.ok || !res.body) {
+    throw new Error(`Request failed with status ${res.status}`);
+  }
+
+  const reader = res.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = "";
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) return;
+    buffer += value;
+
+    // Events are separated by a blank line
+    let end;
+    while ((end = buffer.indexOf("\n\n")) !== -1) {
+      const raw = buffer.slice(0, end);
+      buffer = buffer.slice(end + 2);
+
+      let event = "message";
+      let data = "";
+      for (const line of raw.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+      }
+      if (event === "done") return;
+      onEvent({ event, ...JSON.parse(data || "{}") });
+    }
+  }
+}
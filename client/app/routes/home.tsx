@@ -6,6 +6,10 @@ import { Accordion, AccordionItem, AccordionTrigger, AccordionContent } from "~/
 import ReactMarkdown from "react-markdown"
 import { useState } from "react";
 import ErrorMessage from "~/components/ErrorMessage";
+import { streamSections } from "~/lib/stream";
+
+// Review sections whose LLM output is shown live as it streams in
+const MARKDOWN_REVIEW_SECTIONS = ["validate_pr_resolution", "clear_pr_description", "tests_presence"];
 
 export function meta({ }: Route.MetaArgs) {
   return [
@@ -42,20 +46,18 @@ export default function Home() {
         return;
       }
 
-      const res2 = await fetch(`${import.meta.env.VITE_SERVER_URL}/api/getting_started_guide`, {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify(issueInfo),
-      });
-      const getting_started = await res2.json();
-      if (!res2.ok) {
-        setError("Failed to generate getting started guide.");
-        return;
-      }
-
-      setGettingStartedData(getting_started);
       setIssueInfo(issueInfo); // Store issue info for later use (needed for implementation guide)
       setError("");
+
+      // Show each section as soon as the server finishes it
+      setGettingStartedData({});
+      await streamSections(`${import.meta.env.VITE_SERVER_URL}/api/getting_started_guide/stream`, issueInfo, (e) => {
+        if (e.event === "section") {
+          setGettingStartedData((prev: any) => ({ ...prev, [e.section]: e.result }));
+        } else if (e.event === "error") {
+          setError("Failed to generate getting started guide.");
+        }
+      });
     } catch {
       setError("Failed to generate guidebook.");
     } finally {
@@ -71,20 +73,19 @@ export default function Home() {
 
     setLoading(true);
     try {
-      const res = await fetch(`${import.meta.env.VITE_SERVER_URL}/api/implementation_guide`, {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ ...issueInfo, pr_title, pr_description, suggestion_level: 3 }), // default: function-level detail
-      });
-
-      const implementation_guide = await res.json();
-      if (!res.ok) {
-        setError("Failed to generate implementation guide.");
-        return;
-      }
-
-      setImplementationData(implementation_guide);
+      setImplementationData({});
       setError("");
+      await streamSections(
+        `${import.meta.env.VITE_SERVER_URL}/api/implementation_guide/stream`,
+        { ...issueInfo, pr_title, pr_description, suggestion_level: 3 }, // default: function-level detail
+        (e) => {
+          if (e.event === "section") {
+            setImplementationData((prev: any) => ({ ...prev, [e.section]: e.result }));
+          } else if (e.event === "error") {
+            setError("Failed to generate implementation guide.");
+          }
+        }
+      );
     } catch {
       setError("Error generating implementation guide.");
     } finally {
@@ -94,14 +95,22 @@ export default function Home() {
 
   const handleAutomateReview = async (prUrl: string) => {
     try {
-      const res = await fetch(`${import.meta.env.VITE_SERVER_URL}/api/automate_PR_review`, {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ ...issueInfo, pr_url: prUrl, suggestion_level: 3 }), // default: function-level detail
-      });
-      const json = await res.json();
-      setAutomatedReviewData(json);
+      setAutomatedReviewData({});
       setError("");
+      await streamSections(
+        `${import.meta.env.VITE_SERVER_URL}/api/automate_PR_review/stream`,
+        { ...issueInfo, pr_url: prUrl, suggestion_level: 3 }, // default: function-level detail
+        (e) => {
+          if (e.event === "delta" && MARKDOWN_REVIEW_SECTIONS.includes(e.section)) {
+            // Markdown feedback is readable while it is still being written
+            setAutomatedReviewData((prev: any) => ({ ...prev, [e.section]: (prev[e.section] || "") + e.text }));
+          } else if (e.event === "section") {
+            setAutomatedReviewData((prev: any) => ({ ...prev, [e.section]: e.result }));
+          } else if (e.event === "error") {
+            setError("Failed to refresh checklist.");
+          }
+        }
+      );
     } catch {
       setError("Failed to refresh checklist.");
     }
@@ -1,14 +1,63 @@
 import os
 import time
-from flask import Flask, request, jsonify
+import requests
+from flask import Flask, Response, request, jsonify, g
 from flask_cors import CORS
-from utils.guidebook import classify_issue, verify_feature_uniqueness, check_issue_alignment_with_vision, check_issue_scope, understand_relevant_contribution_guidelines, generate_steps, explain_tests, validate_pr_resolution, enforce_contribution_guidelines, clear_pr_description, tests_presence
-from utils.scraping import fetch_issue, clean_issue_info, get_diff, detect_duplicates
-from utils.io import read_issue_files
+from utils.scraping import fetch_issue_with_repo, store_issue_info, parse_issue_url
+from utils.io import store, write_pr_choice, write_pr_number
+from utils.pipelines import iter_getting_started, iter_implementation, iter_pr_review_sections, record_sections, no_relay
+from utils.streaming import stream_sections
+from utils.jobs import JobQueue
+from utils.singleflight import SingleFlight, request_key
+from utils.speculation import Speculator
+from utils.bulk import BULK_MAX_ISSUES, resolve_issue_urls, generate_guidebooks
+from utils.metrics import registry, http_request_seconds, set_cache_stats, coalesced_calls, CONTENT_TYPE
+from utils.tracing import current_trace, start_trace, write_trace
 
 app = Flask(__name__)
 CORS(app)
 
+# Collapses identical requests that arrive while one is already being answered
+flights = SingleFlight()
+
+# The client asks for the getting-started guide as soon as generate_guidebook returns, so with
+# SPECULATIVE_GETTING_STARTED on it is started right away and kept for SPECULATIVE_TTL seconds
+SPECULATIVE_GETTING_STARTED = os.getenv("SPECULATIVE_GETTING_STARTED", "").lower() in ("1", "true", "yes")
+speculator = Speculator(
+    max_concurrent=int(os.getenv("SPECULATIVE_MAX_CONCURRENT", 2)),
+    ttl=int(os.getenv("SPECULATIVE_TTL", 600))
+)
+
+@app.before_request
+def start_timer():
+    g.started = time.monotonic()
+    g.trace = start_trace(f"{request.method} {request.path}")
+
+@app.after_request
+def record_request_time(response):
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    http_request_seconds.observe(time.monotonic() - g.started, endpoint=endpoint, method=request.method, status=response.status_code)
+    # Where the time went, for the browser's devtools (streams only include what happened before they started)
+    response.headers["Server-Timing"] = g.trace.server_timing()
+    response.headers["Timing-Allow-Origin"] = "*"
+    # A stream is still being generated here, so the full trace is written once the response is closed
+    trace = g.trace
+    response.call_on_close(lambda: write_trace(trace))
+    return response
+
+@app.teardown_request
+def end_trace(exc):
+    current_trace.set(None)
+
+@registry.collector
+def collect_api_metrics():
+    coalesced_calls.set_total(flights.shared, flight="requests")
+    set_cache_stats("speculative_getting_started", speculator.hits, speculator.misses)
+
+@app.route('/metrics')
+def metrics():
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
 @app.route('/api/time')
 def get_current_time():
     return {'time': time.time()}
@@ -18,46 +67,71 @@ def generate_guidebook():
     issueUrl = request.get_json()
     # use the issue url, to fetch repo information, issue information, and other required information...
     # https://github.com/jax-ml/jax/issues/30787
-    fetched_issue_information = fetch_issue(issueUrl["issueUrl"])
+    # Everyone who pastes the same issue while it is being prepared shares that run
+    key = request_key("generate_guidebook", parse_issue_url(issueUrl["issueUrl"]) or issueUrl)
+    useful_issue_info = flights.do(key, lambda: prepare_issue(issueUrl["issueUrl"]))
+    if not useful_issue_info:
+        return jsonify({"error": "Failed to fetch issue information"}), 400
+    if SPECULATIVE_GETTING_STARTED:
+        speculator.start(speculation_key(useful_issue_info), lambda: run_getting_started(useful_issue_info))
+    return useful_issue_info
+
+def prepare_issue(issueUrl):
+    # The issue and its repo's metadata come back from a single GraphQL round-trip
+    fetched_issue_information, repo_information = fetch_issue_with_repo(issueUrl)
     print("Fetched the issue")
     if not fetched_issue_information:
-        return jsonify({"error": "Failed to fetch issue information"}), 400
+        return None
     # Clean the fetched information to get the important parts to it.
-    useful_issue_info = clean_issue_info(fetched_issue_information)
-    return useful_issue_info
+    return store_issue_info(fetched_issue_information, repo_information)
 
-@app.route('/api/getting_started_guide', methods=['POST'])
-def getting_started():
-    issue_info = request.get_json()
+# Every guidebook section has a JSON endpoint that returns all subtask results at once,
+# and a /stream variant that sends each subtask result as a Server-Sent Event as soon as it is done.
+# Identical JSON requests in flight at the same time share one run; streams share the LLM calls.
+
+def speculation_key(issue_info):
+    return (issue_info['repo_author'], issue_info['repo_name'], str(issue_info['issue_number']))
+
+def run_getting_started(issue_info, relay=no_relay):
     owner = issue_info['repo_author']
     repo = issue_info['repo_name']
     issue_number = issue_info['issue_number']
-    issue_files = read_issue_files(owner, repo, issue_number)
-
-    title = issue_files["title"]
-    body = issue_files["body"]
-    repo_description = issue_files["repo_description"]
-    contribution_guidelines = issue_files["contribution_guidelines"]
-
-    # === Subtasks =====
-    results = {}
-    issue_duplicates = detect_duplicates(owner, repo, title)
-    results["issue_duplicates"] = issue_duplicates
-    issue_type = classify_issue(title, body)
-    feature_uniqueness = verify_feature_uniqueness(owner, repo, title, body, issue_type)
-    results["feature_uniqueness"] = feature_uniqueness
-    align_with_project_vision = check_issue_alignment_with_vision(repo_description, title, body, contribution_guidelines, issue_type)
-    results["align_with_project_vision"] = align_with_project_vision
-    tune_contribution_guidelines = understand_relevant_contribution_guidelines(owner, repo, title, body, contribution_guidelines)
-    results["tune_contribution_guidelines"] = tune_contribution_guidelines
-    issue_scope = check_issue_scope(repo_description, title, body, contribution_guidelines, issue_type, issue_number)
-    results["issue_scope"] = issue_scope
+    return record_sections(owner, repo, issue_number, "getting_started", iter_getting_started(owner, repo, issue_number, relay))
+
+def getting_started_sections(issue_info, relay=no_relay):
+    # Picks up the speculative run started by generate_guidebook, even while it is still going
+    speculated = speculator.take(speculation_key(issue_info))
+    sent = set()
+    if speculated is not None:
+        try:
+            for section, result in speculated:
+                sent.add(section)
+                yield section, result
+            return
+        except RuntimeError as e:
+            print(f"{e}, running the rest of the getting-started guide again")
+
+    def relay_unsent(section, fn):
+        # Sections the speculative run already delivered are recomputed (mostly from the LLM cache) but not sent again
+        return fn if section in sent else relay(section, fn)
+
+    for section, result in run_getting_started(issue_info, relay_unsent):
+        if section not in sent:
+            yield section, result
+
+@app.route('/api/getting_started_guide', methods=['POST'])
+def getting_started():
+    issue_info = request.get_json()
+    results = flights.do(request_key("getting_started", issue_info), lambda: dict(getting_started_sections(issue_info)))
     # print(results)
     return jsonify(results)
 
-@app.route('/api/implementation_guide', methods=['POST'])
-def implementation():
+@app.route('/api/getting_started_guide/stream', methods=['POST'])
+def getting_started_stream():
     issue_info = request.get_json()
+    return stream_sections(lambda relay: getting_started_sections(issue_info, relay))
+
+def implementation_sections(issue_info, relay=no_relay):
     print("issue_info", issue_info)
     owner = issue_info['repo_author']
     repo = issue_info['repo_name']
@@ -67,64 +141,34 @@ def implementation():
     pr_description = issue_info.get('pr_description', '')
 
     # Save PR choice to pr_choice.txt
-    pr_choice_path = f"data/{owner}/{repo}/{issue_number}/pr_choice.txt"
-    os.makedirs(os.path.dirname(pr_choice_path), exist_ok=True)
-    with open(pr_choice_path, 'w', encoding='utf-8') as f:
-        f.write(f"PR Title: {pr_title}\nPR Description: {pr_description}")
-
-    issue_files = read_issue_files(owner, repo, issue_number)
-    title = issue_files["title"]
-    body = issue_files["body"]
-    repo_description = issue_files["repo_description"]
-    contribution_guidelines = issue_files["contribution_guidelines"]
-
-    # === Subtasks ===
-    results = {}
-    results["steps"] = generate_steps(
-        owner, repo, title, issue_number, body, repo_description, contribution_guidelines,
-        pr_title, pr_description, suggestion_level
-    )
-    results["tests"] = explain_tests(
-        owner, repo, title, issue_number, body, repo_description, contribution_guidelines,
-        pr_title, pr_description, suggestion_level
-    )
+    write_pr_choice(owner, repo, issue_number, pr_title, pr_description)
+
+    return record_sections(owner, repo, issue_number, "implementation", iter_implementation(owner, repo, issue_number, pr_title, pr_description, suggestion_level, relay))
+
+@app.route('/api/implementation_guide', methods=['POST'])
+def implementation():
+    issue_info = request.get_json()
+    results = flights.do(request_key("implementation", issue_info), lambda: dict(implementation_sections(issue_info)))
     # print(results)
     return jsonify(results)
 
-@app.route('/api/automate_PR_review', methods=['POST'])
-def automate_PR_review():
+@app.route('/api/implementation_guide/stream', methods=['POST'])
+def implementation_stream():
     issue_info = request.get_json()
+    return stream_sections(lambda relay: implementation_sections(issue_info, relay))
+
+def pr_review_sections(issue_info, relay=no_relay):
     owner = issue_info['repo_author']
     repo = issue_info['repo_name']
     issue_number = issue_info['issue_number']
     pr_url = issue_info['pr_url']
 
-    issue_files = read_issue_files(owner, repo, issue_number)
-
-    title = issue_files["title"]
-    body = issue_files["body"]
-    repo_description = issue_files["repo_description"]
-    contribution_guidelines = issue_files["contribution_guidelines"]
-
     # TODO: fetch PR data - especially PR patch and then evaluate technical design alignment
     # https://github.com/jax-ml/jax/pull/31251
     # https://api.github.com/repos/jax-ml/jax/pulls/31251
     pr_number = pr_url.rstrip('/').split('/')[-1]
-    dir_path = os.path.join("data", owner, repo, issue_number)
-    os.makedirs(dir_path, exist_ok=True)
-    file_path = os.path.join(dir_path, "pr_number.txt")
-    with open(file_path, "w") as f:
-        f.write(str(pr_number))
-
-    print(f"PR number {pr_number} written to {file_path}")
+    write_pr_number(owner, repo, issue_number, pr_number)
 
-    # Firstly extract the patch body, then pass it 
-    diff = get_diff(owner, repo, pr_number)
-
-    # === Subtasks ===
-    results = {}
-    results["validate_pr_resolution"] = validate_pr_resolution(owner, repo, issue_number, repo_description, diff)
-    results["enforce_contribution_guidelines"] = enforce_contribution_guidelines(owner, repo, issue_number, contribution_guidelines, diff)
     # All of the following enforcement of contribution guidelines must happen in a single conversation state
         # technical_design_alignment
         # match_project_code_style
@@ -132,11 +176,109 @@ def automate_PR_review():
         # possible_performance_issues
         # high_source_code_quality
         # commit_quality_standards
-    results["clear_pr_description"] = clear_pr_description(owner, repo, issue_number, contribution_guidelines, diff)
-    results["tests_presence"] = tests_presence(owner, repo, issue_number, contribution_guidelines, diff)
+    return record_sections(owner, repo, issue_number, "pr_review", iter_pr_review_sections(owner, repo, issue_number, pr_number, relay))
 
+@app.route('/api/automate_PR_review', methods=['POST'])
+def automate_PR_review():
+    issue_info = request.get_json()
+    results = flights.do(request_key("pr_review", issue_info), lambda: dict(pr_review_sections(issue_info)))
     return jsonify(results)
 
+@app.route('/api/automate_PR_review/stream', methods=['POST'])
+def automate_PR_review_stream():
+    issue_info = request.get_json()
+    return stream_sections(lambda relay: pr_review_sections(issue_info, relay))
+
+# Job mode: every section can also run as a background job. POST .../jobs returns a job id
+# right away, and GET /api/jobs/<job_id> returns the sections finished so far and the job's status.
+# JOB_WORKERS (or e.g. JOB_WORKERS_PR_REVIEW for one type) bounds how many jobs run at once.
+# Jobs left unfinished by a stopped process are resumed when this one serves its first request
+# (or by `flask resume-jobs`); claims with a JOB_LEASE_SECONDS lease keep each job in one process.
+
+JOB_RUNNERS = {
+    "getting_started": getting_started_sections,
+    "implementation": implementation_sections,
+    "pr_review": pr_review_sections,
+}
+jobs = JobQueue(
+    store,
+    JOB_RUNNERS,
+    {kind: int(os.getenv(f"JOB_WORKERS_{kind.upper()}", os.getenv("JOB_WORKERS", 2))) for kind in JOB_RUNNERS},
+    lease=int(os.getenv("JOB_LEASE_SECONDS", 300))
+)
+
+@app.before_request
+def resume_jobs():
+    # Only the first request of the process gets past the check in resume()
+    jobs.resume()
+
+@app.cli.command("resume-jobs")
+def resume_jobs_command():
+    "Resumes unfinished jobs and runs them in this process until they finish"
+    jobs.resume()
+    jobs.shutdown()
+
+def submit_job(kind):
+    job_id = jobs.submit(kind, request.get_json())
+    return jsonify({"job_id": job_id, "status": "queued"}), 202
+
+@app.route('/api/getting_started_guide/jobs', methods=['POST'])
+def getting_started_job():
+    return submit_job("getting_started")
+
+@app.route('/api/implementation_guide/jobs', methods=['POST'])
+def implementation_job():
+    return submit_job("implementation")
+
+@app.route('/api/automate_PR_review/jobs', methods=['POST'])
+def automate_PR_review_job():
+    return submit_job("pr_review")
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    status = jobs.status(job_id)
+    if status is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(status)
+
+# Pre-warms the guidebooks of many issues: {"issueUrls": [...]} or {"repo": "owner/name", "labels": [...]}
+# (optionally "state" and "limit"). Streams one `section` event per issue as it finishes,
+# with the issue URL as the section and {"status", "issue", "getting_started", "progress"} as the result.
+@app.route('/api/generate_guidebooks', methods=['POST'])
+def generate_guidebooks_batch():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({"error": "Expected a JSON object with issueUrls or repo"}), 400
+    issue_urls = body.get("issueUrls") or []
+    if not isinstance(issue_urls, list) or not all(isinstance(url, str) for url in issue_urls):
+        return jsonify({"error": "issueUrls must be a list of issue URLs"}), 400
+    repo = body.get("repo")
+    if repo is not None and not isinstance(repo, str):
+        return jsonify({"error": "repo must be a string of the form owner/name"}), 400
+    labels = body.get("labels", [])
+    if not isinstance(labels, list) or not all(isinstance(label, str) for label in labels):
+        return jsonify({"error": "labels must be a list of label names"}), 400
+    state = body.get("state", "open")
+    if state not in ("open", "closed", "all"):
+        return jsonify({"error": "state must be open, closed or all"}), 400
+    limit = body.get("limit", 100)
+    if isinstance(limit, bool) or not isinstance(limit, int) or not 0 < limit <= BULK_MAX_ISSUES:
+        return jsonify({"error": f"limit must be a number from 1 to {BULK_MAX_ISSUES}"}), 400
+    if len(issue_urls) > BULK_MAX_ISSUES:
+        return jsonify({"error": f"At most {BULK_MAX_ISSUES} issues can be generated at once"}), 400
+    try:
+        issue_urls = resolve_issue_urls(issue_urls, repo, labels, state, limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except requests.exceptions.RequestException as e:
+        # Listing the repo's issues failed: no such repo, or GitHub (or our quota) gave out
+        missing = getattr(e.response, "status_code", None) == 404
+        print(f"Could not list the issues of {repo}: {e}")
+        if missing:
+            return jsonify({"error": f"Repository {repo} not found"}), 404
+        return jsonify({"error": f"Could not list the issues of {repo}: {e}"}), 502
+    return stream_sections(lambda relay: generate_guidebooks(issue_urls))
+
 
 
-# This changes things a little. It is because, now what I want to do is this. Instead of asking the LLM to suggest how to solve the issue in the generate_steps step. I want to ask the user to choose which issue they want to solve in the check_issue_scope. Their choice should then be prepended to the /api/implementation_guide. 
+# This changes things a little. It is because, now what I want to do is this. Instead of asking the LLM to suggest how to solve the issue in the generate_steps step. I want to ask the user to choose which issue they want to solve in the check_issue_scope. Their choice should then be prepended to the /api/implementation_guide.
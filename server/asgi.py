@@ -0,0 +1,238 @@
+import os
+import time
+import asyncio
+from quart import Quart, Response, request, jsonify, g
+from utils.scraping import parse_issue_url
+from utils.io import write_pr_choice, write_pr_number, write_issue_result
+from utils.singleflight import AsyncSingleFlight, request_key
+from utils.speculation import AsyncSpeculator
+from utils.metrics import registry, http_request_seconds, coalesced_calls, set_cache_stats, CONTENT_TYPE
+from utils.tracing import start_trace, write_trace
+from utils.streaming import format_sse
+from utils.guidebook import stream_llm_output
+from utils.aio import (
+    async_github, fetch_issue_with_repo_async, store_issue_info_async, getting_started_async, implementation_async, pr_review_async,
+    iter_getting_started_async, iter_implementation_async, iter_pr_review_async
+)
+
+# asyncio version of api.py, serving the same JSON and /stream endpoints. Run it with an ASGI server:
+#   hypercorn asgi:app
+# Every GitHub and LLM call is awaited, so one process holds many guidebooks in flight
+# instead of tying up a worker thread per request.
+
+app = Quart(__name__)
+
+# Collapses identical requests that arrive while one is already being answered
+flights = AsyncSingleFlight()
+
+# Speculative getting-started guides, as in api.py
+SPECULATIVE_GETTING_STARTED = os.getenv("SPECULATIVE_GETTING_STARTED", "").lower() in ("1", "true", "yes")
+speculator = AsyncSpeculator(
+    max_concurrent=int(os.getenv("SPECULATIVE_MAX_CONCURRENT", 2)),
+    ttl=int(os.getenv("SPECULATIVE_TTL", 600))
+)
+
+def speculation_key(owner, repo, issue_number):
+    return (owner, repo, str(issue_number))
+
+def stream_sections(make_sections):
+    """
+    Same Server-Sent Events as utils.streaming.stream_sections, for an async pipeline.
+    `make_sections(relay)` must return an async iterator of (section, result) pairs;
+    `relay(section, fn)` wraps a coroutine function so the LLM text it generates is sent as it arrives.
+    """
+    events = asyncio.Queue()
+
+    def relay(section, fn):
+        async def relayed(*args, **kwargs):
+            # Every subtask runs as its own asyncio task, so the listener only sees this one's calls
+            with stream_llm_output(lambda text: events.put_nowait(("delta", {"section": section, "text": text}))):
+                return await fn(*args, **kwargs)
+        return relayed
+
+    async def run():
+        try:
+            async for section, result in make_sections(relay):
+                events.put_nowait(("section", {"section": section, "result": result}))
+        except Exception as e:
+            print(f"Error while streaming sections: {e}")
+            events.put_nowait(("error", {"error": str(e)}))
+        events.put_nowait(("done", {}))
+
+    task = asyncio.ensure_future(run())
+
+    async def generate():
+        try:
+            while True:
+                event, data = await events.get()
+                yield format_sse(event, data)
+                if event == "done":
+                    break
+        finally:
+            # The client went away: stop working on its sections
+            task.cancel()
+
+    return Response(generate(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+async def record_sections(owner, repo, issue_number, guide, sections):
+    "Same as utils.pipelines.record_sections, for an async iterator"
+    results = {}
+    async for section, result in sections:
+        results[section] = result
+        yield section, result
+    await asyncio.to_thread(write_issue_result, owner, repo, issue_number, guide, results)
+
+@app.after_request
+async def add_cors_headers(response):
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    response.headers["Access-Control-Allow-Headers"] = "Content-Type"
+    response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+    return response
+
+@app.before_request
+async def start_timer():
+    g.started = time.monotonic()
+    g.trace = start_trace(f"{request.method} {request.path}")
+
+@app.after_request
+async def record_request_time(response):
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    http_request_seconds.observe(time.monotonic() - g.started, endpoint=endpoint, method=request.method, status=response.status_code)
+    # Where the time went, for the browser's devtools
+    response.headers["Server-Timing"] = g.trace.server_timing()
+    response.headers["Timing-Allow-Origin"] = "*"
+    await asyncio.to_thread(write_trace, g.trace)
+    return response
+
+@registry.collector
+def collect_asgi_metrics():
+    coalesced_calls.set_total(flights.shared, flight="requests")
+    set_cache_stats("speculative_getting_started", speculator.hits, speculator.misses)
+
+@app.after_serving
+async def close_github_client():
+    await async_github.aclose()
+
+@app.route('/metrics')
+async def metrics():
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+@app.route('/api/time')
+async def get_current_time():
+    return {'time': time.time()}
+
+@app.route('/api/generate_guidebook', methods=['POST'])
+async def generate_guidebook():
+    issueUrl = await request.get_json()
+    # Everyone who pastes the same issue while it is being prepared shares that run
+    key = request_key("generate_guidebook", parse_issue_url(issueUrl["issueUrl"]) or issueUrl)
+    useful_issue_info = await flights.do(key, lambda: prepare_issue(issueUrl["issueUrl"]))
+    if not useful_issue_info:
+        return jsonify({"error": "Failed to fetch issue information"}), 400
+    if SPECULATIVE_GETTING_STARTED:
+        owner, repo, issue_number = useful_issue_info["repo_author"], useful_issue_info["repo_name"], useful_issue_info["issue_number"]
+        speculator.start(speculation_key(owner, repo, issue_number), lambda: getting_started_async(owner, repo, issue_number))
+    return useful_issue_info
+
+async def prepare_issue(issueUrl):
+    fetched_issue_information, repo_information = await fetch_issue_with_repo_async(issueUrl)
+    print("Fetched the issue")
+    if not fetched_issue_information:
+        return None
+    return await store_issue_info_async(fetched_issue_information, repo_information)
+
+@app.route('/api/getting_started_guide', methods=['POST'])
+async def getting_started():
+    issue_info = await request.get_json()
+    owner = issue_info['repo_author']
+    repo = issue_info['repo_name']
+    issue_number = issue_info['issue_number']
+    # Picks up the speculative run started by generate_guidebook, even while it is still going
+    results = await speculator.take(speculation_key(owner, repo, issue_number))
+    if results is None:
+        results = await flights.do(request_key("getting_started", issue_info), lambda: getting_started_async(owner, repo, issue_number))
+    await asyncio.to_thread(write_issue_result, owner, repo, issue_number, "getting_started", results)
+    return jsonify(results)
+
+@app.route('/api/getting_started_guide/stream', methods=['POST'])
+async def getting_started_stream():
+    issue_info = await request.get_json()
+    owner = issue_info['repo_author']
+    repo = issue_info['repo_name']
+    issue_number = issue_info['issue_number']
+
+    async def sections(relay):
+        results = await speculator.take(speculation_key(owner, repo, issue_number))
+        if results is not None:
+            for section, result in results.items():
+                yield section, result
+            return
+        async for section, result in iter_getting_started_async(owner, repo, issue_number, relay):
+            yield section, result
+
+    return stream_sections(lambda relay: record_sections(owner, repo, issue_number, "getting_started", sections(relay)))
+
+@app.route('/api/implementation_guide', methods=['POST'])
+async def implementation():
+    issue_info = await request.get_json()
+    owner = issue_info['repo_author']
+    repo = issue_info['repo_name']
+    issue_number = issue_info['issue_number']
+    suggestion_level = issue_info.get('suggestion_level', 3)
+    pr_title = issue_info.get('pr_title', '')
+    pr_description = issue_info.get('pr_description', '')
+
+    await asyncio.to_thread(write_pr_choice, owner, repo, issue_number, pr_title, pr_description)
+
+    results = await flights.do(
+        request_key("implementation", issue_info),
+        lambda: implementation_async(owner, repo, issue_number, pr_title, pr_description, suggestion_level)
+    )
+    await asyncio.to_thread(write_issue_result, owner, repo, issue_number, "implementation", results)
+    return jsonify(results)
+
+@app.route('/api/automate_PR_review', methods=['POST'])
+async def automate_PR_review():
+    issue_info = await request.get_json()
+    owner = issue_info['repo_author']
+    repo = issue_info['repo_name']
+    issue_number = issue_info['issue_number']
+    pr_number = issue_info['pr_url'].rstrip('/').split('/')[-1]
+
+    await asyncio.to_thread(write_pr_number, owner, repo, issue_number, pr_number)
+
+    results = await flights.do(request_key("pr_review", issue_info), lambda: pr_review_async(owner, repo, issue_number, pr_number))
+    await asyncio.to_thread(write_issue_result, owner, repo, issue_number, "pr_review", results)
+    return jsonify(results)
+
+@app.route('/api/implementation_guide/stream', methods=['POST'])
+async def implementation_stream():
+    issue_info = await request.get_json()
+    owner = issue_info['repo_author']
+    repo = issue_info['repo_name']
+    issue_number = issue_info['issue_number']
+    suggestion_level = issue_info.get('suggestion_level', 3)
+    pr_title = issue_info.get('pr_title', '')
+    pr_description = issue_info.get('pr_description', '')
+
+    await asyncio.to_thread(write_pr_choice, owner, repo, issue_number, pr_title, pr_description)
+    return stream_sections(lambda relay: record_sections(
+        owner, repo, issue_number, "implementation",
+        iter_implementation_async(owner, repo, issue_number, pr_title, pr_description, suggestion_level, relay)
+    ))
+
+@app.route('/api/automate_PR_review/stream', methods=['POST'])
+async def automate_PR_review_stream():
+    issue_info = await request.get_json()
+    owner = issue_info['repo_author']
+    repo = issue_info['repo_name']
+    issue_number = issue_info['issue_number']
+    pr_number = issue_info['pr_url'].rstrip('/').split('/')[-1]
+
+    await asyncio.to_thread(write_pr_number, owner, repo, issue_number, pr_number)
+    return stream_sections(lambda relay: record_sections(
+        owner, repo, issue_number, "pr_review", iter_pr_review_async(owner, repo, issue_number, pr_number, relay=relay)
+    ))
@@ -0,0 +1,447 @@
+import copy
+import time
+import asyncio
+from collections import OrderedDict
+import httpx
+from utils.scraping import (
+    github, headers, convert_issue_http_to_api_url, parse_issue_url, build_issues_query, issue_from_graphql, store_issue_info, get_diff, detect_duplicates,
+    build_linked_pr_query, linked_pr_statuses_from_graphql, duplicate_search_params, duplicate_results,
+    DUPLICATE_INDEX_DISABLED, local_duplicates, PR_DIFF_MAX_BYTES,
+    guideline_flights, gather_contribution_guidelines, guideline_probe_waves, guideline_file_content, pick_guideline_file, GUIDELINES_CRAWL_BUDGET
+)
+from utils.diffs import parse_diff, render_diff, cut_at_line
+from utils.github import GRAPHQL_URL
+from utils.ratelimit import RateLimitExceeded, resource_for_url
+from utils.metrics import registry, set_cache_stats, record_github_response
+from utils.tracing import span
+from utils.guidebook import llm_listener
+from utils.io import read_issue_files, read_repo_guidelines, read_pr_choice, read_closed_issue_statuses, write_closed_issue_statuses, read_pr_diff, write_pr_diff
+from utils.pipelines import GETTING_STARTED_BATCHED, getting_started_tasks, implementation_tasks, relay_tasks, no_relay
+from utils.review import REVIEW_CHECK_TIMEOUT, REVIEW_SHARD_WORKERS, pr_review_checks, review_shards, diff_shards, review_timeout, missing_pr_choice_results, partial_review_result
+from utils.tasks import iter_task_graph_async
+
+# asyncio versions of the GitHub fetches and guidebook pipelines, used by asgi.py.
+# Every subtask runs as a coroutine on the event loop, so one process can keep many
+# guidebooks in flight while they wait on GitHub and the model.
+
+class AsyncGitHubClient:
+    """
+    asyncio counterpart of GitHubClient: keep-alive connection pool, ETag / Last-Modified
+    revalidation, and the same RateLimitScheduler, so both code paths draw from one budget.
+    Waiting for rate-limit budget sleeps the coroutine instead of blocking a thread.
+    """
+
+    def __init__(self, headers, scheduler=None, max_wait=60, pool_size=20, max_cached=512):
+        self.headers = dict(headers)
+        self.scheduler = scheduler
+        self.max_wait = max_wait
+        self.pool_size = pool_size
+        self.max_cached = max_cached
+        # (url, params, accept) -> last 200 response carrying a validator
+        self._cache = OrderedDict()
+        self._client = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def client(self):
+        # Created on first use, inside the running event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _cache_key(self, url, params, headers):
+        accept = (headers or {}).get("Accept", self.headers.get("Accept"))
+        return (url, tuple(sorted((params or {}).items())), accept)
+
+    async def _acquire(self, resource, max_wait):
+        deadline = time.monotonic() + max_wait
+        while True:
+            token, delay = self.scheduler.try_acquire(resource)
+            if token:
+                return token
+            if time.monotonic() + delay > deadline:
+                raise RateLimitExceeded(resource, delay)
+            await asyncio.sleep(delay)
+
+    async def _request(self, method, url, **kwargs):
+        started = time.monotonic()
+        with span("github", method=method, url=url) as attributes:
+            response = await self.client.request(method, url, **kwargs)
+            attributes["status"] = response.status_code
+        record_github_response(url, response, time.monotonic() - started)
+        return response
+
+    async def _send(self, url, params, headers, timeout, max_wait, method="GET", json=None):
+        if self.scheduler is None:
+            return await self._request(method, url, params=params, headers=headers, json=json, timeout=timeout)
+
+        resource = resource_for_url(url)
+        # One retry per token, in case a request races another one for the last of a budget
+        for _ in range(len(self.scheduler.tokens) + 1):
+            token = await self._acquire(resource, max_wait)
+            response = await self._request(method, url, params=params, headers={**headers, "Authorization": f"Bearer {token}"}, json=json, timeout=timeout)
+            self.scheduler.update(token, resource, response)
+            if not self.scheduler.is_rate_limited(response) or max_wait <= 0:
+                break
+        return response
+
+    async def get_capped(self, url, max_bytes, headers=None, timeout=10, max_wait=None):
+        "Same as GitHubClient.get_capped"
+        max_wait = self.max_wait if max_wait is None else max_wait
+        headers = dict(headers or {})
+        token = None
+        if self.scheduler is not None:
+            token = await self._acquire(resource_for_url(url), max_wait)
+            headers["Authorization"] = f"Bearer {token}"
+        started = time.monotonic()
+        with span("github", method="GET", url=url) as attributes:
+            async with self.client.stream("GET", url, headers=headers, timeout=timeout) as response:
+                attributes["status"] = response.status_code
+                record_github_response(url, response, time.monotonic() - started)
+                if token is not None:
+                    self.scheduler.update(token, resource_for_url(url), response)
+                response.raise_for_status()
+                body = bytearray()
+                async for chunk in response.aiter_bytes():
+                    body += chunk
+                    if len(body) > max_bytes:
+                        return bytes(body[:max_bytes]), True
+                return bytes(body), False
+
+    async def graphql(self, query, variables=None, timeout=10, max_wait=None):
+        "Same as GitHubClient.graphql"
+        max_wait = self.max_wait if max_wait is None else max_wait
+        response = await self._send(GRAPHQL_URL, None, {}, timeout, max_wait, method="POST", json={"query": query, "variables": variables or {}})
+        response.raise_for_status()
+        payload = response.json()
+        if payload.get("errors"):
+            print(f"GitHub GraphQL errors: {payload['errors']}")
+            if not payload.get("data"):
+                raise ValueError(payload["errors"][0].get("message", "GraphQL query failed"))
+        return payload["data"]
+
+    async def get(self, url, params=None, headers=None, timeout=10, max_wait=None):
+        "Same as GitHubClient.get, returning an httpx.Response"
+        max_wait = self.max_wait if max_wait is None else max_wait
+        key = self._cache_key(url, params, headers)
+        cached = self._cache.get(key)
+
+        request_headers = dict(headers or {})
+        if cached is not None:
+            if cached.headers.get("ETag"):
+                request_headers["If-None-Match"] = cached.headers["ETag"]
+            if cached.headers.get("Last-Modified"):
+                request_headers["If-Modified-Since"] = cached.headers["Last-Modified"]
+
+        response = await self._send(url, params, request_headers, timeout, max_wait)
+
+        if response.status_code == 304 and cached is not None:
+            self.hits += 1
+            # Serve the stored body, but with the fresh rate-limit headers, on a copy of the
+            # stored response so callers still holding it keep the headers they were given
+            fresh = copy.copy(cached)
+            fresh.headers = httpx.Headers(cached.headers)
+            fresh.headers.update({k: v for k, v in response.headers.items() if k.lower().startswith("x-ratelimit")})
+            self._cache.move_to_end(key)
+            return fresh
+
+        self.misses += 1
+        if response.status_code == 200 and (response.headers.get("ETag") or response.headers.get("Last-Modified")):
+            self._cache[key] = response
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+
+        return response
+
+async_github = AsyncGitHubClient(headers, scheduler=github.scheduler, max_wait=github.max_wait)
+
+@registry.collector
+def collect_async_github_metrics():
+    set_cache_stats("github_etag_async", async_github.hits, async_github.misses)
+
+async def fetch_issue_async(issueUrl):
+    issueApiUrl = convert_issue_http_to_api_url(issueUrl)
+    try:
+        response = await async_github.get(issueApiUrl, timeout=10)
+        response.raise_for_status()
+        return response.json()
+    except (httpx.HTTPError, RateLimitExceeded) as e:
+        print(f"Error fetching {issueApiUrl}: {e}")
+        return None
+
+async def fetch_repo_async(repo_api_url):
+    try:
+        response = await async_github.get(repo_api_url, timeout=10)
+        response.raise_for_status()
+        return response.json()
+    except (httpx.HTTPError, RateLimitExceeded) as e:
+        print(f"Error fetching {repo_api_url}: {e}")
+        return None
+
+async def fetch_issues_bulk_async(issueUrls):
+    "Same as fetch_issues_bulk"
+    parsed = [parse_issue_url(url) for url in issueUrls]
+    issues = [p for p in parsed if p]
+    if not issues:
+        return [None] * len(issueUrls)
+
+    query, variables = build_issues_query(issues)
+    try:
+        data = await async_github.graphql(query, variables)
+    except (httpx.HTTPError, RateLimitExceeded, ValueError) as e:
+        print(f"Error fetching issues over GraphQL: {e}")
+        return [None] * len(issueUrls)
+
+    fetched = iter(issue_from_graphql(owner, repo, data.get(f"i{i}")) for i, (owner, repo, _) in enumerate(issues))
+    return [next(fetched) if p else None for p in parsed]
+
+async def fetch_issue_with_repo_async(issueUrl):
+    "Same as fetch_issue_with_repo"
+    fetched = (await fetch_issues_bulk_async([issueUrl]))[0]
+    if fetched is not None:
+        return fetched
+    issue_data = await fetch_issue_async(issueUrl)
+    if not issue_data:
+        return None, None
+    return issue_data, await fetch_repo_async(issue_data["repository_url"])
+
+async def fetch_guideline_file_async(owner, repo, path):
+    "Same as fetch_guideline_file"
+    r = await async_github.get(f"https://api.github.com/repos/{owner}/{repo}/contents/{path}", timeout=10)
+    if r.status_code == 404:
+        return None, None
+    r.raise_for_status()
+    return guideline_file_content(r.json())
+
+async def probe_guideline_files_async(owner, repo, cached_sources, keep_cached):
+    "Same as probe_guideline_files, with every wave's probes awaited together under the crawl budget"
+    async def probe():
+        uncertain = False
+        for wave in guideline_probe_waves(cached_sources):
+            outcomes = await asyncio.gather(*(fetch_guideline_file_async(owner, repo, path) for path in wave), return_exceptions=True)
+            found, failed = pick_guideline_file(owner, repo, wave, outcomes)
+            uncertain = uncertain or failed
+            if found:
+                path, content, sha = found
+                return {path: sha}, content, uncertain
+            if uncertain and keep_cached:
+                break
+        return {}, None, uncertain
+
+    try:
+        return await asyncio.wait_for(probe(), timeout=GUIDELINES_CRAWL_BUDGET)
+    except asyncio.TimeoutError:
+        print(f"Probing {owner}/{repo}'s guideline files exceeded the crawl budget")
+        return {}, None, True
+
+async def store_issue_info_async(issue_data, repo_data):
+    if not issue_data or not repo_data:
+        return None
+    owner, repo = issue_data["repository_url"].rstrip("/").split("/")[-2:]
+    # The guideline files are probed on the event loop. Only when they changed does the rest of
+    # the crawl (linked pages, and the LLM calls that structure the text) go to a thread.
+    cached_guidelines, cached_sources = await asyncio.to_thread(read_repo_guidelines, owner, repo)
+    probed = await probe_guideline_files_async(owner, repo, cached_sources, cached_guidelines is not None)
+    sources, _, uncertain = probed
+    if cached_guidelines is not None and (cached_sources == sources or uncertain):
+        guidelines = cached_guidelines
+    else:
+        guidelines = await asyncio.to_thread(
+            guideline_flights.do, (owner, repo),
+            lambda: gather_contribution_guidelines(owner, repo, repo_data["description"], probed=probed)
+        )
+    return await asyncio.to_thread(store_issue_info, issue_data, repo_data, guidelines)
+
+async def get_pr_diff_async(owner, repo, pr_number):
+    "Same as get_pr_diff"
+    try:
+        response = await async_github.get(f"https://api.github.com/repos/{owner}/{repo}/pulls/{pr_number}", timeout=10)
+        response.raise_for_status()
+        head_sha = response.json()["head"]["sha"]
+        cached = await asyncio.to_thread(read_pr_diff, owner, repo, pr_number, head_sha)
+        if cached is not None:
+            files, truncated = cached
+            return {"head_sha": head_sha, "files": files, "truncated": truncated}
+
+        diff_url = f"https://api.github.com/repos/{owner}/{repo}/pulls/{pr_number}"
+        body, truncated = await async_github.get_capped(diff_url, PR_DIFF_MAX_BYTES, headers={"Accept": "application/vnd.github.diff"}, timeout=30)
+    except (httpx.HTTPError, RateLimitExceeded) as e:
+        print(f"Error fetching the diff of {owner}/{repo}#{pr_number}: {e}")
+        return None
+
+    if truncated:
+        print(f"Diff of {owner}/{repo}#{pr_number} is larger than {PR_DIFF_MAX_BYTES} bytes, reviewing the first part only")
+        body = cut_at_line(body)
+    files = parse_diff(body.decode("utf-8", errors="replace"))
+    await asyncio.to_thread(write_pr_diff, owner, repo, pr_number, head_sha, files, truncated)
+    return {"head_sha": head_sha, "files": files, "truncated": truncated}
+
+async def get_diff_async(owner, repo, pr_number):
+    "Same as get_diff"
+    pr_diff = await get_pr_diff_async(owner, repo, pr_number)
+    if pr_diff is None:
+        return None
+    return render_diff(pr_diff["files"])
+
+async def closed_issue_statuses_async(owner, repo, issue_numbers):
+    "Same as closed_issue_statuses"
+    statuses = await asyncio.to_thread(read_closed_issue_statuses, owner, repo, issue_numbers)
+    missing = [number for number in issue_numbers if number not in statuses]
+    if missing:
+        try:
+            data = await async_github.graphql(build_linked_pr_query(missing), {"owner": owner, "repo": repo})
+            resolved = linked_pr_statuses_from_graphql(missing, data)
+            await asyncio.to_thread(write_closed_issue_statuses, owner, repo, resolved)
+            statuses.update(resolved)
+        except (httpx.HTTPError, RateLimitExceeded, ValueError) as e:
+            print(f"Error resolving linked pull requests: {e}")
+    return {number: statuses.get(number, "closed") for number in issue_numbers}
+
+async def detect_duplicates_async(owner, repo, issue_title, issue_number=None):
+    "Same as detect_duplicates"
+    items = None
+    if not DUPLICATE_INDEX_DISABLED:
+        # Queries are answered in memory; only the occasional index refresh waits on GitHub
+        items = await asyncio.to_thread(local_duplicates, owner, repo, issue_title, issue_number)
+    try:
+        if items is None:
+            search_url = "https://api.github.com/search/issues"
+            params = duplicate_search_params(owner, repo, issue_title)
+            response = await async_github.get(search_url, params=params, timeout=10)
+            response.raise_for_status()
+            items = response.json().get("items", [])
+        closed = [item["number"] for item in items if item["state"] == "closed"]
+        return duplicate_results(items, await closed_issue_statuses_async(owner, repo, closed))
+    except (httpx.HTTPError, RateLimitExceeded) as e:
+        print(f"Error searching for duplicates: {e}")
+        return []
+
+async def review_shards_async(check, shard_args, merge, merge_args=(), slots=None):
+    "Same as review_shards, with the shards reviewed as concurrent coroutines, at most `slots` (an asyncio.Semaphore) at once"
+    slots = slots or asyncio.Semaphore(REVIEW_SHARD_WORKERS)
+
+    async def review(args):
+        # Each shard is its own task with its own context, so only the merge streams to the listener
+        llm_listener.set(None)
+        async with slots:
+            return await call_async(check, *args)
+
+    findings = await asyncio.gather(*(review(args) for args in shard_args))
+    return await call_async(merge, list(findings), *merge_args)
+
+# Blocking functions that have a native coroutine version
+ASYNC_VERSIONS = {
+    get_diff: get_diff_async,
+    detect_duplicates: detect_duplicates_async,
+    review_shards: review_shards_async,
+}
+
+async def call_async(fn, *args):
+    """
+    Runs a pipeline subtask as a coroutine: GitHub fetches use their async version,
+    guidebook functions are driven with call_llm_async, anything else goes to a thread.
+    """
+    if fn in ASYNC_VERSIONS:
+        return await ASYNC_VERSIONS[fn](*args)
+    if hasattr(fn, "run_async"):
+        return await fn.run_async(*args)
+    return await asyncio.to_thread(fn, *args)
+
+async def iter_getting_started_async(owner, repo, issue_number, relay=no_relay):
+    "Same as iter_getting_started, as an async iterator; `relay` wraps coroutine functions"
+    issue_files = await asyncio.to_thread(read_issue_files, owner, repo, issue_number)
+
+    if GETTING_STARTED_BATCHED:
+        tasks = getting_started_tasks(owner, repo, issue_number, issue_files, call=call_async, batched=True)
+        checklist = None
+        async for section, result in iter_task_graph_async(tasks):
+            if section == "checklist":
+                checklist = result
+            else:
+                yield section, result
+        if checklist is not None:
+            for section, result in checklist.items():
+                if section != "issue_type":
+                    yield section, result
+            return
+        print("Could not parse the batched checklist, falling back to one call per section")
+
+    tasks = getting_started_tasks(owner, repo, issue_number, issue_files, call=call_async)
+    if GETTING_STARTED_BATCHED:
+        # Duplicates were already sent above
+        del tasks["issue_duplicates"]
+    async for section, result in iter_task_graph_async(relay_tasks(tasks, relay)):
+        if section != "issue_type":
+            yield section, result
+
+async def getting_started_async(owner, repo, issue_number):
+    return {section: result async for section, result in iter_getting_started_async(owner, repo, issue_number)}
+
+async def iter_implementation_async(owner, repo, issue_number, pr_title, pr_description, suggestion_level, relay=no_relay):
+    "Same as iter_implementation, as an async iterator"
+    issue_files = await asyncio.to_thread(read_issue_files, owner, repo, issue_number)
+    tasks = implementation_tasks(owner, repo, issue_number, issue_files, pr_title, pr_description, suggestion_level, call=call_async)
+    async for section, result in iter_task_graph_async(relay_tasks(tasks, relay)):
+        yield section, result
+
+async def implementation_async(owner, repo, issue_number, pr_title, pr_description, suggestion_level):
+    return {
+        section: result
+        async for section, result in iter_implementation_async(owner, repo, issue_number, pr_title, pr_description, suggestion_level)
+    }
+
+async def iter_pr_review_async(owner, repo, issue_number, pr_number, timeout=REVIEW_CHECK_TIMEOUT, relay=no_relay):
+    """
+    Same as iter_pr_review_sections, as an async iterator: the four checks run as coroutines
+    under one deadline and are yielded as they finish
+    """
+    issue_files = await asyncio.to_thread(read_issue_files, owner, repo, issue_number)
+    pr_choice_text = await asyncio.to_thread(read_pr_choice, owner, repo, issue_number)
+    if pr_choice_text is None:
+        for name, result in missing_pr_choice_results().items():
+            yield name, result
+        return
+
+    pr_diff = await get_pr_diff_async(owner, repo, pr_number)
+    diff_files = pr_diff["files"] if pr_diff else None
+    diff = render_diff(diff_files) if pr_diff else None
+    shards = diff_shards(diff, diff_files)
+    timeout = review_timeout(shards, timeout)
+    checks = pr_review_checks(
+        owner, repo, issue_number, issue_files["repo_description"], issue_files["contribution_guidelines"],
+        diff, pr_choice_text, call=call_async, diff_files=diff_files, shards=shards, slots=asyncio.Semaphore(REVIEW_SHARD_WORKERS)
+    )
+    futures = {asyncio.ensure_future(relay(name, check)()): name for name, check in checks.items()}
+    deadline = time.monotonic() + timeout
+    try:
+        while futures:
+            done, _ = await asyncio.wait(futures, timeout=max(0, deadline - time.monotonic()), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                name = futures.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Review check {name} failed: {e}")
+                    result = partial_review_result(name, "failed")
+                yield name, result
+        for name in futures.values():
+            print(f"Review check {name} timed out after {timeout}s")
+            yield name, partial_review_result(name, "timed out")
+    finally:
+        for future in futures:
+            future.cancel()
+
+async def pr_review_async(owner, repo, issue_number, pr_number, timeout=REVIEW_CHECK_TIMEOUT):
+    return {name: result async for name, result in iter_pr_review_async(owner, repo, issue_number, pr_number, timeout)}
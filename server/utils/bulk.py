@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import argparse
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.scraping import fetch_issues_bulk, fetch_issue_with_repo, list_issue_urls, gather_contribution_guidelines, guideline_flights, store_issue_info
+from utils.pipelines import iter_getting_started, record_sections
+
+# Pre-warms guidebooks for many issues at once: every issue is fetched, its files are
+# written and its getting-started guide is generated, BULK_WORKERS issues at a time.
+# Contribution guidelines are gathered once per repo, before any of its issues start.
+BULK_WORKERS = int(os.getenv("BULK_WORKERS", 4))
+# Issues fetched per GraphQL query
+BULK_FETCH_SIZE = int(os.getenv("BULK_FETCH_SIZE", 20))
+# Most issues one POST /api/generate_guidebooks may ask for
+BULK_MAX_ISSUES = int(os.getenv("BULK_MAX_ISSUES", 200))
+
+def resolve_issue_urls(issue_urls=None, repo=None, labels=(), state="open", limit=100):
+    "The issue URLs to work on: the given list, or the issues of `repo` ('owner/name') with all of `labels`"
+    if issue_urls:
+        return list(dict.fromkeys(issue_urls))
+    if not repo or "/" not in repo:
+        raise ValueError("Either issue URLs or a repo in the form owner/name is required")
+    owner, name = repo.split("/", 1)
+    return list_issue_urls(owner, name, labels=labels, state=state, limit=limit)
+
+def fetch_issues(issue_urls):
+    "(issue_data, repo_data) or None per URL, in GraphQL batches of BULK_FETCH_SIZE"
+    fetched = []
+    for start in range(0, len(issue_urls), BULK_FETCH_SIZE):
+        fetched += fetch_issues_bulk(issue_urls[start:start + BULK_FETCH_SIZE])
+    # URLs the GraphQL batch could not resolve get one more try over REST
+    return [pair if pair is not None else fetch_issue_with_repo(url) for url, pair in zip(issue_urls, fetched)]
+
+def repo_of(issue_data):
+    "(owner, repo) of a fetched issue"
+    owner, repo = issue_data["repository_url"].rstrip("/").split("/")[-2:]
+    return owner, repo
+
+def generate_guidebooks(issue_urls, max_workers=BULK_WORKERS):
+    """
+    Prepares every issue and generates its getting-started guide.
+    Yields (issue_url, result) as each issue finishes, where result is
+    {"status": "done", "issue": ..., "getting_started": {...}, "progress": "n/total"}
+    or {"status": "failed", "error": ..., "progress": ...}.
+    """
+    total = len(issue_urls)
+    finished = 0
+
+    def report(result):
+        nonlocal finished
+        finished += 1
+        result["progress"] = f"{finished}/{total}"
+        return result
+
+    fetched = dict(zip(issue_urls, fetch_issues(issue_urls)))
+    for url in issue_urls:
+        if fetched[url] is None or None in fetched[url]:
+            del fetched[url]
+            yield url, report({"status": "failed", "error": "Failed to fetch issue information"})
+
+    # Repo-level work happens once per repo, however many of its issues are in the batch
+    repos = {}
+    for issue_data, repo_data in fetched.values():
+        repos.setdefault(repo_of(issue_data), repo_data["description"])
+
+    def gather(owner, repo, description):
+        return guideline_flights.do((owner, repo), lambda: gather_contribution_guidelines(owner, repo, description))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        guideline_futures = {
+            key: executor.submit(gather, key[0], key[1], description)
+            for key, description in repos.items()
+        }
+        guidelines = {}
+        for key, future in guideline_futures.items():
+            try:
+                guidelines[key] = future.result()
+            except Exception as e:
+                print(f"Could not gather contribution guidelines for {key[0]}/{key[1]}: {e}")
+
+        def prepare(issue_data, repo_data):
+            owner, repo = repo_of(issue_data)
+            if (owner, repo) not in guidelines:
+                raise RuntimeError(f"No contribution guidelines for {owner}/{repo}")
+            issue = store_issue_info(issue_data, repo_data, guidelines[(owner, repo)])
+            sections = record_sections(
+                issue["repo_author"], issue["repo_name"], issue["issue_number"], "getting_started",
+                iter_getting_started(issue["repo_author"], issue["repo_name"], issue["issue_number"])
+            )
+            return {"status": "done", "issue": issue, "getting_started": dict(sections)}
+
+        futures = {executor.submit(prepare, *pair): url for url, pair in fetched.items()}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Failed to generate the guidebook for {url}: {e}")
+                result = {"status": "failed", "error": str(e)}
+            yield url, report(result)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the guidebooks of many issues at once")
+    parser.add_argument("issue_urls", nargs="*", help="GitHub issue URLs")
+    parser.add_argument("--repo", help="owner/name of a repo whose issues to take instead of URLs")
+    parser.add_argument("--label", action="append", default=[], help="only issues with this label (repeatable)")
+    parser.add_argument("--state", default="open", choices=["open", "closed", "all"])
+    parser.add_argument("--limit", type=int, default=100, help="at most this many issues of --repo")
+    parser.add_argument("--workers", type=int, default=BULK_WORKERS, help="issues worked on at once")
+    args = parser.parse_args(argv)
+
+    try:
+        issue_urls = resolve_issue_urls(args.issue_urls, args.repo, args.label, args.state, args.limit)
+    except ValueError as e:
+        parser.error(str(e))
+    except requests.exceptions.RequestException as e:
+        print(f"Could not list the issues of {args.repo}: {e}", file=sys.stderr)
+        return 1
+    print(f"Generating {len(issue_urls)} guidebooks", file=sys.stderr)
+
+    failed = 0
+    for url, result in generate_guidebooks(issue_urls, max_workers=args.workers):
+        failed += result["status"] == "failed"
+        # One JSON line per issue on stdout, progress on stderr
+        print(json.dumps({"issue_url": url, **result}), flush=True)
+        print(f"[{result['progress']}] {result['status']}: {url}", file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
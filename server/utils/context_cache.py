@@ -0,0 +1,137 @@
+import time
+import hashlib
+import datetime
+import threading
+from utils.singleflight import SingleFlight
+
+# Replaces the inlined guidelines in a prompt once they live in the cached context
+CONTEXT_REFERENCE = "[The repository's contribution guidelines are provided in the cached context.]"
+
+class GeminiContextCacheBackend:
+    """
+    Stores a large shared prompt prefix with Gemini's context caching, so the
+    model does not re-read it on every call.
+    Any object with the same three methods can be used instead (see StubContextCacheBackend).
+    """
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def create(self, text, ttl):
+        "Registers `text` with the provider and returns a handle to it"
+        from google.generativeai import caching
+        return caching.CachedContent.create(
+            model=self.model_name,
+            display_name="repo-contribution-guidelines",
+            system_instruction="You are helping contributors of an open-source repository. Its contribution guidelines follow.",
+            contents=[text],
+            ttl=datetime.timedelta(seconds=ttl)
+        )
+
+    def model_for(self, handle):
+        "A model exposing generate_content(prompt, generation_config=None, stream=False) that sees the cached text"
+        import google.generativeai as genai
+        return genai.GenerativeModel.from_cached_content(cached_content=handle)
+
+    def delete(self, handle):
+        handle.delete()
+
+class StubContextCacheBackend:
+    """
+    Local stand-in for tests: `generate(prompt, generation_config, stream)` is called with the
+    cached text prepended to the prompt, the way the provider would see it.
+    """
+
+    def __init__(self, generate):
+        self.generate = generate
+        self.created = []
+
+    def create(self, text, ttl):
+        self.created.append(text)
+        return text
+
+    def model_for(self, handle):
+        backend = self
+
+        class StubModel:
+            def generate_content(self, prompt, generation_config=None, stream=False):
+                return backend.generate(f"{handle}\n\n{prompt}", generation_config, stream)
+
+            async def generate_content_async(self, prompt, generation_config=None, stream=False):
+                return self.generate_content(prompt, generation_config, stream)
+
+        return StubModel()
+
+    def delete(self, handle):
+        pass
+
+class RepoContextCache:
+    """
+    Registers each repo's contribution guidelines with the backend once per
+    guidelines version (keyed by a hash of the text) and hands out models that
+    already have them in context. Texts that are too small to be worth caching,
+    or that the backend refuses, are remembered so callers fall back to inlining them.
+    Entries are re-registered a little before they expire; the contents they replace,
+    and those nobody asked for again before they expired, are deleted from the backend.
+    """
+
+    def __init__(self, backend, ttl=3600, min_chars=16384):
+        self.backend = backend
+        self.ttl = ttl
+        self.min_chars = min_chars
+        # sha256 of the text -> (handle or None, expires_at)
+        self._entries = {}
+        self._lock = threading.Lock()
+        # Only one registration per text at a time; other texts are not held up by it
+        self._registrations = SingleFlight()
+
+    def model_for(self, text):
+        "Returns a model with `text` already in context, or None if the prompt should inline it"
+        if not text or len(text) < self.min_chars:
+            return None
+
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        handle = self._fresh_handle(key)
+        if handle is _STALE:
+            handle = self._registrations.do(key, lambda: self._register(key, text))
+        if handle is None:
+            return None
+        return self.backend.model_for(handle)
+
+    def _fresh_handle(self, key):
+        # Re-register a little before the provider drops the cached content
+        with self._lock:
+            handle, expires_at = self._entries.get(key, (None, 0))
+        return handle if expires_at - 60 > time.time() else _STALE
+
+    def _register(self, key, text):
+        # Someone may have registered it between our check and getting to run
+        handle = self._fresh_handle(key)
+        if handle is not _STALE:
+            return handle
+        try:
+            handle = self.backend.create(text, self.ttl)
+        except Exception as e:
+            print(f"Could not cache repo context, inlining it instead: {e}")
+            handle = None
+
+        now = time.time()
+        with self._lock:
+            replaced, _ = self._entries.get(key, (None, 0))
+            self._entries[key] = (handle, now + self.ttl)
+            expired = [k for k, (_, expires_at) in self._entries.items() if expires_at <= now]
+            unused = [self._entries.pop(k)[0] for k in expired]
+        for old in [replaced] + unused:
+            if old is not None:
+                self._delete(old)
+        return handle
+
+    def _delete(self, handle):
+        try:
+            self.backend.delete(handle)
+        except Exception as e:
+            # Expired contents may already be gone on the provider's side
+            print(f"Could not delete cached repo context: {e}")
+
+# Marks a missing or soon-expiring entry (None is a valid handle: "inline the text")
+_STALE = object()
@@ -0,0 +1,65 @@
+import re
+
+# Parsing and rendering of unified diffs (as served by GitHub's .diff endpoints).
+# A parsed diff is a list of plain dicts, so it can be stored as JSON:
+#   {"path", "old_path", "status", "header": [lines], "hunks": [{"header", "lines": [lines]}], "additions", "deletions"}
+
+def parse_diff(text):
+    "Splits a unified diff into per-file entries with their hunks"
+    files = []
+    current = None
+    hunk = None
+    for line in text.splitlines():
+        if line.startswith("diff --git "):
+            match = re.match(r"diff --git a/(.*) b/(.*)", line)
+            old_path, path = match.groups() if match else (None, line[len("diff --git "):])
+            current = {
+                "path": path,
+                "old_path": old_path,
+                "status": "modified",
+                "header": [line],
+                "hunks": [],
+                "additions": 0,
+                "deletions": 0
+            }
+            files.append(current)
+            hunk = None
+        elif current is None:
+            continue
+        elif line.startswith("@@"):
+            hunk = {"header": line, "lines": []}
+            current["hunks"].append(hunk)
+        elif hunk is None:
+            # Extended header lines before the first hunk
+            current["header"].append(line)
+            if line.startswith("new file mode"):
+                current["status"] = "added"
+            elif line.startswith("deleted file mode"):
+                current["status"] = "deleted"
+            elif line.startswith("rename from"):
+                current["status"] = "renamed"
+            elif line.startswith("Binary files"):
+                current["status"] = "binary"
+        else:
+            hunk["lines"].append(line)
+            if line.startswith("+"):
+                current["additions"] += 1
+            elif line.startswith("-"):
+                current["deletions"] += 1
+    return files
+
+def render_file(file_diff):
+    lines = list(file_diff["header"])
+    for hunk in file_diff["hunks"]:
+        lines.append(hunk["header"])
+        lines.extend(hunk["lines"])
+    return "\n".join(lines)
+
+def render_diff(files):
+    "Turns parsed files back into unified diff text"
+    return "\n".join(render_file(file_diff) for file_diff in files)
+
+def cut_at_line(data):
+    "Drops the trailing partial line of a diff that was cut off mid-stream"
+    end = data.rfind(b"\n")
+    return data[:end + 1] if end != -1 else b""
@@ -0,0 +1,167 @@
+import re
+import math
+import time
+import datetime
+import threading
+from collections import Counter, defaultdict
+from utils.io import read_repo_issues, read_repo_issues_sync, write_repo_issues
+
+STOPWORDS = {
+    "the", "and", "for", "with", "not", "are", "was", "this", "that", "from", "when", "what", "which",
+    "have", "has", "but", "can", "should", "would", "could", "does", "into", "use", "using", "via"
+}
+
+def tokenize(text):
+    return [t for t in re.findall(r"[a-z0-9_]+", (text or "").lower()) if len(t) > 1 and t not in STOPWORDS]
+
+class TfidfIndex:
+    """
+    In-memory TF-IDF index over a repo's issues, with an inverted index so a query
+    only touches the issues sharing a term with it.
+    Titles count twice, since they carry most of what an issue is about.
+    """
+
+    def __init__(self, rows):
+        # rows: (number, title, body, state, html_url)
+        self.issues = {row[0]: row for row in rows}
+        term_counts = {number: Counter(tokenize(title) * 2 + tokenize(body)) for number, title, body, _, _ in rows}
+        document_frequency = Counter(term for counts in term_counts.values() for term in counts)
+        total = len(rows)
+        self.idf = {term: math.log((total + 1) / (df + 1)) + 1 for term, df in document_frequency.items()}
+
+        # term -> [(issue number, normalised weight)]
+        self.postings = defaultdict(list)
+        for number, counts in term_counts.items():
+            weights = {term: (1 + math.log(count)) * self.idf[term] for term, count in counts.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1
+            for term, weight in weights.items():
+                self.postings[term].append((number, weight / norm))
+
+    def search(self, text, limit=3, exclude=None, min_score=0.0):
+        "Returns [(score, (number, title, body, state, html_url))] ranked by cosine similarity"
+        counts = Counter(tokenize(text))
+        weights = {term: (1 + math.log(count)) * self.idf[term] for term, count in counts.items() if term in self.idf}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1
+
+        scores = defaultdict(float)
+        for term, weight in weights.items():
+            for number, doc_weight in self.postings[term]:
+                scores[number] += weight / norm * doc_weight
+
+        ranked = sorted(
+            ((score, number) for number, score in scores.items() if number != exclude and score >= min_score),
+            reverse=True
+        )
+        return [(score, self.issues[number]) for score, number in ranked[:limit]]
+
+class DuplicateIndex:
+    """
+    Local, per-repo index of issue titles and bodies used to find duplicates without the
+    (30 requests/minute, keyword-only) Search API.
+    Issues are stored in the issue store. A repo's first fill pages through all of its issues
+    in a background thread (see warm()); until it is done, similar_issues() returns None so
+    callers can fall back to the Search API. Afterwards queries only fetch what changed since
+    the last sync, at most once every `refresh_interval` seconds and `max_pages` pages at a time.
+    """
+
+    def __init__(self, github, refresh_interval=300, max_pages=30):
+        self.github = github
+        self.refresh_interval = refresh_interval
+        self.max_pages = max_pages
+        # (owner, repo) -> TfidfIndex of the stored issues
+        self._indexes = {}
+        self._locks = defaultdict(threading.Lock)
+        self._filling = set()
+        self._filling_lock = threading.Lock()
+
+    def _sync(self, owner, repo):
+        """
+        Stores the issues updated since the repo's sync cursor, oldest first, up to max_pages pages.
+        Each page is stored together with the updated_at of its last issue as the new cursor, so a
+        sync that stops early (page limit, error, restart) resumes where it stopped; updates made
+        while paging only move issues further back in the list.
+        `since` is inclusive, so every sync sees the issue at the cursor again; only issues that are
+        new or whose updated_at moved count as changed.
+        Returns (number of issues new or changed, whether the end of the list was reached).
+        """
+        cursor, checked_at, complete = read_repo_issues_sync(owner, repo)
+        url = f"https://api.github.com/repos/{owner}/{repo}/issues"
+        started = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        stored = 0
+        page = 1
+        for _ in range(self.max_pages):
+            params = {"state": "all", "sort": "updated", "direction": "asc", "per_page": 100, "page": page}
+            if cursor:
+                params["since"] = cursor
+            # List pages are large and never requested twice, so they stay out of the ETag cache
+            response = self.github.get(url, params=params, timeout=30, cache=False)
+            response.raise_for_status()
+            items = response.json()
+            done = len(items) < 100
+            last = items[-1]["updated_at"] if items else (cursor or started)
+            # More than a page of issues updated within the same second: step through them by page number
+            page = page + 1 if last == cursor else 1
+            cursor = last
+            # The issues endpoint also lists pull requests
+            issues = [item for item in items if "pull_request" not in item]
+            stored += write_repo_issues(owner, repo, issues, cursor, time.time() if done else checked_at, complete or done)
+            if done:
+                return stored, True
+        return stored, False
+
+    def warm(self, owner, repo):
+        "Starts the repo's first fill in the background, unless it is done or already running"
+        key = (owner, repo)
+        with self._filling_lock:
+            if key in self._filling:
+                return
+            self._filling.add(key)
+        if read_repo_issues_sync(owner, repo)[2]:
+            with self._filling_lock:
+                self._filling.discard(key)
+            return
+        threading.Thread(target=self._fill, args=(owner, repo), daemon=True).start()
+
+    def _fill(self, owner, repo):
+        try:
+            with self._locks[(owner, repo)]:
+                total, done = 0, False
+                while not done:
+                    stored, done = self._sync(owner, repo)
+                    total += stored
+                print(f"Indexed {total} issues of {owner}/{repo}")
+        except Exception as e:
+            # The cursor is kept, so the next warm() continues from the last stored page
+            print(f"Filling the duplicate index of {owner}/{repo} failed: {e}")
+        finally:
+            with self._filling_lock:
+                self._filling.discard((owner, repo))
+
+    def refresh(self, owner, repo):
+        """
+        The repo's index, brought up to date unless that was done less than refresh_interval ago.
+        Returns None (and starts the fill) if the repo was never fully indexed.
+        """
+        key = (owner, repo)
+        if not read_repo_issues_sync(owner, repo)[2]:
+            self.warm(owner, repo)
+            return None
+        with self._locks[key]:
+            _, checked_at, _ = read_repo_issues_sync(owner, repo)
+            changed = 0
+            if time.time() - checked_at >= self.refresh_interval:
+                changed, _ = self._sync(owner, repo)
+                print(f"Indexed {changed} new or updated issues of {owner}/{repo}")
+            if changed or key not in self._indexes:
+                self._indexes[key] = TfidfIndex(read_repo_issues(owner, repo))
+            return self._indexes[key]
+
+    def similar_issues(self, owner, repo, text, limit=3, exclude=None, min_score=0.1):
+        """
+        Ranked [(score, (number, title, body, state, html_url))] of the repo's issues most similar to text,
+        or None while the repo is not indexed yet
+        """
+        index = self.refresh(owner, repo)
+        if index is None:
+            return None
+        return index.search(text, limit=limit, exclude=exclude, min_score=min_score)
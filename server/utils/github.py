@@ -0,0 +1,144 @@
+import copy
+import time
+import threading
+from collections import OrderedDict
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from utils.ratelimit import resource_for_url
+from utils.metrics import record_github_response
+from utils.tracing import span
+
+GRAPHQL_URL = "https://api.github.com/graphql"
+
+class GitHubClient:
+    """
+    Shared client for the GitHub API.
+    Reuses keep-alive connections from a pool, and remembers the ETag / Last-Modified
+    of every response so unchanged resources are revalidated with a conditional
+    request (a 304 costs no bandwidth and no rate-limit quota).
+    When a RateLimitScheduler is given, every request is sent with a token
+    picked by the scheduler instead of the Authorization header in `headers`.
+    """
+
+    def __init__(self, headers, scheduler=None, max_wait=60, pool_size=10, max_cached=512):
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        self.scheduler = scheduler
+        self.max_wait = max_wait
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.max_cached = max_cached
+        # (url, params, accept) -> last 200 response carrying a validator
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        # Conditional GETs answered with a 304 (hits) or a full response (misses)
+        self.hits = 0
+        self.misses = 0
+
+    def _cache_key(self, url, params, headers):
+        accept = (headers or {}).get("Accept", self.session.headers.get("Accept"))
+        return (url, tuple(sorted((params or {}).items())), accept)
+
+    def _request(self, method, url, **kwargs):
+        started = time.monotonic()
+        with span("github", method=method, url=url) as attributes:
+            response = self.session.request(method, url, **kwargs)
+            attributes["status"] = response.status_code
+        record_github_response(url, response, time.monotonic() - started)
+        return response
+
+    def _send(self, url, params, headers, timeout, max_wait, method="GET", json=None, stream=False):
+        if self.scheduler is None:
+            return self._request(method, url, params=params, headers=headers, json=json, timeout=timeout, stream=stream)
+
+        resource = resource_for_url(url)
+        # One retry per token, in case a request races another one for the last of a budget
+        for _ in range(len(self.scheduler.tokens) + 1):
+            token = self.scheduler.acquire(resource, max_wait=max_wait)
+            response = self._request(method, url, params=params, headers={**headers, "Authorization": f"Bearer {token}"}, json=json, timeout=timeout, stream=stream)
+            self.scheduler.update(token, resource, response)
+            if not self.scheduler.is_rate_limited(response) or max_wait <= 0:
+                break
+            # Hand the connection back to the pool before retrying (a streamed body is never read)
+            response.close()
+        return response
+
+    def get(self, url, params=None, headers=None, timeout=10, max_wait=None, cache=True):
+        """
+        GET a GitHub API URL.
+        `max_wait` is how long the caller is willing to queue for rate-limit budget
+        (defaults to the client's max_wait, 0 fails fast with RateLimitExceeded).
+        Pass cache=False for large or one-off responses (e.g. list pages), which would
+        only push the small, often revalidated ones out of the ETag cache.
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        if not cache:
+            return self._send(url, params, dict(headers or {}), timeout, max_wait)
+        key = self._cache_key(url, params, headers)
+        with self._lock:
+            cached = self._cache.get(key)
+
+        request_headers = dict(headers or {})
+        if cached is not None:
+            if cached.headers.get("ETag"):
+                request_headers["If-None-Match"] = cached.headers["ETag"]
+            if cached.headers.get("Last-Modified"):
+                request_headers["If-Modified-Since"] = cached.headers["Last-Modified"]
+
+        response = self._send(url, params, request_headers, timeout, max_wait)
+
+        if response.status_code == 304 and cached is not None:
+            self.hits += 1
+            # Serve the stored body, but with the fresh rate-limit headers. Other threads may be
+            # reading the stored response, so those go on a copy of it.
+            fresh = copy.copy(cached)
+            fresh.headers = CaseInsensitiveDict(cached.headers)
+            fresh.headers.update({k: v for k, v in response.headers.items() if k.lower().startswith("x-ratelimit")})
+            with self._lock:
+                self._cache.move_to_end(key)
+            return fresh
+
+        self.misses += 1
+        if response.status_code == 200 and (response.headers.get("ETag") or response.headers.get("Last-Modified")):
+            response.content  # read the body now so the response can be replayed later
+            with self._lock:
+                self._cache[key] = response
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.max_cached:
+                    self._cache.popitem(last=False)
+
+        return response
+
+    def get_capped(self, url, max_bytes, headers=None, timeout=10, max_wait=None, chunk_size=65536):
+        """
+        GET a potentially large body (e.g. a diff) by streaming it, reading at most max_bytes.
+        Returns (body bytes, whether the body was cut off). These responses are not cached here.
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        response = self._send(url, None, dict(headers or {}), timeout, max_wait, stream=True)
+        try:
+            response.raise_for_status()
+            body = bytearray()
+            for chunk in response.iter_content(chunk_size):
+                body += chunk
+                if len(body) > max_bytes:
+                    return bytes(body[:max_bytes]), True
+            return bytes(body), False
+        finally:
+            response.close()
+
+    def graphql(self, query, variables=None, timeout=10, max_wait=None):
+        """
+        Run a GraphQL query and return its "data".
+        Raises requests' HTTPError for a failed request, and ValueError if GitHub reports query errors without data.
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        response = self._send(GRAPHQL_URL, None, {}, timeout, max_wait, method="POST", json={"query": query, "variables": variables or {}})
+        response.raise_for_status()
+        payload = response.json()
+        if payload.get("errors"):
+            print(f"GitHub GraphQL errors: {payload['errors']}")
+            if not payload.get("data"):
+                raise ValueError(payload["errors"][0].get("message", "GraphQL query failed"))
+        return payload["data"]
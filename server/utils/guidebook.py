@@ -3,13 +3,169 @@ import json
 from dotenv import load_dotenv
 import google.generativeai as genai
 import re
+import asyncio
+import time
+import functools
+import contextvars
+from contextlib import contextmanager
+from utils.io import read_pr_choice
+from utils.llm_cache import LLMCache
+from utils.context_cache import RepoContextCache, GeminiContextCacheBackend, CONTEXT_REFERENCE
+from utils.retrieval import select_guidelines, count_tokens
+from utils.singleflight import SingleFlight, AsyncSingleFlight
+from utils.tracing import span
+from utils.metrics import registry, set_cache_stats, coalesced_calls, task_seconds, llm_calls, llm_tokens, llm_seconds
 
 # Load environment variables
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel('gemini-1.5-pro-latest')
+MODEL_NAME = 'gemini-1.5-pro-latest'
+model = genai.GenerativeModel(MODEL_NAME)
+
+# Register each repo's contribution guidelines with the model once (per guidelines version)
+# instead of re-sending them in every prompt. Needs a model version that supports context caching.
+REPO_CONTEXT_CACHE = os.getenv("REPO_CONTEXT_CACHE", "").lower() in ("1", "true", "yes")
+repo_contexts = None
+if REPO_CONTEXT_CACHE:
+    repo_contexts = RepoContextCache(
+        GeminiContextCacheBackend(os.getenv("REPO_CONTEXT_CACHE_MODEL", f"models/{MODEL_NAME}")),
+        ttl=int(os.getenv("REPO_CONTEXT_CACHE_TTL", 3600)),
+        min_chars=int(os.getenv("REPO_CONTEXT_CACHE_MIN_CHARS", 16384))
+    )
+
+# Receives generated text as it streams in, see stream_llm_output()
+llm_listener = contextvars.ContextVar("llm_listener", default=None)
+# The guidebook function an LLM call is made for, so metrics can be broken down by it
+current_task = contextvars.ContextVar("current_task", default="other")
+
+# Identical prompts (page reloads, several users on the same issue) are answered from disk
+LLM_CACHE_DISABLED = os.getenv("LLM_CACHE_DISABLED", "").lower() in ("1", "true", "yes")
+llm_cache = LLMCache(
+    path=os.getenv("LLM_CACHE_PATH", os.path.join("data", "llm_cache.sqlite3")),
+    max_bytes=int(os.getenv("LLM_CACHE_MAX_MB", 256)) * 1024 * 1024,
+    default_ttl=int(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
+)
+
+# Token budget for a whole prompt, and for the contribution guideline excerpt in it.
+# Tokens are estimated by count_tokens (about four characters per token), not counted by the model's tokenizer.
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 24000))
+GUIDELINES_TOKEN_BUDGET = int(os.getenv("GUIDELINES_TOKEN_BUDGET", 3000))
+
+# The guideline sections (see process_chunk) each subtask needs
+GUIDELINE_SECTIONS = {
+    "align_with_project_vision": ["Project Goals", "Technical Design"],
+    "issue_scope": ["Project Goals", "Technical Design", "Pull Request"],
+    "tune_contribution_guidelines": ["Setup", "Pull Request", "Commit"],
+    "getting_started_checklist": ["Project Goals", "Setup", "Pull Request", "Commit"],
+    "steps": ["Setup", "Technical Design", "Code Style"],
+    "tests": ["Testing", "Setup"],
+    "enforce_contribution_guidelines": ["Technical Design", "Code Style", "Performance", "Commit"],
+    "clear_pr_description": ["Pull Request", "Commit"],
+    "tests_presence": ["Testing"],
+}
+
+def relevant_guidelines(contribution_guidelines, task, query, *other_inputs):
+    """
+    The parts of the contribution guidelines a subtask needs: its own sections first, then the
+    sections most relevant to `query` (BM25), within GUIDELINES_TOKEN_BUDGET and whatever
+    PROMPT_TOKEN_BUDGET leaves after the prompt's other inputs (at least 500 tokens; if the
+    other inputs are that large, llm_request cuts them to fit the whole prompt).
+    With repo context caching on, the full guidelines already live in the model's context and are kept.
+    """
+    if repo_contexts is not None:
+        return contribution_guidelines
+    remaining = PROMPT_TOKEN_BUDGET - sum(count_tokens(str(x)) for x in other_inputs if x) - 1000
+    budget = min(GUIDELINES_TOKEN_BUDGET, max(500, remaining))
+    return select_guidelines(contribution_guidelines, query, budget, GUIDELINE_SECTIONS.get(task, ()))
+
+# Identical prompts in flight at the same time are sent to the model once
+llm_flights = SingleFlight()
+llm_flights_async = AsyncSingleFlight()
+
+@registry.collector
+def collect_llm_metrics():
+    set_cache_stats("llm", llm_cache.hits, llm_cache.misses)
+    coalesced_calls.set_total(llm_flights.shared + llm_flights_async.shared, flight="llm")
+
+def parse_json(text):
+    "json.loads of model output, timed as a span of the request's trace"
+    with span("json_parse", chars=len(text)):
+        return json.loads(text)
+
+TRUNCATION_NOTE = "\n[... cut to fit the prompt budget ...]"
 
+def fit_prompt(prompt, trimmable, served_from_context=None):
+    """
+    Keeps the fully built prompt under PROMPT_TOKEN_BUDGET (as estimated by count_tokens)
+    by cutting the largest of the `trimmable` free-text inputs inlined in it, then the next largest.
+    `served_from_context` is text generate_text will swap for CONTEXT_REFERENCE before sending,
+    so it does not count against the budget.
+    """
+    def excess_tokens(prompt):
+        sent = prompt.replace(served_from_context, CONTEXT_REFERENCE) if served_from_context else prompt
+        return count_tokens(sent) - PROMPT_TOKEN_BUDGET
+
+    excess = excess_tokens(prompt)
+    for text in sorted((t for t in trimmable if t and t in prompt), key=len, reverse=True):
+        if excess <= 0:
+            break
+        keep = max(0, len(text) - excess * 4 - len(TRUNCATION_NOTE))
+        prompt = prompt.replace(text, text[:keep] + TRUNCATION_NOTE, 1)
+        excess = excess_tokens(prompt)
+    if excess > 0:
+        print(f"Prompt is still about {excess} tokens over PROMPT_TOKEN_BUDGET")
+    return prompt
+
+def llm_request(prompt, trim=(), **options):
+    """
+    What a guidebook function yields when it needs the model: the prompt plus call_llm options.
+    `trim` lists the free-text inputs inlined in the prompt (issue body, diff, ...) that may be
+    cut to keep the prompt under PROMPT_TOKEN_BUDGET. Guidelines passed as cached_context that
+    are large enough for the repo context cache are not counted, as they are not sent inline
+    (should the provider refuse them after all, the prompt goes out over the budget).
+    """
+    cached_context = options.get("cached_context")
+    served = cached_context if repo_contexts is not None and cached_context and len(cached_context) >= repo_contexts.min_chars else None
+    return fit_prompt(prompt, trim, served), options
+
+def llm_task(fn):
+    """
+    Lets one guidebook function body serve both the blocking and the asyncio code path.
+    The body yields llm_request(...) wherever it needs the model and is sent the text back.
+    Calling the function drives it with call_llm; `fn.run_async(...)` drives it with call_llm_async.
+    """
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        steps = fn(*args, **kwargs)
+        token = current_task.set(fn.__name__)
+        try:
+            with task_seconds.time(function=fn.__name__):
+                prompt, options = next(steps)
+                while True:
+                    prompt, options = steps.send(call_llm(prompt, **options))
+        except StopIteration as done:
+            return done.value
+        finally:
+            current_task.reset(token)
+
+    async def run_async(*args, **kwargs):
+        steps = fn(*args, **kwargs)
+        token = current_task.set(fn.__name__)
+        try:
+            with task_seconds.time(function=fn.__name__):
+                prompt, options = next(steps)
+                while True:
+                    prompt, options = steps.send(await call_llm_async(prompt, **options))
+        except StopIteration as done:
+            return done.value
+        finally:
+            current_task.reset(token)
+
+    run.run_async = run_async
+    return run
+
+@llm_task
 def classify_issue(title, body):
     "Classifies if an issue is a bug or a new feature"
     # Step 1: Classify issue type
@@ -25,12 +181,13 @@ def classify_issue(title, body):
     "feature" or "bug".
         """
 
-    classification = call_llm(classify_prompt)
+    classification = (yield llm_request(classify_prompt, trim=[body]))
     if not classification:
         return {"error": "Failed to classify issue type."}
 
     return classification.strip().lower()
 
+@llm_task
 def verify_feature_uniqueness(owner, repo, title, body, issue_type):
     """
     Determines if the issue is a feature request or a bug.
@@ -58,7 +215,7 @@ def verify_feature_uniqueness(owner, repo, title, body, issue_type):
     A single paragraph.
         """
 
-    guidance = call_llm(uniqueness_prompt)
+    guidance = (yield llm_request(uniqueness_prompt, trim=[body]))
     if not guidance:
         guidance = "Could not generate guidance at this time."
 
@@ -68,6 +225,7 @@ def verify_feature_uniqueness(owner, repo, title, body, issue_type):
     }
 
 
+@llm_task
 def check_issue_alignment_with_vision(repo_description, title, body, contribution_guidelines, issue_type):
     """
     Check if the issue conflicts with the project's vision using LLM.
@@ -82,6 +240,9 @@ def check_issue_alignment_with_vision(repo_description, title, body, contributio
             "reason": "This issue is a bug report, so alignment check is unnecessary."
         }
 
+    # Only send the guideline sections this task needs, within the prompt token budget
+    contribution_guidelines = relevant_guidelines(contribution_guidelines, "align_with_project_vision", f"{title}\n{body}", repo_description, title, body)
+
     # Step 2: Build prompt for LLM
     alignment_prompt = f"""
     You are an expert open-source reviewer.
@@ -113,7 +274,7 @@ def check_issue_alignment_with_vision(repo_description, title, body, contributio
         """
 
     # Step 3: Call LLM
-    llm_response = call_llm(alignment_prompt)
+    llm_response = (yield llm_request(alignment_prompt, trim=[body], cached_context=contribution_guidelines))
     if not llm_response:
         return {"error": "Failed to check alignment with vision."}
 
@@ -126,12 +287,13 @@ def check_issue_alignment_with_vision(repo_description, title, body, contributio
             # Ensure only JSON-like part is parsed
             json_match = re.search(r"\{[\s\S]*\}", llm_response)
             if json_match:
-                return json.loads(json_match.group(0))
+                return parse_json(json_match.group(0))
             else:
                 return {"status": "conflict", "details": llm_response.strip()}
         except Exception:
             return {"status": "conflict", "details": llm_response.strip()}
 
+@llm_task
 def check_issue_scope(repo_description, title, body, contribution_guidelines, issue_type, issue_number):
     """
     Check if the issue scope is manageable for a single PR.
@@ -146,6 +308,9 @@ def check_issue_scope(repo_description, title, body, contribution_guidelines, is
             "reason": "Bug fix issues are usually handled in a single PR."
         }
 
+    # Only send the guideline sections this task needs, within the prompt token budget
+    contribution_guidelines = relevant_guidelines(contribution_guidelines, "issue_scope", f"{title}\n{body}", repo_description, title, body)
+
     # Build LLM prompt
     scope_prompt = f"""
     You are an expert open-source maintainer.
@@ -180,7 +345,7 @@ def check_issue_scope(repo_description, title, body, contribution_guidelines, is
     """
 
     # Call LLM
-    llm_response = call_llm(scope_prompt)
+    llm_response = (yield llm_request(scope_prompt, trim=[body], cached_context=contribution_guidelines))
     if not llm_response:
         return {"error": "Failed to check issue scope."}
 
@@ -189,7 +354,7 @@ def check_issue_scope(repo_description, title, body, contribution_guidelines, is
         import json, re
         json_match = re.search(r"\{[\s\S]*\}", llm_response)
         if json_match:
-            parsed = json.loads(json_match.group(0))
+            parsed = parse_json(json_match.group(0))
 
             # Append issue reference in description
             if "pr_plan" in parsed and parsed["pr_plan"]:
@@ -215,6 +380,7 @@ def check_issue_scope(repo_description, title, body, contribution_guidelines, is
         }
 
 
+@llm_task
 def understand_relevant_contribution_guidelines(owner, repo, title, body, contribution_guidelines):
     """
     Summarize contribution guidelines in three points:
@@ -223,6 +389,9 @@ def understand_relevant_contribution_guidelines(owner, repo, title, body, contri
     3. How the project expects PR creation to be done.
     """
 
+    # Only send the guideline sections this task needs, within the prompt token budget
+    contribution_guidelines = relevant_guidelines(contribution_guidelines, "tune_contribution_guidelines", f"{title}\n{body}", title, body)
+
     prompt = f"""
     You are an expert open-source assistant.
 
@@ -244,7 +413,7 @@ def understand_relevant_contribution_guidelines(owner, repo, title, body, contri
     Respond with exactly this JSON format, no extra text.
         """
 
-    llm_response = call_llm(prompt)
+    llm_response = (yield llm_request(prompt, trim=[body], cached_context=contribution_guidelines))
     if not llm_response:
         return {"error": "Failed to fetch contribution guidelines summary."}
 
@@ -253,7 +422,7 @@ def understand_relevant_contribution_guidelines(owner, repo, title, body, contri
         import json, re
         json_match = re.search(r"\{[\s\S]*\}", llm_response)
         if json_match:
-            return json.loads(json_match.group(0))
+            return parse_json(json_match.group(0))
         else:
             # Fallback if parsing fails: return as plain text in all fields
             return {
@@ -268,6 +437,110 @@ def understand_relevant_contribution_guidelines(owner, repo, title, body, contri
             "PR_creation_process": llm_response.strip()
         }
 
+@llm_task
+def generate_getting_started_checklist(owner, repo, title, body, repo_description, contribution_guidelines, issue_number):
+    """
+    Produces the whole getting-started checklist (classification, feature uniqueness,
+    vision alignment, scope / PR plan and guidelines summary) from ONE structured-output
+    request, so the issue and the contribution guidelines are only sent once.
+    Returns a dict with the same shapes as classify_issue, verify_feature_uniqueness,
+    check_issue_alignment_with_vision, check_issue_scope and
+    understand_relevant_contribution_guidelines, or None if the response could not be parsed
+    (callers should then fall back to one call per section).
+    """
+    # Only send the guideline sections this task needs, within the prompt token budget
+    contribution_guidelines = relevant_guidelines(contribution_guidelines, "getting_started_checklist", f"{title}\n{body}", repo_description, title, body)
+
+    prompt = f"""
+    You are an expert open-source assistant helping a new contributor get started on a GitHub issue.
+
+    Inputs:
+    - Repository: {owner}/{repo}
+    - Project Description: {repo_description}
+    - Contribution Guidelines: {contribution_guidelines}
+    - Issue Title: {title}
+    - Issue Description: {body}
+
+    Tasks:
+    1. issue_type: Determine whether the issue is a FEATURE REQUEST or a BUG REPORT. Exactly "feature" or "bug".
+    2. feature_uniqueness_guidance: If it is a feature, a SHORT and CLEAR guide (max 3-4 sentences) for how the contributor can verify if this feature already exists in the repository. Be actionable (search keywords, specific files or directories, docs). Empty string for bugs.
+    3. vision_alignment: If it is a feature, analyze whether it aligns with the project's vision and contribution guidelines. Use status "no conflict", or status "conflict" with the conflict in one short paragraph and up to 2 alternative directions. Use status "no conflict" for bugs.
+    4. scope: If it is a feature, decide whether it can be completed in a single PR ("single-pr", empty pr_plan) or should be split ("multi-pr", 2-4 smaller PRs with titles and brief descriptions). Use "single-pr" for bugs.
+    5. contribution_guidelines_summary: Summarize the contribution guidelines for a new contributor:
+       - signing_guidelines: If contributor must sign a CLA or agree to contribution guidelines, provide the URL. Else, "not applicable".
+       - local_setup_instructions: Steps to setup the project locally (install dependencies, build, run tests, etc.)
+       - PR_creation_process: Steps or instructions on how the project expects PRs to be created
+
+    Output Format (JSON):
+    {{
+      "issue_type": "feature",
+      "feature_uniqueness_guidance": "...",
+      "vision_alignment": {{"status": "conflict", "conflict_reason": "...", "suggested_alternatives": ["alt1", "alt2"]}},
+      "scope": {{"status": "multi-pr", "pr_plan": [{{"title": "PR Title 1", "description": "Short explanation"}}]}},
+      "contribution_guidelines_summary": {{"signing_guidelines": "...", "local_setup_instructions": "...", "PR_creation_process": "..."}}
+    }}
+    Respond with exactly this JSON format, no extra text.
+    """
+
+    llm_response = (yield llm_request(prompt, trim=[body], generation_config={"response_mime_type": "application/json"}, cached_context=contribution_guidelines))
+    if not llm_response:
+        return None
+
+    try:
+        parsed = parse_json(llm_response)
+        issue_type = parsed["issue_type"].strip().lower()
+        if issue_type not in ("feature", "bug"):
+            return None
+        guidance = parsed["feature_uniqueness_guidance"]
+        alignment = parsed["vision_alignment"]
+        scope = parsed["scope"]
+        summary = parsed["contribution_guidelines_summary"]
+        if not isinstance(alignment, dict) or not isinstance(scope, dict) or not isinstance(summary, dict):
+            return None
+    except (ValueError, KeyError, AttributeError, TypeError):
+        return None
+
+    checklist = {
+        "issue_type": issue_type,
+        "tune_contribution_guidelines": {
+            "signing_guidelines": summary.get("signing_guidelines", "not applicable"),
+            "local_setup_instructions": summary.get("local_setup_instructions", ""),
+            "PR_creation_process": summary.get("PR_creation_process", "")
+        }
+    }
+
+    if issue_type == "bug":
+        # The per-section functions answer bugs without calling the LLM
+        checklist["feature_uniqueness"] = verify_feature_uniqueness(owner, repo, title, body, issue_type)
+        checklist["align_with_project_vision"] = check_issue_alignment_with_vision(repo_description, title, body, contribution_guidelines, issue_type)
+        checklist["issue_scope"] = check_issue_scope(repo_description, title, body, contribution_guidelines, issue_type, issue_number)
+        return checklist
+
+    checklist["feature_uniqueness"] = {
+        "status": "feature",
+        "guidance": (guidance or "Could not generate guidance at this time.").strip()
+    }
+
+    if str(alignment.get("status", "")).strip().lower() == "no conflict":
+        checklist["align_with_project_vision"] = {"status": "no conflict"}
+    else:
+        checklist["align_with_project_vision"] = {
+            "status": "conflict",
+            "conflict_reason": alignment.get("conflict_reason", ""),
+            "suggested_alternatives": alignment.get("suggested_alternatives", [])
+        }
+
+    pr_plan = scope.get("pr_plan") or []
+    # Append issue reference in description
+    for pr in pr_plan:
+        pr["description"] = f"{pr.get('description', '')} (Addresses Issue #{issue_number})"
+    checklist["issue_scope"] = {
+        "status": scope.get("status", "multi-pr" if pr_plan else "single-pr"),
+        "pr_plan": pr_plan
+    }
+    return checklist
+
+@llm_task
 def generate_steps(owner, repo, title, issue_number, body, repo_description, contribution_guidelines, pr_title=None, pr_description=None, suggestion_level=3):
     detail_map = {1: "High-level overview steps", 2: "Module-level guidance", 3: "Function-level guidance",
                   4: "Line-level guidance", 5: "Very detailed with pseudo-code"}
@@ -282,6 +555,9 @@ def generate_steps(owner, repo, title, issue_number, body, repo_description, con
         Description: {pr_description}
         """
 
+    # Only send the guideline sections this task needs, within the prompt token budget
+    contribution_guidelines = relevant_guidelines(contribution_guidelines, "steps", f"{title}\n{body}\n{pr_title or ''}\n{pr_description or ''}", repo_description, title, body)
+
     prompt = f"""
     You are an expert open-source contributor assistant.
 
@@ -312,17 +588,20 @@ def generate_steps(owner, repo, title, issue_number, body, repo_description, con
     ]
     """
 
-    steps_text = call_llm(prompt).strip()
+    steps_text = (yield llm_request(prompt, trim=[body, pr_description], cached_context=contribution_guidelines)).strip()
+    if not steps_text:
+        return ["Could not generate implementation steps at this time."]
 
     try:
         import json
-        parsed = json.loads(steps_text)
+        parsed = parse_json(steps_text)
         # Always normalize to list of strings
         return [str(s).strip() for s in parsed if str(s).strip()]
     except:
         # fallback: split lines
         return [line.strip("-* ") for line in steps_text.split("\n") if line.strip()]
 
+@llm_task
 def explain_tests(owner, repo, title, issue_number, body, repo_description,
                   contribution_guidelines, pr_title=None, pr_description=None,
                   suggestion_level=3):
@@ -344,6 +623,9 @@ def explain_tests(owner, repo, title, issue_number, body, repo_description,
         Description: {pr_description}
         """
 
+    # Only send the guideline sections this task needs, within the prompt token budget
+    contribution_guidelines = relevant_guidelines(contribution_guidelines, "tests", f"{title}\n{body}\n{pr_title or ''}\n{pr_description or ''}", repo_description, title, body)
+
     prompt = f"""
     You are an expert open-source contributor assistant.
 
@@ -374,28 +656,29 @@ def explain_tests(owner, repo, title, issue_number, body, repo_description,
     ]
     """
 
-    steps_text = call_llm(prompt).strip()
+    steps_text = (yield llm_request(prompt, trim=[body, pr_description], cached_context=contribution_guidelines)).strip()
+    if not steps_text:
+        return ["Could not generate testing steps at this time."]
 
     try:
         import json
-        parsed = json.loads(steps_text)
+        parsed = parse_json(steps_text)
         return [str(s).strip() for s in parsed if str(s).strip()]
     except:
         return [line.strip("-*• ") for line in steps_text.split("\n") if line.strip()]
 
-def validate_pr_resolution(owner, repo, issue_number, repo_description, diff):
+@llm_task
+def validate_pr_resolution(owner, repo, issue_number, repo_description, diff, pr_choice_text=None):
     """
     Validates if the selected PR is fully implemented according to the user's choice.
     Returns a markdown list of items still missing if any.
     """
-    pr_choice_file = os.path.join("data", owner, repo, str(issue_number), "pr_choice.txt")
-    if not os.path.exists(pr_choice_file):
+    # Read the PR choice (plain text), unless the caller already did
+    if pr_choice_text is None:
+        pr_choice_text = read_pr_choice(owner, repo, issue_number)
+    if pr_choice_text is None:
         return "PR choice not found. User must select a PR plan first."
 
-    # Read the PR choice (plain text)
-    with open(pr_choice_file, "r", encoding="utf-8") as f:
-        pr_choice_text = f.read().strip()
-
     # Compose prompt for LLM
     prompt = f"""
     You are reviewing a pull request.
@@ -415,10 +698,11 @@ def validate_pr_resolution(owner, repo, issue_number, repo_description, diff):
     """
 
     # Call your LLM function here
-    result = call_llm(prompt)
-    return result
+    result = (yield llm_request(prompt, trim=[diff]))
+    return result or "Could not validate the PR against the chosen plan at this time."
 
-def enforce_contribution_guidelines(owner, repo, issue_number, contribution_guidelines, diff):
+@llm_task
+def enforce_contribution_guidelines(owner, repo, issue_number, contribution_guidelines, diff, pr_choice_text=None):
     """
     Evaluates if the PR follows the repository's contribution guidelines:
     - technical_design_alignment
@@ -430,17 +714,18 @@ def enforce_contribution_guidelines(owner, repo, issue_number, contribution_guid
 
     Returns a structured JSON object with suggestions.
     """
-    import os, json, re
+    import json, re
 
     # Read PR choice
-    pr_choice_file = os.path.join("data", owner, repo, str(issue_number), "pr_choice.txt")
-    if not os.path.exists(pr_choice_file):
+    if pr_choice_text is None:
+        pr_choice_text = read_pr_choice(owner, repo, issue_number)
+    if pr_choice_text is None:
         return {"error": "PR choice not found. User must select a PR plan first."}
 
-    with open(pr_choice_file, "r", encoding="utf-8") as f:
-        pr_choice_text = f.read().strip()
-
     # Compose prompt for LLM
+    # Only send the guideline sections this task needs, within the prompt token budget
+    contribution_guidelines = relevant_guidelines(contribution_guidelines, "enforce_contribution_guidelines", f"{pr_choice_text}\n{diff}", pr_choice_text, diff)
+
     prompt = f"""
     You are an expert open-source assistant.
 
@@ -474,7 +759,7 @@ def enforce_contribution_guidelines(owner, repo, issue_number, contribution_guid
     """
 
     # Call your LLM function
-    llm_response = call_llm(prompt)
+    llm_response = (yield llm_request(prompt, trim=[diff], cached_context=contribution_guidelines))
     if not llm_response:
         return {"error": "Failed to fetch contribution guidelines enforcement."}
 
@@ -482,7 +767,7 @@ def enforce_contribution_guidelines(owner, repo, issue_number, contribution_guid
     try:
         json_match = re.search(r"\{[\s\S]*\}", llm_response)
         if json_match:
-            return json.loads(json_match.group(0))
+            return parse_json(json_match.group(0))
         else:
             # fallback: return all fields with raw text
             return {
@@ -503,7 +788,8 @@ def enforce_contribution_guidelines(owner, repo, issue_number, contribution_guid
             "commit_quality_standards": llm_response.strip()
         }
 
-def clear_pr_description(owner, repo, issue_number, contribution_guidelines, diff):
+@llm_task
+def clear_pr_description(owner, repo, issue_number, contribution_guidelines, diff, pr_choice_text=None):
     """
     Checks the PR description and generates a markdown with suggestions
     for making it clear, concise, linked to the issue, and consistent
@@ -511,16 +797,12 @@ def clear_pr_description(owner, repo, issue_number, contribution_guidelines, dif
     
     Returns a markdown string.
     """
-    import os
-
     # Read PR choice
-    pr_choice_file = os.path.join("data", owner, repo, str(issue_number), "pr_choice.txt")
-    if not os.path.exists(pr_choice_file):
+    if pr_choice_text is None:
+        pr_choice_text = read_pr_choice(owner, repo, issue_number)
+    if pr_choice_text is None:
         return "PR choice not found. User must select a PR plan first."
 
-    with open(pr_choice_file, "r", encoding="utf-8") as f:
-        pr_choice_text = f.read().strip()
-
     # Extract the PR description from the text
     pr_description = ""
     lines = pr_choice_text.split("\n")
@@ -528,6 +810,9 @@ def clear_pr_description(owner, repo, issue_number, contribution_guidelines, dif
         if line.lower().startswith("pr description:"):
             pr_description = line[len("pr description:"):].strip()
 
+    # Only send the guideline sections this task needs, within the prompt token budget
+    contribution_guidelines = relevant_guidelines(contribution_guidelines, "clear_pr_description", pr_choice_text, pr_choice_text, diff)
+
     prompt = f"""
     You are an expert open-source assistant.
 
@@ -554,11 +839,12 @@ def clear_pr_description(owner, repo, issue_number, contribution_guidelines, dif
     """
 
     # Call LLM
-    llm_response = call_llm(prompt)
+    llm_response = (yield llm_request(prompt, trim=[diff], cached_context=contribution_guidelines))
 
-    return llm_response
+    return llm_response or "Could not review the PR description at this time."
 
-def tests_presence(owner, repo, issue_number, contribution_guidelines, diff):
+@llm_task
+def tests_presence(owner, repo, issue_number, contribution_guidelines, diff, pr_choice_text=None):
     """
     Checks whether tests are present in the PR, if the contribution guidelines
     recommend tests, and if the PR itself suggests testing is required.
@@ -567,16 +853,12 @@ def tests_presence(owner, repo, issue_number, contribution_guidelines, diff):
       - Recommendations for additional tests
       - Instructions for manual testing if needed
     """
-    import os
-
     # Read PR choice
-    pr_choice_file = os.path.join("data", owner, repo, str(issue_number), "pr_choice.txt")
-    if not os.path.exists(pr_choice_file):
+    if pr_choice_text is None:
+        pr_choice_text = read_pr_choice(owner, repo, issue_number)
+    if pr_choice_text is None:
         return "PR choice not found. User must select a PR plan first."
 
-    with open(pr_choice_file, "r", encoding="utf-8") as f:
-        pr_choice_text = f.read().strip()
-
     # Extract the PR title and description from the text
     pr_title = ""
     pr_description = ""
@@ -587,6 +869,9 @@ def tests_presence(owner, repo, issue_number, contribution_guidelines, diff):
         elif line.lower().startswith("pr description:"):
             pr_description = line[len("pr description:"):].strip()
 
+    # Only send the guideline sections this task needs, within the prompt token budget
+    contribution_guidelines = relevant_guidelines(contribution_guidelines, "tests_presence", f"{pr_choice_text}\n{diff}", pr_choice_text, diff)
+
     prompt = f"""
     You are an expert open-source assistant.
 
@@ -620,14 +905,207 @@ def tests_presence(owner, repo, issue_number, contribution_guidelines, diff):
     """
 
     # Call the LLM
-    llm_response = call_llm(prompt)
-    return llm_response
+    llm_response = (yield llm_request(prompt, trim=[diff], cached_context=contribution_guidelines))
+    return llm_response or "Could not check the PR's tests at this time."
+
+
+@llm_task
+def merge_review_findings(check_description, findings):
+    """
+    Reduce step of a sharded review: merges the results of one review check that was
+    run separately on each part of a large diff into a single markdown answer.
+    """
+    parts = "\n\n".join(f"--- Review of part {i + 1} of the diff ---\n{finding}" for i, finding in enumerate(findings) if finding)
+    prompt = f"""
+    You are an expert open-source assistant.
+
+    A large pull request was reviewed in parts: each review below only saw some of the files in the diff.
+    The review task was:
+    {check_description}
 
+    {parts}
+
+    Task:
+    Merge these partial reviews into ONE review of the whole pull request, in the same format.
+    - Something is only missing from the PR if none of the parts contains it.
+    - Remove duplicates and contradictions, keep every concrete finding with its file name.
+
+    Respond ONLY in markdown format.
+    """
+    merged = (yield llm_request(prompt, trim=[parts]))
+    # Without a merge, the partial reviews are still better than nothing
+    return merged or parts
+
+@llm_task
+def merge_guideline_reports(reports):
+    """
+    Reduce step of a sharded enforce_contribution_guidelines: merges the per-part
+    reports into one report with the same keys.
+    """
+    keys = ["technical_design_alignment", "match_project_code_style", "language_specific_best_practices",
+            "possible_performance_issues", "high_source_code_quality", "commit_quality_standards"]
+    reports = [r for r in reports if isinstance(r, dict) and "error" not in r]
+    if len(reports) <= 1:
+        return reports[0] if reports else {"error": "Failed to fetch contribution guidelines enforcement."}
+
+    prompt = f"""
+    You are an expert open-source assistant.
+
+    A large pull request was checked against the repository's contribution guidelines in parts:
+    each report below only saw some of the files in the diff.
+
+    {json.dumps(reports, indent=2)}
+
+    Task:
+    Merge the reports into ONE report for the whole pull request. For every key, combine the
+    observations of all parts, remove duplicates, and keep file names for concrete findings.
+
+    Respond only with a JSON object with exactly these keys: {", ".join(keys)}
+    """
+    merged = (yield llm_request(prompt, generation_config={"response_mime_type": "application/json"}))
+    try:
+        merged = parse_json(merged)
+        return {key: merged.get(key, "") for key in keys}
+    except (TypeError, ValueError):
+        # Fall back to listing every part's findings under each key
+        return {key: "\n\n".join(str(r.get(key, "")) for r in reports if r.get(key)) for key in keys}
 
 # Bulk call several prompts to generate different checklist for each guidebook heading
-def call_llm(prompt):
-    response  = model.generate_content(prompt)
-    if response:
-        return response.text
-    else:
-        return None
\ No newline at end of file
+def call_llm(prompt, generation_config=None, use_cache=True, ttl=None, cached_context=None):
+    """
+    Generate a response for the prompt, answering from the LLM cache when possible.
+    Pass use_cache=False (or set LLM_CACHE_DISABLED) to always call the model.
+    Inside stream_llm_output(), the text is also relayed to the listener as it is generated.
+    cached_context is a large block inlined in the prompt (the contribution guidelines); when
+    repo context caching is on, it is registered with the model once and removed from the prompt.
+    Concurrent calls with the same prompt share a single model call.
+    """
+    listener = llm_listener.get()
+    use_cache = use_cache and not LLM_CACHE_DISABLED
+    if not use_cache:
+        llm_calls.inc(function=current_task.get(), source="model")
+        return generate_text(prompt, generation_config, cached_context, listener)
+
+    key = LLMCache.make_key(MODEL_NAME, generation_config, prompt)
+    with span("llm_cache"):
+        cached = llm_cache.get(key)
+    if cached is not None:
+        llm_calls.inc(function=current_task.get(), source="cache")
+        if listener:
+            listener(cached)
+        return cached
+
+    ran = []
+    def generate():
+        ran.append(True)
+        text = generate_text(prompt, generation_config, cached_context, listener)
+        if text:
+            llm_cache.set(key, text, ttl=ttl)
+        return text
+
+    # Several users opening the same issue at once send identical prompts
+    text = llm_flights.do(key, generate)
+    llm_calls.inc(function=current_task.get(), source="model" if ran else "shared")
+    if not ran and listener and text:
+        listener(text)
+    return text
+
+def generate_text(prompt, generation_config, cached_context, listener):
+    "One model call, streamed to the listener if there is one. Returns '' when the model gave no text (e.g. a blocked response)"
+    target_model = model
+    if repo_contexts is not None and cached_context:
+        context_model = repo_contexts.model_for(cached_context)
+        if context_model is not None:
+            target_model = context_model
+            prompt = prompt.replace(cached_context, CONTEXT_REFERENCE)
+
+    started = time.monotonic()
+    usage = None
+    with span("llm", function=current_task.get(), streamed=bool(listener)):
+        if listener:
+            text = ""
+            for chunk in target_model.generate_content(prompt, generation_config=generation_config, stream=True):
+                usage = getattr(chunk, "usage_metadata", None) or usage
+                if chunk.parts:
+                    listener(chunk.text)
+                    text += chunk.text
+        else:
+            response  = target_model.generate_content(prompt, generation_config=generation_config)
+            usage = getattr(response, "usage_metadata", None)
+            text = response.text if response and response.parts else ""
+    record_llm_usage(prompt, text, usage, time.monotonic() - started)
+    return text
+
+def record_llm_usage(prompt, text, usage, seconds):
+    "Token counts as reported by the model, or estimated from the text when it reports none"
+    function = current_task.get()
+    input_tokens = getattr(usage, "prompt_token_count", None) or count_tokens(prompt)
+    output_tokens = getattr(usage, "candidates_token_count", None) or count_tokens(text)
+    llm_tokens.inc(input_tokens, function=function, direction="input")
+    llm_tokens.inc(output_tokens, function=function, direction="output")
+    llm_seconds.observe(seconds, function=function)
+
+async def call_llm_async(prompt, generation_config=None, use_cache=True, ttl=None, cached_context=None):
+    "Same as call_llm, but awaits the model instead of blocking a thread on it"
+    listener = llm_listener.get()
+    use_cache = use_cache and not LLM_CACHE_DISABLED
+    if not use_cache:
+        llm_calls.inc(function=current_task.get(), source="model")
+        return await generate_text_async(prompt, generation_config, cached_context, listener)
+
+    key = LLMCache.make_key(MODEL_NAME, generation_config, prompt)
+    with span("llm_cache"):
+        cached = await asyncio.to_thread(llm_cache.get, key)
+    if cached is not None:
+        llm_calls.inc(function=current_task.get(), source="cache")
+        if listener:
+            listener(cached)
+        return cached
+
+    ran = []
+    async def generate():
+        ran.append(True)
+        text = await generate_text_async(prompt, generation_config, cached_context, listener)
+        if text:
+            await asyncio.to_thread(llm_cache.set, key, text, ttl)
+        return text
+
+    text = await llm_flights_async.do(key, generate)
+    llm_calls.inc(function=current_task.get(), source="model" if ran else "shared")
+    if not ran and listener and text:
+        listener(text)
+    return text
+
+async def generate_text_async(prompt, generation_config, cached_context, listener):
+    target_model = model
+    if repo_contexts is not None and cached_context:
+        context_model = await asyncio.to_thread(repo_contexts.model_for, cached_context)
+        if context_model is not None:
+            target_model = context_model
+            prompt = prompt.replace(cached_context, CONTEXT_REFERENCE)
+
+    started = time.monotonic()
+    usage = None
+    with span("llm", function=current_task.get(), streamed=bool(listener)):
+        if listener:
+            text = ""
+            async for chunk in await target_model.generate_content_async(prompt, generation_config=generation_config, stream=True):
+                usage = getattr(chunk, "usage_metadata", None) or usage
+                if chunk.parts:
+                    listener(chunk.text)
+                    text += chunk.text
+        else:
+            response = await target_model.generate_content_async(prompt, generation_config=generation_config)
+            usage = getattr(response, "usage_metadata", None)
+            text = response.text if response and response.parts else ""
+    record_llm_usage(prompt, text, usage, time.monotonic() - started)
+    return text
+
+@contextmanager
+def stream_llm_output(listener):
+    "Within this block, call_llm uses the model's streaming mode and passes each piece of text to listener(text)"
+    token = llm_listener.set(listener)
+    try:
+        yield
+    finally:
+        llm_listener.reset(token)
\ No newline at end of file
@@ -1,47 +1,101 @@
 import os
 from flask import jsonify
+from utils.issue_store import IssueStore
+from utils.tracing import span
 
 BASE_DIR = "data"
 
-def write_issue_files(owner, repo, issue_number, title, body, repo_description, contribution_guidelines):
-    path = os.path.join(BASE_DIR, owner, repo, str(issue_number))
-    os.makedirs(path, exist_ok=True)
-
-    # Write issue info to their respective files
-    with open(os.path.join(path, "title.txt"), "w") as f:
-        f.write(title)
-
-    with open(os.path.join(path, "body.txt"), "w") as f:
-        f.write(body)
+# Every issue is one row of a SQLite database. Issue folders written under
+# data/<owner>/<repo>/<issue>/ by earlier versions are imported the first time it is created.
+store = IssueStore(
+    os.getenv("ISSUE_STORE_PATH", os.path.join(BASE_DIR, "guidebook.sqlite3")),
+    legacy_dir=BASE_DIR
+)
 
-    with open(os.path.join(path, "repo_description.txt"), "w") as f:
-        f.write(repo_description)
+def write_issue_files(owner, repo, issue_number, title, body, repo_description, contribution_guidelines):
+    store.upsert_issue(
+        owner, repo, issue_number,
+        title=title,
+        body=body,
+        repo_description=repo_description,
+        contribution_guidelines=contribution_guidelines
+    )
 
-    # TODO: Find contributing.md for the repo, and the related files 
-    with open(os.path.join(path, "contribution_guidelines.txt"), "w") as f:
-        f.write(contribution_guidelines)
-    
     return {
         "Done"
     }
 
 def read_issue_files(owner, repo, issue_number):
-    base_path = os.path.join(BASE_DIR, owner, repo, issue_number)
-    if not os.path.exists(base_path):
+    with span("read_issue_files"):
+        issue = store.get_issue(owner, repo, issue_number)
+    if issue is None or issue["title"] is None:
         return jsonify({"error": "Issue data not found, run generate_guidebook first"}), 400
 
-    with open(os.path.join(base_path, "title.txt")) as f:
-        title = f.read()
-    with open(os.path.join(base_path, "body.txt")) as f:
-        body = f.read()
-    with open(os.path.join(base_path, "repo_description.txt")) as f:
-        repo_description = f.read()
-    with open(os.path.join(base_path, "contribution_guidelines.txt")) as f:
-        contribution_guidelines = f.read()
-    
     return {
-        "title": title,
-        "body" : body,
-        "repo_description": repo_description,
-        "contribution_guidelines": contribution_guidelines
+        "title": issue["title"],
+        "body" : issue["body"],
+        "repo_description": issue["repo_description"],
+        "contribution_guidelines": issue["contribution_guidelines"]
     }
+
+def write_pr_choice(owner, repo, issue_number, pr_title, pr_description):
+    store.upsert_issue(owner, repo, issue_number, pr_choice=f"PR Title: {pr_title}\nPR Description: {pr_description}")
+
+def write_pr_number(owner, repo, issue_number, pr_number):
+    store.upsert_issue(owner, repo, issue_number, pr_number=str(pr_number))
+    print(f"PR number {pr_number} stored for {owner}/{repo}#{issue_number}")
+
+def read_pr_choice(owner, repo, issue_number):
+    "Returns the PR plan chosen by the user as plain text, or None if none was chosen yet"
+    issue = store.get_issue(owner, repo, issue_number)
+    if issue is None or issue["pr_choice"] is None:
+        return None
+    return issue["pr_choice"].strip()
+
+def write_issue_result(owner, repo, issue_number, name, result):
+    "Keeps a generated guidebook section (e.g. the getting-started results) with the issue"
+    store.set_result(owner, repo, issue_number, name, result)
+
+def read_issue_results(owner, repo, issue_number):
+    issue = store.get_issue(owner, repo, issue_number)
+    return issue["results"] if issue is not None else {}
+
+def read_closed_issue_statuses(owner, repo, issue_numbers):
+    "Cached merged/outdated status of closed issues, as {issue number: status}"
+    return store.get_closed_statuses(owner, repo, issue_numbers)
+
+def write_closed_issue_statuses(owner, repo, statuses):
+    # A closed issue's linked PRs practically never change, so these are kept for good
+    store.set_closed_statuses(owner, repo, statuses)
+
+def read_repo_issues(owner, repo):
+    return store.get_repo_issues(owner, repo)
+
+def read_repo_issues_sync(owner, repo):
+    return store.get_repo_issues_sync(owner, repo)
+
+def write_repo_issues(owner, repo, issues, synced_at, checked_at, complete):
+    "Returns how many of the issues were new or changed"
+    return store.add_repo_issues(owner, repo, issues, synced_at, checked_at, complete)
+
+def read_pr_diff(owner, repo, pr_number, head_sha):
+    return store.get_pr_diff(owner, repo, pr_number, head_sha)
+
+def write_pr_diff(owner, repo, pr_number, head_sha, files, truncated):
+    store.set_pr_diff(owner, repo, pr_number, head_sha, files, truncated)
+
+def read_repo_guidelines(owner, repo):
+    """
+    Returns the repo-level contribution guidelines and the {path: blob sha} of the
+    files they were generated from, or (None, None) if they were never generated.
+    """
+    return store.get_repo_guidelines(owner, repo)
+
+def write_repo_guidelines(owner, repo, guidelines, sources):
+    store.set_repo_guidelines(owner, repo, guidelines, sources)
+
+def read_guideline_chunks(chunk_hashes):
+    return store.get_guideline_chunks(chunk_hashes)
+
+def write_guideline_chunk(chunk_hash, structured, max_age=30 * 24 * 3600):
+    store.set_guideline_chunk(chunk_hash, structured, max_age)
@@ -0,0 +1,434 @@
+import os
+import json
+import time
+import sqlite3
+from contextlib import contextmanager
+
+# Columns of an issue record, besides the (owner, repo, issue_number) key
+ISSUE_FIELDS = (
+    "title", "body", "repo_description", "contribution_guidelines",
+    "pr_choice", "pr_number", "results"
+)
+
+SCHEMA_VERSION = 8
+
+# A job another process may pick up: never started, or its owner stopped renewing the lease
+_CLAIMABLE = "(status = 'queued' OR (status = 'running' AND (lease_until IS NULL OR lease_until < ?)))"
+
+class IssueStore:
+    """
+    Keeps every issue the guidebook was generated for as one row of a SQLite
+    database (WAL mode, so readers never see a half-written record and never
+    block the writer), indexed by (owner, repo, issue_number).
+    Repo-level contribution guidelines live in a second table keyed by (owner, repo).
+    When the database is first created, the per-issue text files of an existing
+    data/ tree are imported into it (see migrate_data_dir).
+    """
+
+    def __init__(self, path, legacy_dir=None):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < 1:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS issues (
+                        owner TEXT NOT NULL,
+                        repo TEXT NOT NULL,
+                        issue_number TEXT NOT NULL,
+                        title TEXT,
+                        body TEXT,
+                        repo_description TEXT,
+                        contribution_guidelines TEXT,
+                        pr_choice TEXT,
+                        pr_number TEXT,
+                        results TEXT,
+                        updated_at REAL NOT NULL,
+                        PRIMARY KEY (owner, repo, issue_number)
+                    )
+                """)
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS repo_guidelines (
+                        owner TEXT NOT NULL,
+                        repo TEXT NOT NULL,
+                        guidelines TEXT NOT NULL,
+                        sources TEXT NOT NULL,
+                        updated_at REAL NOT NULL,
+                        PRIMARY KEY (owner, repo)
+                    )
+                """)
+                if legacy_dir and os.path.isdir(legacy_dir):
+                    migrated = migrate_data_dir(conn, legacy_dir)
+                    print(f"Imported {migrated} issues from {legacy_dir} into {path}")
+            if version < 2:
+                # Final state of closed issues, as found by duplicate detection
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS closed_issue_status (
+                        owner TEXT NOT NULL,
+                        repo TEXT NOT NULL,
+                        issue_number TEXT NOT NULL,
+                        status TEXT NOT NULL,
+                        PRIMARY KEY (owner, repo, issue_number)
+                    )
+                """)
+            if version < 3:
+                # Every issue of a repo, for the local duplicate index
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS repo_issues (
+                        owner TEXT NOT NULL,
+                        repo TEXT NOT NULL,
+                        issue_number INTEGER NOT NULL,
+                        title TEXT NOT NULL,
+                        body TEXT,
+                        state TEXT NOT NULL,
+                        html_url TEXT NOT NULL,
+                        updated_at TEXT NOT NULL,
+                        PRIMARY KEY (owner, repo, issue_number)
+                    )
+                """)
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS repo_issues_sync (
+                        owner TEXT NOT NULL,
+                        repo TEXT NOT NULL,
+                        synced_at TEXT NOT NULL,
+                        checked_at REAL NOT NULL,
+                        PRIMARY KEY (owner, repo)
+                    )
+                """)
+            if version < 4:
+                # Parsed diff of each PR's latest reviewed head commit
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS pr_diffs (
+                        owner TEXT NOT NULL,
+                        repo TEXT NOT NULL,
+                        pr_number TEXT NOT NULL,
+                        head_sha TEXT NOT NULL,
+                        files TEXT NOT NULL,
+                        truncated INTEGER NOT NULL,
+                        PRIMARY KEY (owner, repo, pr_number)
+                    )
+                """)
+            if version < 5:
+                # Background guidebook jobs, see utils/jobs.py
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS jobs (
+                        job_id TEXT PRIMARY KEY,
+                        kind TEXT NOT NULL,
+                        payload TEXT NOT NULL,
+                        status TEXT NOT NULL,
+                        results TEXT NOT NULL,
+                        error TEXT,
+                        created_at REAL NOT NULL,
+                        updated_at REAL NOT NULL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+            if version < 6:
+                # synced_at becomes a resume cursor, and `complete` says whether the first fill reached the end.
+                # Earlier syncs stopped after the newest pages and may have skipped older issues, so they start over.
+                conn.execute("ALTER TABLE repo_issues_sync ADD COLUMN complete INTEGER NOT NULL DEFAULT 0")
+                conn.execute("DELETE FROM repo_issues_sync")
+            if version < 7:
+                # Structured contribution guideline chunks, keyed by a hash of the chunk and repo description
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS guideline_chunks (
+                        chunk_hash TEXT PRIMARY KEY,
+                        structured TEXT NOT NULL,
+                        used_at REAL NOT NULL
+                    )
+                """)
+            if version < 8:
+                # The process running a job and until when its claim holds, so that several
+                # processes sharing the store never run the same job at once
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+                conn.execute("ALTER TABLE jobs ADD COLUMN lease_until REAL")
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get_issue(self, owner, repo, issue_number):
+        "Returns the issue record as a dict, or None if it was never stored"
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(ISSUE_FIELDS)} FROM issues WHERE owner = ? AND repo = ? AND issue_number = ?",
+                (owner, repo, str(issue_number))
+            ).fetchone()
+        if row is None:
+            return None
+        record = dict(zip(ISSUE_FIELDS, row))
+        record["results"] = json.loads(record["results"]) if record["results"] else {}
+        return record
+
+    def upsert_issue(self, owner, repo, issue_number, **fields):
+        "Atomically inserts the issue or updates only the given fields of it"
+        with self._connect() as conn:
+            _upsert_issue(conn, owner, repo, issue_number, fields)
+
+    def set_result(self, owner, repo, issue_number, name, value):
+        "Stores one derived result (e.g. a generated guide section) on the issue record"
+        with self._connect() as conn:
+            # Take the write lock before reading, so concurrent updates don't drop each other's results
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT results FROM issues WHERE owner = ? AND repo = ? AND issue_number = ?",
+                (owner, repo, str(issue_number))
+            ).fetchone()
+            results = json.loads(row[0]) if row and row[0] else {}
+            results[name] = value
+            _upsert_issue(conn, owner, repo, issue_number, {"results": json.dumps(results)})
+
+    def get_repo_guidelines(self, owner, repo):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT guidelines, sources FROM repo_guidelines WHERE owner = ? AND repo = ?", (owner, repo)
+            ).fetchone()
+        if row is None:
+            return None, None
+        return row[0], json.loads(row[1])
+
+    def set_repo_guidelines(self, owner, repo, guidelines, sources):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO repo_guidelines (owner, repo, guidelines, sources, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (owner, repo, guidelines, json.dumps(sources), time.time())
+            )
+
+    def get_guideline_chunks(self, chunk_hashes):
+        "Returns {chunk hash: structured text} for the chunks already structured, and marks them as used"
+        hashes = list(chunk_hashes)
+        if not hashes:
+            return {}
+        placeholders = ", ".join("?" * len(hashes))
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT chunk_hash, structured FROM guideline_chunks WHERE chunk_hash IN ({placeholders})", hashes
+            ).fetchall()
+            conn.execute(f"UPDATE guideline_chunks SET used_at = ? WHERE chunk_hash IN ({placeholders})", [time.time(), *hashes])
+        return dict(rows)
+
+    def set_guideline_chunk(self, chunk_hash, structured, max_age):
+        "Stores one structured chunk, dropping chunks no guideline has used for max_age seconds"
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO guideline_chunks (chunk_hash, structured, used_at) VALUES (?, ?, ?)",
+                (chunk_hash, structured, now)
+            )
+            conn.execute("DELETE FROM guideline_chunks WHERE used_at < ?", (now - max_age,))
+
+    def get_closed_statuses(self, owner, repo, issue_numbers):
+        "Returns {issue number: status} for the closed issues whose status is already known"
+        numbers = [str(n) for n in issue_numbers]
+        if not numbers:
+            return {}
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT issue_number, status FROM closed_issue_status WHERE owner = ? AND repo = ? AND issue_number IN ({', '.join('?' for _ in numbers)})",
+                (owner, repo, *numbers)
+            ).fetchall()
+        return {int(number): status for number, status in rows}
+
+    def set_closed_statuses(self, owner, repo, statuses):
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO closed_issue_status (owner, repo, issue_number, status) VALUES (?, ?, ?, ?)",
+                [(owner, repo, str(number), status) for number, status in statuses.items()]
+            )
+
+    def get_repo_issues(self, owner, repo):
+        "Every stored issue of the repo as (number, title, body, state, html_url) rows"
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT issue_number, title, body, state, html_url FROM repo_issues WHERE owner = ? AND repo = ?",
+                (owner, repo)
+            ).fetchall()
+
+    def get_repo_issues_sync(self, owner, repo):
+        """
+        Returns (synced_at, checked_at, complete) of the repo's issue sync, or (None, 0, False) if it never ran.
+        synced_at is the updated_at of the last stored issue, where the next sync resumes.
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT synced_at, checked_at, complete FROM repo_issues_sync WHERE owner = ? AND repo = ?", (owner, repo)
+            ).fetchone()
+        return (row[0], row[1], bool(row[2])) if row is not None else (None, 0, False)
+
+    def add_repo_issues(self, owner, repo, issues, synced_at, checked_at, complete):
+        """
+        Upserts issue rows (dicts as returned by the issues list endpoint) and records the sync in one transaction.
+        Returns how many issues were new or changed; a row whose updated_at is the stored one is left alone.
+        """
+        with self._connect() as conn:
+            changed = conn.executemany(
+                """
+                INSERT INTO repo_issues (owner, repo, issue_number, title, body, state, html_url, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (owner, repo, issue_number) DO UPDATE SET
+                    title = excluded.title, body = excluded.body, state = excluded.state,
+                    html_url = excluded.html_url, updated_at = excluded.updated_at
+                WHERE excluded.updated_at != repo_issues.updated_at
+                """,
+                [(owner, repo, i["number"], i["title"], i.get("body") or "", i["state"], i["html_url"], i["updated_at"]) for i in issues]
+            ).rowcount
+            conn.execute(
+                "INSERT OR REPLACE INTO repo_issues_sync (owner, repo, synced_at, checked_at, complete) VALUES (?, ?, ?, ?, ?)",
+                (owner, repo, synced_at, checked_at, int(complete))
+            )
+        return max(changed, 0)
+
+    def get_pr_diff(self, owner, repo, pr_number, head_sha):
+        "Returns (files, truncated) of the PR's diff at head_sha, or None if it is not stored"
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT files, truncated FROM pr_diffs WHERE owner = ? AND repo = ? AND pr_number = ? AND head_sha = ?",
+                (owner, repo, str(pr_number), head_sha)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), bool(row[1])
+
+    def set_pr_diff(self, owner, repo, pr_number, head_sha, files, truncated):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO pr_diffs (owner, repo, pr_number, head_sha, files, truncated) VALUES (?, ?, ?, ?, ?, ?)",
+                (owner, repo, str(pr_number), head_sha, json.dumps(files), int(truncated))
+            )
+
+    def create_job(self, job_id, kind, payload):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (job_id, kind, payload, status, results, created_at, updated_at) VALUES (?, ?, ?, 'queued', '{}', ?, ?)",
+                (job_id, kind, json.dumps(payload), now, now)
+            )
+
+    def get_job(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT job_id, kind, payload, status, results, error, created_at, updated_at FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(("job_id", "kind", "payload", "status", "results", "error", "created_at", "updated_at"), row))
+        job["payload"] = json.loads(job["payload"])
+        job["results"] = json.loads(job["results"])
+        return job
+
+    def unfinished_jobs(self):
+        "(job_id, kind, payload) of queued jobs and of running jobs whose lease ran out, oldest first"
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT job_id, kind, payload FROM jobs WHERE " + _CLAIMABLE + " ORDER BY created_at", (time.time(),)
+            ).fetchall()
+        return [(job_id, kind, json.loads(payload)) for job_id, kind, payload in rows]
+
+    def claim_job(self, job_id, owner, lease):
+        "Marks the job as running for `owner` for `lease` seconds. False if it is done or another owner holds it"
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, lease_until = ?, updated_at = ? WHERE job_id = ? AND " + _CLAIMABLE,
+                (owner, now + lease, now, job_id, now)
+            )
+        return cursor.rowcount == 1
+
+    def renew_job_leases(self, owner, lease):
+        "Extends the lease of every job `owner` is still running"
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE owner = ? AND status = 'running'", (time.time() + lease, owner)
+            )
+
+    def set_job_status(self, job_id, status, error=None, owner=None):
+        "With `owner`, only changes a job that owner still holds"
+        query = "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE job_id = ?"
+        params = (status, error, time.time(), job_id)
+        if owner is not None:
+            query += " AND owner = ?"
+            params += (owner,)
+        with self._connect() as conn:
+            conn.execute(query, params)
+
+    def set_job_result(self, job_id, name, value):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT results FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            results = json.loads(row[0]) if row else {}
+            results[name] = value
+            conn.execute(
+                "UPDATE jobs SET results = ?, updated_at = ? WHERE job_id = ?", (json.dumps(results), time.time(), job_id)
+            )
+
+    def delete_jobs_before(self, cutoff):
+        "Drops finished jobs last updated before the cutoff epoch"
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (cutoff,))
+
+def _upsert_issue(conn, owner, repo, issue_number, fields):
+    unknown = set(fields) - set(ISSUE_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown issue fields: {sorted(unknown)}")
+    columns = list(fields)
+    updates = ", ".join(f"{column} = excluded.{column}" for column in columns + ["updated_at"])
+    conn.execute(
+        f"""
+        INSERT INTO issues (owner, repo, issue_number, {', '.join(columns + ['updated_at'])})
+        VALUES (?, ?, ?, {', '.join('?' for _ in columns + ['updated_at'])})
+        ON CONFLICT (owner, repo, issue_number) DO UPDATE SET {updates}
+        """,
+        (owner, repo, str(issue_number), *fields.values(), time.time())
+    )
+
+def _read_text(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+def migrate_data_dir(conn, base_dir):
+    """
+    Imports a data/<owner>/<repo>/<issue>/*.txt tree (the storage used before the
+    SQLite store) through `conn`. Returns the number of issues imported.
+    """
+    migrated = 0
+    for owner in sorted(os.listdir(base_dir)):
+        owner_dir = os.path.join(base_dir, owner)
+        if not os.path.isdir(owner_dir):
+            continue
+        for repo in sorted(os.listdir(owner_dir)):
+            repo_dir = os.path.join(owner_dir, repo)
+            if not os.path.isdir(repo_dir):
+                continue
+
+            guidelines = _read_text(os.path.join(repo_dir, "contribution_guidelines.txt"))
+            sources = _read_text(os.path.join(repo_dir, "contribution_guidelines_sources.json"))
+            if guidelines is not None and sources is not None:
+                conn.execute(
+                    "INSERT OR IGNORE INTO repo_guidelines (owner, repo, guidelines, sources, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    (owner, repo, guidelines, sources, time.time())
+                )
+
+            for issue_number in sorted(os.listdir(repo_dir)):
+                issue_dir = os.path.join(repo_dir, issue_number)
+                if not os.path.isdir(issue_dir) or not os.path.exists(os.path.join(issue_dir, "title.txt")):
+                    continue
+                fields = {
+                    "title": _read_text(os.path.join(issue_dir, "title.txt")),
+                    "body": _read_text(os.path.join(issue_dir, "body.txt")),
+                    "repo_description": _read_text(os.path.join(issue_dir, "repo_description.txt")),
+                    "contribution_guidelines": _read_text(os.path.join(issue_dir, "contribution_guidelines.txt")),
+                    "pr_choice": _read_text(os.path.join(issue_dir, "pr_choice.txt")),
+                    "pr_number": _read_text(os.path.join(issue_dir, "pr_number.txt")),
+                }
+                _upsert_issue(conn, owner, repo, issue_number, fields)
+                migrated += 1
+    return migrated
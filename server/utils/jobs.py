@@ -0,0 +1,125 @@
+import os
+import time
+import uuid
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class JobQueue:
+    """
+    Runs guidebook pipelines in the background, so a request only has to submit a job
+    and then poll for it. Each job type has its own bounded worker pool.
+    Jobs and their partial results are persisted in `store` as every section finishes,
+    and jobs a previous process left unfinished are started again by resume().
+    A job is claimed in the store before it runs and its lease is renewed every `lease / 3`
+    seconds while it does, so several processes can share the store: each job runs in one
+    of them, and is only taken over once its owner stops renewing (e.g. after a crash).
+    `runners` maps a job type to fn(payload) returning an iterator of (section, result) pairs.
+    """
+
+    def __init__(self, store, runners, concurrency, keep_finished=24 * 3600, lease=300):
+        self.store = store
+        self.runners = runners
+        self.keep_finished = keep_finished
+        self.lease = lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._pools = {
+            kind: ThreadPoolExecutor(max_workers=concurrency.get(kind, 2), thread_name_prefix=f"job-{kind}")
+            for kind in runners
+        }
+        self._lock = threading.Lock()
+        self._last_cleanup = 0
+        self._running = 0
+        self._heartbeat = None
+        self._resumed = False
+
+    def submit(self, kind, payload):
+        "Queues a job and returns its id"
+        if kind not in self.runners:
+            raise ValueError(f"Unknown job type '{kind}'")
+        job_id = uuid.uuid4().hex
+        self.store.create_job(job_id, kind, payload)
+        self._pools[kind].submit(self._run, job_id, kind, payload)
+        self._cleanup()
+        return job_id
+
+    def _run(self, job_id, kind, payload):
+        # Another process (or an earlier resume() here) may already have it
+        if not self.store.claim_job(job_id, self.owner, self.lease):
+            return
+        self._started_running()
+        try:
+            for section, result in self.runners[kind](payload):
+                self.store.set_job_result(job_id, section, result)
+        except Exception as e:
+            print(f"Job {job_id} ({kind}) failed: {e}")
+            self.store.set_job_status(job_id, "failed", str(e), owner=self.owner)
+            return
+        finally:
+            self._stopped_running()
+        self.store.set_job_status(job_id, "done", owner=self.owner)
+
+    def _started_running(self):
+        with self._lock:
+            self._running += 1
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._renew_leases, name="job-leases", daemon=True)
+                self._heartbeat.start()
+
+    def _stopped_running(self):
+        with self._lock:
+            self._running -= 1
+
+    def _renew_leases(self):
+        while True:
+            time.sleep(self.lease / 3)
+            with self._lock:
+                running = self._running
+            if running:
+                try:
+                    self.store.renew_job_leases(self.owner, self.lease)
+                except Exception as e:
+                    print(f"Could not renew job leases: {e}")
+
+    def status(self, job_id):
+        "The job's status and the sections finished so far, or None for an unknown id"
+        job = self.store.get_job(job_id)
+        if job is None:
+            return None
+        return {
+            "job_id": job["job_id"],
+            "type": job["kind"],
+            "status": job["status"],
+            "results": job["results"],
+            "error": job["error"]
+        }
+
+    def resume(self):
+        """
+        Queues the jobs nobody is running: still queued, or left running by a process that
+        stopped renewing their lease. Only the first call in a process does anything.
+        """
+        with self._lock:
+            if self._resumed:
+                return
+            self._resumed = True
+        unfinished = self.store.unfinished_jobs()
+        for job_id, kind, payload in unfinished:
+            if kind in self.runners:
+                self._pools[kind].submit(self._run, job_id, kind, payload)
+        if unfinished:
+            print(f"Resumed {len(unfinished)} unfinished jobs")
+
+    def shutdown(self):
+        "Waits for the queued and running jobs to finish"
+        for pool in self._pools.values():
+            pool.shutdown(wait=True)
+
+    def _cleanup(self):
+        # Finished jobs are only kept around long enough to be polled
+        now = time.time()
+        with self._lock:
+            if now - self._last_cleanup < 3600:
+                return
+            self._last_cleanup = now
+        self.store.delete_jobs_before(now - self.keep_finished)
@@ -0,0 +1,173 @@
+import time
+import threading
+from contextlib import contextmanager
+from utils.ratelimit import resource_for_url
+
+# In-process metrics, served in the Prometheus text format by the /metrics endpoints.
+# Counters and histograms are updated where things happen; counts that other objects
+# already keep (cache hits, coalesced calls, ...) are copied in by collectors at scrape time.
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, value in self.samples():
+            lines.append(f"{name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return "\n".join(lines)
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        "Sets the count kept by another object since the process started (from a collector)"
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, (counts, total) in self.samples():
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{name}_bucket{_format_labels(self.labels, key, [('le', _format_value(bound))])} {count}")
+            lines.append(f"{name}_sum{_format_labels(self.labels, key)} {total!r}")
+            lines.append(f"{name}_count{_format_labels(self.labels, key)} {counts[-1]}")
+        return "\n".join(lines)
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        "Registers fn() to be called before every scrape, to refresh gauges from state kept elsewhere"
+        self.collectors.append(fn)
+        return fn
+
+    def render(self):
+        for collect in self.collectors:
+            try:
+                collect()
+            except Exception as e:
+                print(f"Metrics collector {collect.__name__} failed: {e}")
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+registry = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+http_request_seconds = registry.register(Histogram(
+    "guidebook_http_request_duration_seconds", "Time to answer an API request (until the response starts, for streams)",
+    ["endpoint", "method", "status"]
+))
+task_seconds = registry.register(Histogram(
+    "guidebook_task_duration_seconds", "Time spent in one guidebook function, LLM calls included", ["function"]
+))
+llm_calls = registry.register(Counter(
+    "guidebook_llm_calls_total", "LLM calls by guidebook function and by where the answer came from (model, cache or shared)",
+    ["function", "source"]
+))
+llm_tokens = registry.register(Counter(
+    "guidebook_llm_tokens_total", "Tokens sent to (input) and generated by (output) the model", ["function", "direction"]
+))
+llm_seconds = registry.register(Histogram(
+    "guidebook_llm_request_duration_seconds", "Time of one model call", ["function"]
+))
+github_requests = registry.register(Counter(
+    "guidebook_github_requests_total", "GitHub API requests by rate-limit resource and status code", ["resource", "status"]
+))
+github_seconds = registry.register(Histogram(
+    "guidebook_github_request_duration_seconds", "Time of one GitHub API request", ["resource"]
+))
+github_ratelimit_remaining = registry.register(Gauge(
+    "guidebook_github_ratelimit_remaining", "Last-seen X-RateLimit-Remaining per rate-limit resource", ["resource"]
+))
+cache_hits = registry.register(Counter(
+    "guidebook_cache_hits_total", "Lookups answered by a cache", ["cache"]
+))
+cache_misses = registry.register(Counter(
+    "guidebook_cache_misses_total", "Lookups a cache could not answer", ["cache"]
+))
+coalesced_calls = registry.register(Counter(
+    "guidebook_coalesced_calls_total", "Calls that shared an identical call already in flight", ["flight"]
+))
+
+def set_cache_stats(cache, hits, misses):
+    cache_hits.set_total(hits, cache=cache)
+    cache_misses.set_total(misses, cache=cache)
+
+def record_github_response(url, response, seconds):
+    "Counts one GitHub response and remembers the rate-limit budget it reports"
+    resource = response.headers.get("X-RateLimit-Resource") or resource_for_url(url)
+    github_requests.inc(resource=resource, status=response.status_code)
+    github_seconds.observe(seconds, resource=resource)
+    remaining = response.headers.get("X-RateLimit-Remaining")
+    if remaining is not None:
+        github_ratelimit_remaining.set(int(remaining), resource=resource)
@@ -0,0 +1,116 @@
+import os
+from utils.guidebook import classify_issue, verify_feature_uniqueness, check_issue_alignment_with_vision, check_issue_scope, understand_relevant_contribution_guidelines, generate_getting_started_checklist, generate_steps, explain_tests
+from utils.scraping import get_pr_diff, detect_duplicates
+from utils.diffs import render_diff
+from utils.io import read_issue_files, write_issue_result
+from utils.review import iter_pr_review
+from utils.tasks import iter_task_graph, call_sync
+
+# Upper bound on concurrent LLM/GitHub calls made for a single guidebook section
+GUIDEBOOK_MAX_WORKERS = int(os.getenv("GUIDEBOOK_MAX_WORKERS", 4))
+# Generate the getting-started checklist from a single structured LLM call instead of one call per section
+GETTING_STARTED_BATCHED = os.getenv("GETTING_STARTED_BATCHED", "").lower() in ("1", "true", "yes")
+
+# The guidebook pipelines yield (section, result) pairs as each subtask finishes.
+# `relay(section, fn)` optionally wraps a subtask, e.g. to stream its LLM output.
+# The task builders take `call(fn, *args)`, which runs a subtask: directly on the
+# blocking path (call_sync), or as a coroutine on the asyncio path (see utils/aio.py).
+
+def no_relay(section, fn):
+    return fn
+
+def getting_started_tasks(owner, repo, issue_number, issue_files, call=call_sync, batched=False):
+    title = issue_files["title"]
+    body = issue_files["body"]
+    repo_description = issue_files["repo_description"]
+    contribution_guidelines = issue_files["contribution_guidelines"]
+
+    if batched:
+        # One structured LLM call for the whole checklist, next to the duplicate search
+        return {
+            "issue_duplicates": (lambda: call(detect_duplicates, owner, repo, title, issue_number), []),
+            "checklist": (lambda: call(generate_getting_started_checklist, owner, repo, title, body, repo_description, contribution_guidelines, issue_number), []),
+        }
+
+    # Only the feature checks depend on issue_type, everything else can start right away
+    return {
+        "issue_duplicates": (lambda: call(detect_duplicates, owner, repo, title, issue_number), []),
+        "issue_type": (lambda: call(classify_issue, title, body), []),
+        "tune_contribution_guidelines": (lambda: call(understand_relevant_contribution_guidelines, owner, repo, title, body, contribution_guidelines), []),
+        "feature_uniqueness": (lambda issue_type: call(verify_feature_uniqueness, owner, repo, title, body, issue_type), ["issue_type"]),
+        "align_with_project_vision": (lambda issue_type: call(check_issue_alignment_with_vision, repo_description, title, body, contribution_guidelines, issue_type), ["issue_type"]),
+        "issue_scope": (lambda issue_type: call(check_issue_scope, repo_description, title, body, contribution_guidelines, issue_type, issue_number), ["issue_type"]),
+    }
+
+def implementation_tasks(owner, repo, issue_number, issue_files, pr_title, pr_description, suggestion_level, call=call_sync):
+    title = issue_files["title"]
+    body = issue_files["body"]
+    repo_description = issue_files["repo_description"]
+    contribution_guidelines = issue_files["contribution_guidelines"]
+
+    return {
+        "steps": (lambda: call(
+            generate_steps, owner, repo, title, issue_number, body, repo_description, contribution_guidelines,
+            pr_title, pr_description, suggestion_level
+        ), []),
+        "tests": (lambda: call(
+            explain_tests, owner, repo, title, issue_number, body, repo_description, contribution_guidelines,
+            pr_title, pr_description, suggestion_level
+        ), []),
+    }
+
+def record_sections(owner, repo, issue_number, guide, sections):
+    "Passes the (section, result) pairs through, and stores them with the issue once all of them are done"
+    results = {}
+    for section, result in sections:
+        results[section] = result
+        yield section, result
+    write_issue_result(owner, repo, issue_number, guide, results)
+
+def relay_tasks(tasks, relay):
+    # issue_type is only an intermediate result, it is not part of the guide
+    return {name: (fn if name == "issue_type" else relay(name, fn), deps) for name, (fn, deps) in tasks.items()}
+
+def iter_getting_started(owner, repo, issue_number, relay=no_relay):
+    issue_files = read_issue_files(owner, repo, issue_number)
+
+    if GETTING_STARTED_BATCHED:
+        tasks = getting_started_tasks(owner, repo, issue_number, issue_files, batched=True)
+        checklist = None
+        for section, result in iter_task_graph(tasks, max_workers=GUIDEBOOK_MAX_WORKERS):
+            if section == "checklist":
+                checklist = result
+            else:
+                yield section, result
+        if checklist is not None:
+            for section, result in checklist.items():
+                if section != "issue_type":
+                    yield section, result
+            return
+        print("Could not parse the batched checklist, falling back to one call per section")
+
+    tasks = getting_started_tasks(owner, repo, issue_number, issue_files)
+    if GETTING_STARTED_BATCHED:
+        # Duplicates were already sent above
+        del tasks["issue_duplicates"]
+    for section, result in iter_task_graph(relay_tasks(tasks, relay), max_workers=GUIDEBOOK_MAX_WORKERS):
+        if section != "issue_type":
+            yield section, result
+
+def iter_implementation(owner, repo, issue_number, pr_title, pr_description, suggestion_level, relay=no_relay):
+    issue_files = read_issue_files(owner, repo, issue_number)
+    tasks = implementation_tasks(owner, repo, issue_number, issue_files, pr_title, pr_description, suggestion_level)
+    yield from iter_task_graph(relay_tasks(tasks, relay), max_workers=GUIDEBOOK_MAX_WORKERS)
+
+def iter_pr_review_sections(owner, repo, issue_number, pr_number, relay=no_relay):
+    issue_files = read_issue_files(owner, repo, issue_number)
+    repo_description = issue_files["repo_description"]
+    contribution_guidelines = issue_files["contribution_guidelines"]
+
+    # Firstly extract the patch body, then pass it
+    pr_diff = get_pr_diff(owner, repo, pr_number)
+    diff_files = pr_diff["files"] if pr_diff else None
+    diff = render_diff(diff_files) if pr_diff else None
+
+    # The checks are independent of each other, so they run in parallel on the same diff
+    yield from iter_pr_review(owner, repo, issue_number, repo_description, contribution_guidelines, diff, wrap=relay, diff_files=diff_files)
@@ -0,0 +1,160 @@
+import time
+import threading
+import requests
+
+# Sustained request rates GitHub allows per token, as (requests, per seconds)
+DEFAULT_RATES = {
+    "core": (5000, 3600),
+    "search": (30, 60),
+    "graphql": (5000, 3600),
+}
+
+class RateLimitExceeded(requests.exceptions.RequestException):
+    "Raised when no token has budget left and the caller cannot wait long enough for one"
+
+    def __init__(self, resource, retry_after):
+        super().__init__(f"GitHub {resource} rate limit exhausted, retry in {int(retry_after) + 1}s")
+        self.retry_after = retry_after
+
+def resource_for_url(url):
+    "The GitHub rate-limit bucket a request to this URL is charged against"
+    if "/search/" in url:
+        return "search"
+    if url.rstrip("/").endswith("/graphql"):
+        return "graphql"
+    return "core"
+
+class TokenBucket:
+    "Smooths bursts so one request spike does not burn a whole rate-limit window"
+
+    def __init__(self, requests_per_window, window, burst=None):
+        self.rate = requests_per_window / window
+        self.capacity = burst or max(1, min(requests_per_window, 10))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        "Seconds until one request can be taken from the bucket"
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+class RateLimitScheduler:
+    """
+    Hands out GitHub tokens for requests, rotating across a pool so no single
+    token runs out. Budgets are tracked separately per token and per resource
+    (core, search, graphql) from the X-RateLimit-* response headers, with a
+    local token bucket in front to keep queued calls at a sustainable pace.
+    Callers that can wait are blocked until budget frees up (backpressure);
+    callers that cannot get a RateLimitExceeded.
+    """
+
+    def __init__(self, tokens, rates=None):
+        if not tokens:
+            raise ValueError("At least one GitHub token is required")
+        self.tokens = list(tokens)
+        self.rates = dict(DEFAULT_RATES, **(rates or {}))
+        self._buckets = {}
+        # (token, resource) -> (remaining, reset epoch) as last reported by GitHub
+        self._budgets = {}
+        # (token, resource) -> epoch before which the token must not be used (secondary limits)
+        self._blocked_until = {}
+        self._cond = threading.Condition()
+
+    def _bucket(self, token, resource):
+        key = (token, resource)
+        if key not in self._buckets:
+            self._buckets[key] = TokenBucket(*self.rates.get(resource, self.rates["core"]))
+        return self._buckets[key]
+
+    def _wait_time(self, token, resource):
+        "Seconds until this token may be used for the resource, 0 if it can be used now"
+        now = time.time()
+        key = (token, resource)
+        waits = [self._bucket(token, resource).wait_time(time.monotonic())]
+        remaining, reset = self._budgets.get(key, (None, 0))
+        if remaining is not None and remaining < 1 and reset > now:
+            waits.append(reset - now)
+        waits.append(self._blocked_until.get(key, 0) - now)
+        return max(0, *waits)
+
+    def _remaining(self, token, resource):
+        remaining, reset = self._budgets.get((token, resource), (None, 0))
+        if remaining is None or reset <= time.time():
+            return float("inf")
+        return remaining
+
+    def acquire(self, resource="core", max_wait=0):
+        """
+        Reserve one request against `resource` and return the token to send it with.
+        Blocks for up to `max_wait` seconds when every token is out of budget.
+        """
+        deadline = time.monotonic() + max_wait
+        with self._cond:
+            while True:
+                token, delay = self._try_acquire(resource)
+                if token:
+                    return token
+                if time.monotonic() + delay > deadline:
+                    raise RateLimitExceeded(resource, delay)
+                self._cond.wait(delay)
+
+    def try_acquire(self, resource="core"):
+        """
+        Non-blocking acquire: returns (token, 0) if a request can be sent now,
+        or (None, seconds until one can) otherwise. Used by the asyncio path.
+        """
+        with self._cond:
+            return self._try_acquire(resource)
+
+    def _try_acquire(self, resource):
+        waits = {token: self._wait_time(token, resource) for token in self.tokens}
+        ready = [token for token, wait in waits.items() if wait == 0]
+        if not ready:
+            return None, min(waits.values())
+        # Prefer the token with the most budget left, so load spreads across the pool
+        token = max(ready, key=lambda t: (self._remaining(t, resource), self._bucket(t, resource).tokens))
+        self._bucket(token, resource).take()
+        return token, 0
+
+    def update(self, token, resource, response):
+        "Record the budget GitHub reported on a response sent with `token`"
+        with self._cond:
+            # GitHub reports which bucket the request was charged against
+            resource = response.headers.get("X-RateLimit-Resource", resource)
+            remaining = response.headers.get("X-RateLimit-Remaining")
+            reset = response.headers.get("X-RateLimit-Reset")
+            if remaining is not None and reset is not None:
+                self._budgets[(token, resource)] = (int(remaining), int(reset))
+            if response.status_code == 304:
+                # Conditional hits are free on GitHub's side
+                self._bucket(token, resource).refund()
+            retry_after = response.headers.get("Retry-After")
+            if response.status_code in (403, 429) and retry_after:
+                self._blocked_until[(token, resource)] = time.time() + int(retry_after)
+            self._cond.notify_all()
+
+    def is_rate_limited(self, response):
+        "Whether a response was rejected because of a primary or secondary rate limit"
+        if response.status_code not in (403, 429):
+            return False
+        return response.headers.get("X-RateLimit-Remaining") == "0" or "Retry-After" in response.headers
+
+    def status(self):
+        "Last-seen remaining budget per token (masked) and resource"
+        with self._cond:
+            return {
+                f"...{token[-4:]}:{resource}": {"remaining": remaining, "reset": reset}
+                for (token, resource), (remaining, reset) in self._budgets.items()
+            }
@@ -0,0 +1,127 @@
+import re
+import math
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from utils.duplicate_index import tokenize
+
+def count_tokens(text):
+    "Cheap estimate of the model tokens in text (about four characters per token)"
+    return math.ceil(len(text or "") / 4)
+
+def split_passages(guidelines, max_tokens=400):
+    """
+    Splits structured guidelines into (heading, text) passages: one per "## " section,
+    with long sections cut further at paragraph boundaries so they can be picked in parts.
+    Text before the first heading (or guidelines without headings) gets an empty heading.
+    """
+    sections = []
+    heading, lines = "", []
+    for line in (guidelines or "").splitlines():
+        if line.lstrip().startswith("## "):
+            if "".join(lines).strip():
+                sections.append((heading, "\n".join(lines).strip()))
+            heading, lines = line.strip(), []
+        else:
+            lines.append(line)
+    if "".join(lines).strip():
+        sections.append((heading, "\n".join(lines).strip()))
+
+    passages = []
+    for heading, text in sections:
+        current = ""
+        for paragraph in re.split(r"\n\s*\n", text):
+            if current and count_tokens(current + paragraph) > max_tokens:
+                passages.append((heading, current.strip()))
+                current = ""
+            current += paragraph + "\n\n"
+        if current.strip():
+            passages.append((heading, current.strip()))
+    return passages
+
+class BM25Index:
+    "Okapi BM25 over guideline passages; the section heading is indexed with the passage text"
+
+    def __init__(self, passages, k1=1.5, b=0.75):
+        self.passages = passages
+        self.k1 = k1
+        self.b = b
+        self.term_counts = [Counter(tokenize(f"{heading} {text}")) for heading, text in passages]
+        self.lengths = [sum(counts.values()) for counts in self.term_counts]
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0
+        document_frequency = Counter(term for counts in self.term_counts for term in counts)
+        total = len(passages)
+        self.idf = {term: math.log(1 + (total - df + 0.5) / (df + 0.5)) for term, df in document_frequency.items()}
+
+    def scores(self, query):
+        terms = [term for term in tokenize(query) if term in self.idf]
+        scores = []
+        for counts, length in zip(self.term_counts, self.lengths):
+            score = 0.0
+            for term in terms:
+                tf = counts.get(term, 0)
+                if tf:
+                    norm = self.k1 * (1 - self.b + self.b * length / (self.average_length or 1))
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            scores.append(score)
+        return scores
+
+# Indexes of the most recently used guideline texts, keyed by a hash of the text.
+# Subtasks look them up from many threads at once.
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+def _index_for(guidelines):
+    key = hashlib.sha256(guidelines.encode("utf-8")).hexdigest()
+    with _indexes_lock:
+        if key in _indexes:
+            _indexes.move_to_end(key)
+            return _indexes[key]
+    # Built outside the lock; two threads building the same index at once only waste a little work
+    index = BM25Index(split_passages(guidelines))
+    with _indexes_lock:
+        _indexes[key] = index
+        _indexes.move_to_end(key)
+        while len(_indexes) > 32:
+            _indexes.popitem(last=False)
+    return index
+
+def select_guidelines(guidelines, query, max_tokens, sections=()):
+    """
+    Returns the parts of the guidelines most relevant to `query` that fit in max_tokens.
+    Passages under a heading containing one of `sections` are taken first, then the rest by
+    BM25 score; passages that share no term with the query are left out.
+    The selection keeps the original order and headings. Guidelines that already fit are returned unchanged.
+    """
+    if not guidelines or count_tokens(guidelines) <= max_tokens:
+        return guidelines
+
+    index = _index_for(guidelines)
+    scores = index.scores(query)
+    wanted = [s.lower() for s in sections]
+
+    def priority(i):
+        heading = index.passages[i][0].lower()
+        return (any(s in heading for s in wanted), scores[i])
+
+    chosen = set()
+    used = 0
+    for i in sorted(range(len(index.passages)), key=priority, reverse=True):
+        focus, score = priority(i)
+        if not focus and score <= 0:
+            break
+        tokens = count_tokens(index.passages[i][1]) + count_tokens(index.passages[i][0]) + 1
+        if used + tokens > max_tokens:
+            continue
+        chosen.add(i)
+        used += tokens
+
+    parts = []
+    last_heading = None
+    for i in sorted(chosen):
+        heading, text = index.passages[i]
+        if heading and heading != last_heading:
+            parts.append(heading)
+        parts.append(text)
+        last_heading = heading
+    return "\n\n".join(parts) if parts else guidelines[:max_tokens * 4]
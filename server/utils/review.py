@@ -0,0 +1,195 @@
+import os
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+from utils.guidebook import llm_listener, validate_pr_resolution, enforce_contribution_guidelines, clear_pr_description, tests_presence, merge_review_findings, merge_guideline_reports
+from utils.io import read_pr_choice
+from utils.diffs import render_file, render_diff
+from utils.tasks import call_sync
+from utils.tracing import in_current_context
+
+# Seconds each review check may take before a partial result is returned in its place.
+# Sharded reviews get this much per round of shard calls (see review_timeout).
+REVIEW_CHECK_TIMEOUT = int(os.getenv("REVIEW_CHECK_TIMEOUT", 120))
+# Diffs longer than this (in characters) are reviewed in shards of at most this size
+REVIEW_SHARD_CHARS = int(os.getenv("REVIEW_SHARD_CHARS", 60000))
+# Shard calls of one review (all of its checks together) running at the same time
+REVIEW_SHARD_WORKERS = int(os.getenv("REVIEW_SHARD_WORKERS", 4))
+# Checks that run once per shard when a review is sharded, plus their merge call
+SHARDED_CHECKS = 3
+
+def partial_review_result(check, reason):
+    "Placeholder for a check that failed or timed out, in the same shape as the check's normal output"
+    message = f"This check could not be completed ({reason}). Please try again."
+    if check == "enforce_contribution_guidelines":
+        return {"error": message}
+    return message
+
+def missing_pr_choice_results():
+    return {
+        "validate_pr_resolution": "PR choice not found. User must select a PR plan first.",
+        "enforce_contribution_guidelines": {"error": "PR choice not found. User must select a PR plan first."},
+        "clear_pr_description": "PR choice not found. User must select a PR plan first.",
+        "tests_presence": "PR choice not found. User must select a PR plan first."
+    }
+
+def shard_diff(files, max_chars):
+    """
+    Groups the files of a parsed diff into shards of at most max_chars of diff text.
+    Files are kept whole where possible; a file that is larger than a shard is split between its hunks.
+    Returns the diff text of each shard.
+    """
+    pieces = []
+    for file_diff in files:
+        if len(render_file(file_diff)) <= max_chars or len(file_diff["hunks"]) <= 1:
+            pieces.append(file_diff)
+            continue
+        hunks = []
+        for hunk in file_diff["hunks"]:
+            if hunks and len(render_file({**file_diff, "hunks": hunks + [hunk]})) > max_chars:
+                pieces.append({**file_diff, "hunks": hunks})
+                hunks = []
+            hunks.append(hunk)
+        pieces.append({**file_diff, "hunks": hunks})
+
+    shards = []
+    current = []
+    size = 0
+    for piece in pieces:
+        piece_size = len(render_file(piece)) + 1
+        if current and size + piece_size > max_chars:
+            shards.append(current)
+            current = []
+            size = 0
+        current.append(piece)
+        size += piece_size
+    if current:
+        shards.append(current)
+    return [render_diff(shard) for shard in shards]
+
+def diff_shards(diff, diff_files):
+    "The diff text of each shard a review splits the diff into, or None when it fits one prompt"
+    if diff_files and diff and len(diff) > REVIEW_SHARD_CHARS:
+        return shard_diff(diff_files, REVIEW_SHARD_CHARS)
+    return None
+
+def review_timeout(shards, timeout=REVIEW_CHECK_TIMEOUT):
+    """
+    Deadline for a whole review: `timeout` for an unsharded one, and `timeout` per round of
+    REVIEW_SHARD_WORKERS shard calls, plus one round for the merge, for a sharded one.
+    """
+    if not shards:
+        return timeout
+    return timeout * (math.ceil(SHARDED_CHECKS * len(shards) / REVIEW_SHARD_WORKERS) + 1)
+
+def diff_summary(files):
+    "One line per changed file, for checks that need to know what changed but not how"
+    return "\n".join(f"{f['path']} ({f['status']}, +{f['additions']} -{f['deletions']})" for f in files)
+
+def review_shards(check, shard_args, merge, merge_args=(), slots=None):
+    """
+    Runs check(*args) for every shard's args in parallel, then reduces the results with merge(findings, *merge_args).
+    `slots` (a semaphore shared by the checks of one review) bounds the shard calls running at once.
+    Only the merge streams its text to the check's listener: shards finishing at the same time
+    would interleave their pieces.
+    """
+    slots = slots or threading.BoundedSemaphore(REVIEW_SHARD_WORKERS)
+
+    def review(args):
+        # Every call runs in its own copy of the request context, so this only affects the shard
+        llm_listener.set(None)
+        with slots:
+            return check(*args)
+
+    with ThreadPoolExecutor(max_workers=min(len(shard_args), REVIEW_SHARD_WORKERS)) as pool:
+        findings = list(pool.map(in_current_context(review), shard_args))
+    return merge(findings, *merge_args)
+
+def sharded_pr_review_checks(owner, repo, issue_number, repo_description, contribution_guidelines, diff_files, shards, pr_choice_text, call=call_sync, slots=None):
+    """
+    Same checks as pr_review_checks for diffs too large for one prompt: validation, guideline and
+    test checks run on every shard in parallel and are merged by a final LLM call, so latency follows
+    the largest shard instead of the whole PR. The description check only needs the list of changed files.
+    """
+    print(f"Reviewing {owner}/{repo}#{issue_number}'s PR in {len(shards)} shards")
+    return {
+        "validate_pr_resolution": lambda: call(
+            review_shards, validate_pr_resolution,
+            [(owner, repo, issue_number, repo_description, shard, pr_choice_text) for shard in shards],
+            merge_review_findings, ("Check whether the PR fully implements the chosen PR plan, and list what is still missing.",), slots
+        ),
+        "enforce_contribution_guidelines": lambda: call(
+            review_shards, enforce_contribution_guidelines,
+            [(owner, repo, issue_number, contribution_guidelines, shard, pr_choice_text) for shard in shards],
+            merge_guideline_reports, (), slots
+        ),
+        "clear_pr_description": lambda: call(clear_pr_description, owner, repo, issue_number, contribution_guidelines, diff_summary(diff_files), pr_choice_text),
+        "tests_presence": lambda: call(
+            review_shards, tests_presence,
+            [(owner, repo, issue_number, contribution_guidelines, shard, pr_choice_text) for shard in shards],
+            merge_review_findings, ("Check whether the PR includes automated tests, suggest additional tests and manual testing steps.",), slots
+        ),
+    }
+
+def pr_review_checks(owner, repo, issue_number, repo_description, contribution_guidelines, diff, pr_choice_text, call=call_sync, diff_files=None, shards=None, slots=None):
+    """
+    The four review checks, as name -> zero-argument callable running the check through call(fn, *args).
+    When `shards` (see diff_shards) are given, the checks are sharded and `slots` bounds their shard calls.
+    """
+    if shards:
+        return sharded_pr_review_checks(owner, repo, issue_number, repo_description, contribution_guidelines, diff_files, shards, pr_choice_text, call, slots)
+    return {
+        "validate_pr_resolution": lambda: call(validate_pr_resolution, owner, repo, issue_number, repo_description, diff, pr_choice_text),
+        "enforce_contribution_guidelines": lambda: call(enforce_contribution_guidelines, owner, repo, issue_number, contribution_guidelines, diff, pr_choice_text),
+        "clear_pr_description": lambda: call(clear_pr_description, owner, repo, issue_number, contribution_guidelines, diff, pr_choice_text),
+        "tests_presence": lambda: call(tests_presence, owner, repo, issue_number, contribution_guidelines, diff, pr_choice_text),
+    }
+
+def iter_pr_review(owner, repo, issue_number, repo_description, contribution_guidelines, diff, timeout=REVIEW_CHECK_TIMEOUT, wrap=None, diff_files=None):
+    """
+    Runs the four PR review checks in parallel against a single diff.
+    The PR choice is read once and shared by every check.
+    Yields (check name, result) pairs in the order the checks finish.
+    A check that raises or does not finish within the review's deadline (`timeout`, scaled by
+    review_timeout for sharded diffs) gets a partial result instead of failing the whole review.
+    `wrap(name, fn)` may replace a check with a wrapped version of it (used for streaming).
+    Pass the parsed `diff_files` to allow sharding large diffs (see sharded_pr_review_checks).
+    """
+    pr_choice_text = read_pr_choice(owner, repo, issue_number)
+    if pr_choice_text is None:
+        yield from missing_pr_choice_results().items()
+        return
+
+    shards = diff_shards(diff, diff_files)
+    timeout = review_timeout(shards, timeout)
+    checks = pr_review_checks(
+        owner, repo, issue_number, repo_description, contribution_guidelines, diff, pr_choice_text,
+        diff_files=diff_files, shards=shards, slots=threading.BoundedSemaphore(REVIEW_SHARD_WORKERS)
+    )
+    if wrap is not None:
+        checks = {name: wrap(name, check) for name, check in checks.items()}
+
+    executor = ThreadPoolExecutor(max_workers=len(checks))
+    try:
+        futures = {executor.submit(in_current_context(check)): name for name, check in checks.items()}
+        try:
+            # All checks start together, so they share one deadline
+            for future in as_completed(futures, timeout=timeout):
+                name = futures.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Review check {name} failed: {e}")
+                    result = partial_review_result(name, "failed")
+                yield name, result
+        except TimeoutError:
+            for name in futures.values():
+                print(f"Review check {name} timed out after {timeout}s")
+                yield name, partial_review_result(name, "timed out")
+    finally:
+        # Don't hold the response for checks that already timed out
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def run_pr_review(owner, repo, issue_number, repo_description, contribution_guidelines, diff, timeout=REVIEW_CHECK_TIMEOUT):
+    "Same as iter_pr_review, but returns a dict of check name -> result"
+    return dict(iter_pr_review(owner, repo, issue_number, repo_description, contribution_guidelines, diff, timeout))
@@ -1,18 +1,55 @@
 import os
 import re
 import requests
+import time
 import base64
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from bs4 import BeautifulSoup
-from utils.io import read_issue_files, write_issue_files
+from utils.io import read_issue_files, write_issue_files, read_repo_guidelines, write_repo_guidelines, read_guideline_chunks, write_guideline_chunk, read_closed_issue_statuses, write_closed_issue_statuses, read_pr_diff, write_pr_diff
 from utils.guidebook import call_llm
+from utils.github import GitHubClient
+from utils.ratelimit import RateLimitScheduler
+from utils.duplicate_index import DuplicateIndex
+from utils.diffs import parse_diff, render_diff, cut_at_line
+from utils.singleflight import SingleFlight
+from utils.metrics import registry, set_cache_stats, coalesced_calls
+from utils.tracing import in_current_context
 
 github_token = os.getenv('GITHUB_AUTH_TOKEN')
 if not github_token:
     raise ValueError("GITHUB_AUTH_TOKEN not found in .env file")
+# Optional comma-separated pool of extra tokens to rotate across, next to GITHUB_AUTH_TOKEN
+github_tokens = list(dict.fromkeys(
+    t.strip() for t in [github_token] + os.getenv('GITHUB_AUTH_TOKENS', '').split(",") if t.strip()
+))
 headers = {
     "Accept": "application/vnd.github+json",
     "Authorization": f"Bearer {github_token}"
 }
+# One pooled, revalidating, rate-limit-aware client shared by every GitHub call
+github = GitHubClient(
+    headers,
+    scheduler=RateLimitScheduler(github_tokens),
+    max_wait=int(os.getenv('GITHUB_RATE_LIMIT_MAX_WAIT', 60))
+)
+
+# Diffs larger than this are cut off (at a line boundary) before they are reviewed
+PR_DIFF_MAX_BYTES = int(os.getenv('PR_DIFF_MAX_BYTES', 1024 * 1024))
+
+guideline_flights = SingleFlight()
+
+@registry.collector
+def collect_github_metrics():
+    # Revalidations answered with a 304, which cost no rate-limit quota
+    set_cache_stats("github_etag", github.hits, github.misses)
+    coalesced_calls.set_total(guideline_flights.shared, flight="guidelines")
+
+# Concurrency and total time budget (seconds) for crawling a repo's contribution guidelines
+GUIDELINES_CRAWL_WORKERS = int(os.getenv('GUIDELINES_CRAWL_WORKERS', 8))
+GUIDELINES_CRAWL_BUDGET = int(os.getenv('GUIDELINES_CRAWL_BUDGET', 30))
+# Concurrent LLM calls used to structure and merge the guideline chunks
+GUIDELINES_LLM_WORKERS = int(os.getenv('GUIDELINES_LLM_WORKERS', 4))
 
 
 # use the issue url, to fetch repo information, issue information, and other required information...
@@ -25,46 +62,234 @@ def convert_issue_http_to_api_url(url: str) -> str:
 def fetch_issue(issueUrl):
     issueApiUrl = convert_issue_http_to_api_url(issueUrl)
     try:
-        response = requests.get(issueApiUrl, headers=headers, timeout=10)
+        response = github.get(issueApiUrl, timeout=10)
         response.raise_for_status()
-        # Handle rate limits
-        remaining = int(response.headers.get('X-RateLimit-Remaining', 0))
-        if remaining < 1:
-            # TODO: return an error message saying wait until the reset time
-            reset_time = int(response.headers.get('X-RateLimit-Reset', 0))
         return response.json()
     except requests.exceptions.RequestException as e:
         print(f"Error fetching {issueApiUrl}: {e}")
         return None
     
-def gather_contribution_guidelines(owner, repo, repo_description, chunk_size=4000):
+# Everything generate_guidebook needs about an issue and its repository, for one issue per alias
+ISSUE_GRAPHQL_FIELDS = """
+    description
+    defaultBranchRef { name }
+    issue(number: $number%(i)d) {
+        number
+        title
+        body
+        url
+        state
+        labels(first: 20) { nodes { name } }
+        comments(first: 30) { nodes { author { login } body createdAt } }
+    }
+"""
+
+def parse_issue_url(issueUrl):
+    "Returns (owner, repo, issue number) of a github.com issue URL, or None"
+    match = re.match(r"https://github\.com/([^/]+)/([^/]+)/issues/(\d+)", issueUrl.strip())
+    if not match:
+        return None
+    return match.group(1), match.group(2), int(match.group(3))
+
+def build_issues_query(issues):
+    "GraphQL query (and its variables) fetching every (owner, repo, number) in `issues` under aliases i0, i1, ..."
+    declarations = []
+    selections = []
+    variables = {}
+    for i, (owner, repo, number) in enumerate(issues):
+        declarations.append(f"$owner{i}: String!, $repo{i}: String!, $number{i}: Int!")
+        fields = ISSUE_GRAPHQL_FIELDS % {"i": i}
+        selections.append(f"i{i}: repository(owner: $owner{i}, name: $repo{i}) {{{fields}}}")
+        variables.update({f"owner{i}": owner, f"repo{i}": repo, f"number{i}": number})
+    return f"query({', '.join(declarations)}) {{\n{chr(10).join(selections)}\n}}", variables
+
+def issue_from_graphql(owner, repo, node):
     """
-    Fetch and aggregate contribution guidelines for a repository.
-    Handles long docs via recursive binary merging of chunks.
+    Converts one aliased repository node into the (issue_data, repo_data) pair the REST
+    endpoints return, so store_issue_info works with either. Returns None if the issue was not found.
     """
+    if not node or not node.get("issue"):
+        return None
+    issue = node["issue"]
+    repo_api_url = f"https://api.github.com/repos/{owner}/{repo}"
+    issue_data = {
+        "url": f"{repo_api_url}/issues/{issue['number']}",
+        "repository_url": repo_api_url,
+        "html_url": issue["url"],
+        "number": issue["number"],
+        "title": issue["title"],
+        "body": issue["body"],
+        "state": issue["state"].lower(),
+        "labels": [{"name": label["name"]} for label in issue["labels"]["nodes"]],
+        "comments": [
+            {"user": (comment["author"] or {}).get("login"), "body": comment["body"], "created_at": comment["createdAt"]}
+            for comment in issue["comments"]["nodes"]
+        ]
+    }
+    repo_data = {
+        "description": node["description"],
+        "default_branch": (node["defaultBranchRef"] or {}).get("name")
+    }
+    return issue_data, repo_data
 
-    base_path = os.path.join("data", owner, repo)
-    os.makedirs(base_path, exist_ok=True)
-    file_path = os.path.join(base_path, "contribution_guidelines.txt")
+def fetch_issues_bulk(issueUrls):
+    """
+    Fetch many issues together with their repository metadata in a single GraphQL round-trip.
+    Returns one (issue_data, repo_data) pair per URL, or None for URLs that could not be fetched.
+    """
+    parsed = [parse_issue_url(url) for url in issueUrls]
+    issues = [p for p in parsed if p]
+    if not issues:
+        return [None] * len(issueUrls)
 
-    possible_paths = [
-        "CONTRIBUTING.md", ".github/CONTRIBUTING.md", "docs/CONTRIBUTING.md",
-        "CONTRIBUTING.rst", "README.md", "CODE_OF_CONDUCT.md",
-        "docs/STYLEGUIDE.md", "STYLEGUIDE.md", "DEVELOPER.md"
-    ]
+    query, variables = build_issues_query(issues)
+    try:
+        data = github.graphql(query, variables)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Error fetching issues over GraphQL: {e}")
+        return [None] * len(issueUrls)
 
-    fetched_texts = []
+    fetched = iter(issue_from_graphql(owner, repo, data.get(f"i{i}")) for i, (owner, repo, _) in enumerate(issues))
+    return [next(fetched) if p else None for p in parsed]
 
-    def fetch_github_file(path):
-        url = f"https://api.github.com/repos/{owner}/{repo}/contents/{path}"
-        try:
-            r = requests.get(url, headers=headers, timeout=10)
-            if r.status_code == 200:
-                data = r.json()
-                return base64.b64decode(data.get("content", "")).decode("utf-8")
-        except Exception:
-            return None
-        return None
+def fetch_issue_with_repo(issueUrl):
+    """
+    Returns (issue_data, repo_data) for one issue URL, in one GraphQL call when possible and
+    with the two REST calls otherwise. Returns (None, None) if the issue could not be fetched.
+    """
+    fetched = fetch_issues_bulk([issueUrl])[0]
+    if fetched is not None:
+        return fetched
+    issue_data = fetch_issue(issueUrl)
+    if not issue_data:
+        return None, None
+    return issue_data, fetch_repo(issue_data["repository_url"])
+
+def list_issue_urls(owner, repo, labels=(), state="open", limit=100):
+    "URLs of up to `limit` of the repo's issues (pull requests excluded) carrying all of `labels`, newest first"
+    url = f"https://api.github.com/repos/{owner}/{repo}/issues"
+    params = {"state": state, "per_page": 100}
+    if labels:
+        params["labels"] = ",".join(labels)
+    urls = []
+    while url and len(urls) < limit:
+        response = github.get(url, params=params, timeout=30, cache=False)
+        response.raise_for_status()
+        urls += [item["html_url"] for item in response.json() if "pull_request" not in item]
+        url, params = response.links.get("next", {}).get("url"), None
+    return urls[:limit]
+
+def split_into_chunks(text, max_chars):
+    "Splits text into chunks of at most max_chars, cutting at paragraph (or line) boundaries where possible"
+    chunks = []
+    current = ""
+    for paragraph in re.split(r"(\n\s*\n)", text):
+        while len(paragraph) > max_chars:
+            # A single paragraph that is too long is cut at the last line break that fits
+            cut = paragraph.rfind("\n", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(paragraph[:cut])
+            paragraph = paragraph[cut:]
+        if len(current) + len(paragraph) > max_chars:
+            chunks.append(current)
+            current = ""
+        current += paragraph
+    if current.strip():
+        chunks.append(current)
+    return [chunk for chunk in chunks if chunk.strip()]
+
+# Files a repo's contribution guidelines are taken from, in order of preference (the first one found wins)
+GUIDELINE_PATHS = [
+    "CONTRIBUTING.md", ".github/CONTRIBUTING.md", "docs/CONTRIBUTING.md",
+    "CONTRIBUTING.rst", "README.md", "CODE_OF_CONDUCT.md",
+    "docs/STYLEGUIDE.md", "STYLEGUIDE.md", "DEVELOPER.md"
+]
+# Candidate paths probed at once. A missing file is a 404, which the ETag cache cannot answer
+# and which costs core quota, so later (less preferred) paths are only probed when needed.
+GUIDELINES_PROBE_WAVE = int(os.getenv('GUIDELINES_PROBE_WAVE', 3))
+
+def guideline_probe_waves(cached_sources):
+    """
+    The candidate paths in the groups they are probed in: the file the stored guidelines came
+    from on its own (it usually still exists, and then nothing else is probed), then the rest
+    by preference, GUIDELINES_PROBE_WAVE at a time.
+    """
+    preferred = [path for path in (cached_sources or {}) if path in GUIDELINE_PATHS][:1]
+    rest = [path for path in GUIDELINE_PATHS if path not in preferred]
+    waves = [preferred] if preferred else []
+    return waves + [rest[i:i + GUIDELINES_PROBE_WAVE] for i in range(0, len(rest), GUIDELINES_PROBE_WAVE)]
+
+def fetch_guideline_file(owner, repo, path):
+    """
+    Returns (content, blob sha) of the file, (None, None) if it does not exist,
+    or raises if GitHub could not say (timeout, rate limit, server error)
+    """
+    r = github.get(f"https://api.github.com/repos/{owner}/{repo}/contents/{path}", timeout=10)
+    if r.status_code == 404:
+        return None, None
+    r.raise_for_status()
+    return guideline_file_content(r.json())
+
+def guideline_file_content(data):
+    "(content, blob sha) from a contents API response, or (None, None) for a directory"
+    if not isinstance(data, dict) or data.get("type") != "file":
+        return None, None
+    return base64.b64decode(data.get("content", "")).decode("utf-8", errors="replace"), data.get("sha")
+
+def pick_guideline_file(owner, repo, wave, outcomes):
+    """
+    The (path, content, sha) of the first file of a probe wave that was found, or None,
+    and whether a probe before it failed. `outcomes` holds (content, sha) or the exception per path.
+    """
+    failed = False
+    for path, outcome in zip(wave, outcomes):
+        if isinstance(outcome, BaseException):
+            print(f"Could not probe {owner}/{repo}/{path}: {outcome!r}")
+            failed = True
+            continue
+        content, sha = outcome
+        if content:
+            return (path, content, sha), failed
+    return None, failed
+
+def probe_guideline_files(owner, repo, cached_sources, keep_cached, executor, deadline):
+    """
+    Probes the candidate paths wave by wave (see guideline_probe_waves) on `executor`.
+    Returns ({path: blob sha} of the file found or {}, its content, and whether a probe failed).
+    With `keep_cached` (stored guidelines exist and will be kept on a failed probe), stops at the first failure.
+    """
+    uncertain = False
+    for wave in guideline_probe_waves(cached_sources):
+        futures = [executor.submit(in_current_context(fetch_guideline_file), owner, repo, path) for path in wave]
+        outcomes = []
+        for future in futures:
+            try:
+                outcomes.append(future.result(timeout=max(0, deadline - time.monotonic())))
+            except Exception as e:
+                outcomes.append(e)
+        found, failed = pick_guideline_file(owner, repo, wave, outcomes)
+        uncertain = uncertain or failed
+        if found:
+            path, content, sha = found
+            return {path: sha}, content, uncertain
+        if uncertain and keep_cached:
+            break
+    return {}, None, uncertain
+
+def gather_contribution_guidelines(owner, repo, repo_description, chunk_size=4000, probed=None):
+    """
+    Fetch and aggregate contribution guidelines for a repository.
+    The guidelines come from the first of GUIDELINE_PATHS the repo has (see guideline_probe_waves),
+    plus the pages it links to. Handles long docs via recursive binary merging of chunks:
+    each source document is split into chunks of roughly chunk_size tokens,
+    the chunks are structured in parallel and then merged pairwise in a tree.
+    `probed` is the result of probe_guideline_files when the caller already probed (the asyncio app does).
+    """
+
+    fetched_texts = []
 
     def fetch_external_url(url):
         try:
@@ -78,25 +303,49 @@ def gather_contribution_guidelines(owner, repo, repo_description, chunk_size=400
             return None
         return None
 
-    for path in possible_paths:
-        content = fetch_github_file(path)
+    # Candidate paths and linked pages are fetched concurrently, but the whole crawl
+    # shares one time budget so a slow external site cannot stall the guidebook.
+    deadline = time.monotonic() + GUIDELINES_CRAWL_BUDGET
+    executor = ThreadPoolExecutor(max_workers=GUIDELINES_CRAWL_WORKERS)
+    try:
+        # The guidelines only depend on the repo, so they are reused across issues
+        # for as long as the source file's blob sha is unchanged.
+        # Unchanged files are revalidated with a 304 by the GitHub client, so this probe is cheap.
+        cached_guidelines, cached_sources = read_repo_guidelines(owner, repo)
+        if probed is None:
+            probed = probe_guideline_files(owner, repo, cached_sources, cached_guidelines is not None, executor, deadline)
+        sources, content, uncertain = probed
+
+        if cached_guidelines is not None and (cached_sources == sources or uncertain):
+            if uncertain:
+                print(f"Probing {owner}/{repo}'s guideline files failed, keeping the stored guidelines")
+            else:
+                print(f"Reusing contribution guidelines for {owner}/{repo}")
+            return cached_guidelines
+
         if content:
             fetched_texts.append(content)
-            links = re.findall(r"https?://[^\s\)\]]+", content)
+            links = list(dict.fromkeys(re.findall(r"https?://[^\s\)\]]+", content)))
             print("The Links are:", links)
-            for link in links:
-                ext_text = fetch_external_url(link)
+            link_futures = [executor.submit(in_current_context(fetch_external_url), link) for link in links]
+            # Keep the linked pages in the order they appear in the file
+            for link, future in zip(links, link_futures):
+                try:
+                    ext_text = future.result(timeout=max(0, deadline - time.monotonic()))
+                except FuturesTimeoutError:
+                    print(f"Skipping {link}: contribution guidelines crawl budget exceeded")
+                    continue
                 if ext_text:
                     fetched_texts.append(ext_text)
-            break  # Stop after first valid file
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
 
     if not fetched_texts:
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write("No contribution guidelines found.")
+        # Only remembered when every candidate really is missing, so a failed probe is retried by the next issue
+        if not uncertain:
+            write_repo_guidelines(owner, repo, "No contribution guidelines found.", sources)
         return "No contribution guidelines found."
 
-    unstructured_guidelines = ''.join(fetched_texts)
-
     # TODO: only keep the sentences that are important to the file
     def process_chunk(text, repo_description):
         prompt = f"""
@@ -126,11 +375,66 @@ def gather_contribution_guidelines(owner, repo, repo_description, chunk_size=400
         {text}
         """
         return call_llm(prompt)
-    
-    structured_guidelines = process_chunk(unstructured_guidelines, repo_description)
 
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write(structured_guidelines)
+    def merge_two(text_a, text_b):
+        prompt = f"""
+        Merge the following two structured contribution guidelines into ONE comprehensive version.
+        Preserve all details, avoid redundancy, and keep the same section structure.
+
+        --- Guidelines A ---
+        {text_a}
+
+        --- Guidelines B ---
+        {text_b}
+        """
+        # A failed merge keeps both sides as they are rather than losing one of them
+        return call_llm(prompt) or f"{text_a}\n\n{text_b}"
+
+    def chunk_hash(chunk):
+        return hashlib.sha256(f"{repo_description}\0{chunk}".encode("utf-8")).hexdigest()
+
+    def structure_chunk(chunk, known):
+        key = chunk_hash(chunk)
+        if key in known:
+            return known[key]
+        structured = process_chunk(chunk, repo_description)
+        if structured:
+            write_guideline_chunk(key, structured)
+        return structured
+
+    def merge_level(pool, groups):
+        "Merges neighbours pairwise within each group, one level for all groups at once"
+        jobs = [(g, group[i:i + 2]) for g, group in enumerate(groups) for i in range(0, len(group), 2)]
+        merged = pool.map(in_current_context(lambda job: merge_two(*job[1]) if len(job[1]) == 2 else job[1][0]), jobs)
+        next_groups = [[] for _ in groups]
+        for (g, _), text in zip(jobs, merged):
+            next_groups[g].append(text)
+        return next_groups
+
+    # Map: structure every chunk in parallel. Chunks are cut per source document and their results
+    # are stored by a hash of their content, so an edit to one page only re-runs that page's chunks.
+    # Reduce: the chunks of each document are merged within that document first, then the documents
+    # with each other. A page that changes or gains a chunk only re-runs the merges on its own path,
+    # and one that drops out of the crawl only shifts the few merges between documents;
+    # the rest are answered from the LLM cache.
+    documents = [split_into_chunks(text, chunk_size * 4) for text in fetched_texts]
+    known = read_guideline_chunks({chunk_hash(chunk) for chunks in documents for chunk in chunks})
+    with ThreadPoolExecutor(max_workers=GUIDELINES_LLM_WORKERS) as pool:
+        flat = [chunk for chunks in documents for chunk in chunks]
+        results = iter(pool.map(in_current_context(lambda chunk: structure_chunk(chunk, known)), flat))
+        groups = [[r for r in [next(results) for _ in chunks] if r] for chunks in documents]
+        while any(len(group) > 1 for group in groups):
+            groups = merge_level(pool, groups)
+        structured = [group[0] for group in groups if group]
+        while len(structured) > 1:
+            structured = merge_level(pool, [structured])[0]
+
+    if not structured:
+        # Don't store anything, so the next issue tries again
+        return "No contribution guidelines found."
+    structured_guidelines = structured[0]
+
+    write_repo_guidelines(owner, repo, structured_guidelines, sources)
 
     return structured_guidelines
 
@@ -139,26 +443,30 @@ def clean_issue_info(issue_data):
     if not issue_data:
         # TODO: throw an error
         return None
-    repo_api_url = issue_data["repository_url"]
-    api_url = issue_data["url"]
-    title = issue_data["title"]
-    body = issue_data["body"]
     # TODO: find out if and how to get description about repo, and related files, etc.
+    repo_data = fetch_repo(issue_data["repository_url"])
+    return store_issue_info(issue_data, repo_data)
+
+def fetch_repo(repo_api_url):
     try:
-        response = requests.get(repo_api_url, headers=headers, timeout=10)
+        response = github.get(repo_api_url, timeout=10)
         response.raise_for_status()
-        # Handle rate limits
-        remaining = int(response.headers.get('X-RateLimit-Remaining', 0))
-        if remaining < 1:
-            # TODO: return an error message saying wait until the reset time
-            reset_time = int(response.headers.get('X-RateLimit-Reset', 0))
-        repo_data =  response.json()
+        return response.json()
     except requests.exceptions.RequestException as e:
         print(f"Error fetching {repo_api_url}: {e}")
         return None
+
+def store_issue_info(issue_data, repo_data, contribution_guidelines=None):
+    """
+    Writes the issue files (and the repo's contribution guidelines) from already fetched issue and repo data.
+    Guidelines already gathered for the repo can be passed in to skip gathering them again.
+    """
     if not repo_data:
         # TODO: throw an error
         return None
+    api_url = issue_data["url"]
+    title = issue_data["title"]
+    body = issue_data["body"]
     repo_description = repo_data["description"]
     match = re.match(r"https://api\.github\.com/repos/([^/]+)/([^/]+)/issues/(\d+)", api_url)
     if match:
@@ -171,9 +479,17 @@ def clean_issue_info(issue_data):
     else:
         print("Invalid GitHub API issue URL")
     # TODO: Also extract the comments and the review comments for the repository
-    contribution_guidelines = gather_contribution_guidelines(repo_author_name, repo_name, repo_description)
+    # Issues of the same repo prepared at the same time share one crawl of its guidelines
+    if contribution_guidelines is None:
+        contribution_guidelines = guideline_flights.do(
+            (repo_author_name, repo_name),
+            lambda: gather_contribution_guidelines(repo_author_name, repo_name, repo_description)
+        )
 
     write_issue_files(repo_author_name, repo_name, issue_number, title, body, repo_description, contribution_guidelines)
+    if not DUPLICATE_INDEX_DISABLED:
+        # Start indexing the repo's issues now, so duplicate detection can use the index soon
+        duplicate_index.warm(repo_author_name, repo_name)
 
     return {
         "repo_author": repo_author_name,
@@ -181,66 +497,155 @@ def clean_issue_info(issue_data):
         "issue_number": issue_number
     }
 
-def get_diff(owner, repo, pr_number):
-    pr_api_url = "https://api.github.com/repos/" + owner + "/" + repo + "/pulls/" + pr_number
-    diff_url = pr_api_url + ".diff"
+def fetch_pr_head_sha(owner, repo, pr_number):
+    # Revalidated with the PR's ETag, so an unchanged PR costs a free 304
+    response = github.get(f"https://api.github.com/repos/{owner}/{repo}/pulls/{pr_number}", timeout=10)
+    response.raise_for_status()
+    return response.json()["head"]["sha"]
+
+def get_pr_diff(owner, repo, pr_number):
+    """
+    Returns the PR's diff parsed into per-file hunks, as {"head_sha", "files", "truncated"}.
+    The diff is streamed and cut after PR_DIFF_MAX_BYTES, and cached per head commit,
+    so reviewing an unchanged PR again downloads no diff at all.
+    Returns None if the PR could not be fetched.
+    """
     try:
-        response = requests.get(diff_url, headers=headers, timeout=10)
-        response.raise_for_status()
-        # Handle rate limits
-        remaining = int(response.headers.get('X-RateLimit-Remaining', 0))
-        if remaining < 1:
-            # TODO: return an error message saying wait until the reset time
-            reset_time = int(response.headers.get('X-RateLimit-Reset', 0))
-        return response.json()
+        head_sha = fetch_pr_head_sha(owner, repo, pr_number)
+        cached = read_pr_diff(owner, repo, pr_number, head_sha)
+        if cached is not None:
+            files, truncated = cached
+            return {"head_sha": head_sha, "files": files, "truncated": truncated}
+
+        diff_url = f"https://api.github.com/repos/{owner}/{repo}/pulls/{pr_number}"
+        body, truncated = github.get_capped(diff_url, PR_DIFF_MAX_BYTES, headers={"Accept": "application/vnd.github.diff"}, timeout=30)
     except requests.exceptions.RequestException as e:
-        print(f"Error fetching {diff_url}: {e}")
+        print(f"Error fetching the diff of {owner}/{repo}#{pr_number}: {e}")
+        return None
+
+    if truncated:
+        print(f"Diff of {owner}/{repo}#{pr_number} is larger than {PR_DIFF_MAX_BYTES} bytes, reviewing the first part only")
+        body = cut_at_line(body)
+    files = parse_diff(body.decode("utf-8", errors="replace"))
+    write_pr_diff(owner, repo, pr_number, head_sha, files, truncated)
+    return {"head_sha": head_sha, "files": files, "truncated": truncated}
+
+def get_diff(owner, repo, pr_number):
+    "The PR's diff as unified diff text, or None if it could not be fetched"
+    pr_diff = get_pr_diff(owner, repo, pr_number)
+    if pr_diff is None:
         return None
+    return render_diff(pr_diff["files"])
+
+# Number of similar issues returned by detect_duplicates
+DUPLICATE_RESULTS = int(os.getenv('DUPLICATE_RESULTS', 3))
+# Find duplicates in a local index of the repo's issues instead of with the Search API
+DUPLICATE_INDEX_DISABLED = os.getenv('DUPLICATE_INDEX_DISABLED', '').lower() in ("1", "true", "yes")
+duplicate_index = DuplicateIndex(
+    github,
+    refresh_interval=int(os.getenv('DUPLICATE_INDEX_REFRESH', 300)),
+    max_pages=int(os.getenv('DUPLICATE_INDEX_MAX_PAGES', 30))
+)
 
+def build_linked_pr_query(issue_numbers):
+    "GraphQL query for the pull requests that closed or cross-referenced each issue, aliased as n<number>"
+    selections = "\n".join(f"""
+        n{number}: issue(number: {int(number)}) {{
+            closedByPullRequestsReferences(first: 5, includeClosedPrs: true) {{ nodes {{ merged }} }}
+            timelineItems(itemTypes: [CROSS_REFERENCED_EVENT], first: 20) {{
+                nodes {{ ... on CrossReferencedEvent {{ source {{ ... on PullRequest {{ merged }} }} }} }}
+            }}
+        }}""" for number in issue_numbers)
+    return f"query($owner: String!, $repo: String!) {{ repository(owner: $owner, name: $repo) {{{selections}\n}} }}"
 
-def detect_duplicates(owner, repo, issue_title):
+def linked_pr_statuses_from_graphql(issue_numbers, data):
+    "A closed issue is 'merged' if a PR that closed or referenced it was merged, 'outdated' otherwise"
+    repository = (data or {}).get("repository") or {}
+    statuses = {}
+    for number in issue_numbers:
+        issue = repository.get(f"n{number}")
+        if not issue:
+            continue
+        prs = issue["closedByPullRequestsReferences"]["nodes"]
+        prs += [event["source"] for event in issue["timelineItems"]["nodes"] if event.get("source")]
+        statuses[number] = "merged" if any(pr.get("merged") for pr in prs) else "outdated"
+    return statuses
+
+def closed_issue_statuses(owner, repo, issue_numbers):
     """
-    Detect similar issues in the same repository using GitHub Search API.
-    Returns a list of up to 3 similar issues with title, url, and status.
+    Merged/outdated status of closed issues, resolved for all of them in one GraphQL query.
+    Statuses are cached per issue; issues that could not be resolved come back as 'closed'.
     """
-    search_url = "https://api.github.com/search/issues"
-    query = f"{issue_title} repo:{owner}/{repo} type:issue"
-    params = {
-        "q": query,
+    statuses = read_closed_issue_statuses(owner, repo, issue_numbers)
+    missing = [number for number in issue_numbers if number not in statuses]
+    if missing:
+        try:
+            data = github.graphql(build_linked_pr_query(missing), {"owner": owner, "repo": repo})
+            resolved = linked_pr_statuses_from_graphql(missing, data)
+            write_closed_issue_statuses(owner, repo, resolved)
+            statuses.update(resolved)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Error resolving linked pull requests: {e}")
+    return {number: statuses.get(number, "closed") for number in issue_numbers}
+
+def duplicate_search_params(owner, repo, issue_title):
+    return {
+        "q": f"{issue_title} repo:{owner}/{repo} type:issue",
         "sort": "created",
         "order": "desc",
-        "per_page": 3
+        "per_page": DUPLICATE_RESULTS
     }
 
+def duplicate_results(items, closed_statuses):
+    return [
+        {
+            "title": item["title"],
+            "url": item["html_url"],
+            "status": closed_statuses[item["number"]] if item["state"] == "closed" else "open",
+            **({"score": item["score"]} if "score" in item else {})
+        }
+        for item in items
+    ]
+
+def local_duplicates(owner, repo, issue_title, issue_number=None):
+    """
+    Ranked search hits from the local duplicate index, shaped like Search API items
+    (plus a similarity score), or None if the repo is not indexed yet or the index could not be brought up to date.
+    """
+    exclude = int(issue_number) if issue_number is not None else None
     try:
-        response = requests.get(search_url, headers=headers, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-
-        results = []
-        for item in data.get("items", []):
-            status_label = "open"
-            if item["state"] == "closed":
-                # Check if closed issue is linked to a merged PR
-                issue_number = item["number"]
-                timeline_url = f"https://api.github.com/repos/{owner}/{repo}/issues/{issue_number}/timeline"
-                timeline_resp = requests.get(timeline_url, headers={**headers, "Accept": "application/vnd.github.mockingbird-preview"}, timeout=10)
-                if timeline_resp.status_code == 200:
-                    events = timeline_resp.json()
-                    merged = any(e.get("event") == "cross-referenced" and e.get("source", {}).get("type") == "pull_request" for e in events)
-                    status_label = "merged" if merged else "outdated"
-                else:
-                    status_label = "closed"
-            else:
-                status_label = "open"
+        matches = duplicate_index.similar_issues(owner, repo, issue_title, limit=DUPLICATE_RESULTS, exclude=exclude)
+    except requests.exceptions.RequestException as e:
+        print(f"Error updating the duplicate index, using the Search API instead: {e}")
+        return None
+    if matches is None:
+        print(f"The duplicate index of {owner}/{repo} is still being filled, using the Search API instead")
+        return None
+    return [
+        {"number": number, "title": title, "state": state, "html_url": html_url, "score": round(score, 3)}
+        for score, (number, title, _, state, html_url) in matches
+    ]
+
+def detect_duplicates(owner, repo, issue_title, issue_number=None):
+    """
+    Detect similar issues in the same repository.
+    Issues are ranked by a local TF-IDF index of the repo's issues (no search quota);
+    the GitHub Search API is used when the index is disabled or cannot be updated.
+    Returns a list of up to DUPLICATE_RESULTS similar issues with title, url, and status.
+    """
+    items = None if DUPLICATE_INDEX_DISABLED else local_duplicates(owner, repo, issue_title, issue_number)
 
-            results.append({
-                "title": item["title"],
-                "url": item["html_url"],
-                "status": status_label
-            })
+    try:
+        if items is None:
+            search_url = "https://api.github.com/search/issues"
+            params = duplicate_search_params(owner, repo, issue_title)
+            response = github.get(search_url, params=params, timeout=10)
+            response.raise_for_status()
+            items = response.json().get("items", [])
 
-        return results
+        # Check if closed issues are linked to a merged PR, all at once
+        closed = [item["number"] for item in items if item["state"] == "closed"]
+        return duplicate_results(items, closed_issue_statuses(owner, repo, closed))
 
     except requests.exceptions.RequestException as e:
         print(f"Error searching for duplicates: {e}")
@@ -0,0 +1,69 @@
+import json
+import asyncio
+import threading
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one: the first caller runs fn,
+    callers arriving while it is in flight wait for it and share its result (or exception).
+    Nothing is kept once the call finishes, so later calls run again.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.shared = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+class AsyncSingleFlight:
+    "SingleFlight for coroutines on one event loop: make_coro() is only awaited by the first caller"
+
+    def __init__(self):
+        self._calls = {}
+        self.shared = 0
+
+    async def do(self, key, make_coro):
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(make_coro())
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._calls.pop(key) if self._calls.get(key) is f else None)
+        else:
+            self.shared += 1
+        # One caller going away must not cancel the call the others are waiting for
+        return await asyncio.shield(future)
+
+def request_key(endpoint, payload):
+    "Flight key of an API request: the endpoint plus its JSON body (owner, repo, issue and options)"
+    return (endpoint, json.dumps(payload, sort_keys=True))
@@ -0,0 +1,164 @@
+import time
+import asyncio
+import threading
+
+class _Run:
+    def __init__(self):
+        self.expires_at = None
+        self.sections = []
+        self.done = False
+        self.failed = False
+        self.changed = threading.Condition()
+
+class Speculator:
+    """
+    Runs a pipeline ahead of the request that is expected to ask for it and keeps its
+    (section, result) pairs for `ttl` seconds after it finishes.
+    At most `max_concurrent` speculative runs happen at once; anything beyond that is
+    dropped rather than queued, so speculation never takes workers away from real requests.
+    """
+
+    def __init__(self, max_concurrent=2, ttl=600):
+        self.ttl = ttl
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._runs = {}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.skipped = 0
+        self.hits = 0
+        self.misses = 0
+
+    def start(self, key, make_sections):
+        "Starts make_sections() in the background under key, unless one is already running or all slots are busy"
+        with self._lock:
+            current = self._runs.get(key)
+            if current is not None and not current.done:
+                return False
+        if not self._slots.acquire(blocking=False):
+            self.skipped += 1
+            return False
+        run = _Run()
+        with self._lock:
+            self._drop_expired()
+            self._runs[key] = run
+            self.started += 1
+        threading.Thread(target=self._run, args=(run, make_sections), daemon=True).start()
+        return True
+
+    def _run(self, run, make_sections):
+        try:
+            for section, result in make_sections():
+                with run.changed:
+                    run.sections.append((section, result))
+                    run.changed.notify_all()
+        except Exception as e:
+            print(f"Speculative run failed: {e}")
+            run.failed = True
+        finally:
+            self._slots.release()
+            with run.changed:
+                run.expires_at = time.time() + self.ttl
+                run.done = True
+                run.changed.notify_all()
+
+    def take(self, key):
+        """
+        An iterator over the sections of the speculative run for key, yielding them as they
+        finish if it is still going, or None if there is no usable run (none, expired or failed).
+        """
+        with self._lock:
+            self._drop_expired()
+            run = self._runs.get(key)
+        if run is None or run.failed:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._follow(run)
+
+    def _follow(self, run):
+        sent = 0
+        while True:
+            with run.changed:
+                while sent == len(run.sections) and not run.done:
+                    run.changed.wait()
+                pending = run.sections[sent:]
+                finished = run.done
+            for section, result in pending:
+                yield section, result
+            sent += len(pending)
+            if finished and sent == len(run.sections):
+                if run.failed:
+                    raise RuntimeError("The speculative run failed before finishing")
+                return
+
+    def _drop_expired(self):
+        now = time.time()
+        for key in [key for key, run in self._runs.items() if run.done and run.expires_at < now]:
+            del self._runs[key]
+
+class AsyncSpeculator:
+    """
+    Speculator for coroutines on one event loop: make_coro() runs as a task whose result is kept
+    for `ttl` seconds after it finishes. At most `max_concurrent` run at once, and a run that
+    fails is dropped right away, so the request it was meant for runs the work itself.
+    """
+
+    def __init__(self, max_concurrent=2, ttl=600):
+        self.ttl = ttl
+        self.max_concurrent = max_concurrent
+        # key -> (task, expires_at once it finished)
+        self._runs = {}
+        self._running = 0
+        self.started = 0
+        self.skipped = 0
+        self.hits = 0
+        self.misses = 0
+
+    def start(self, key, make_coro):
+        "Starts make_coro() as a task under key, unless one is already running or all slots are busy"
+        self._drop_expired()
+        current = self._runs.get(key)
+        if current is not None and not current[0].done():
+            return False
+        if self._running >= self.max_concurrent:
+            self.skipped += 1
+            return False
+        task = asyncio.ensure_future(make_coro())
+        self._runs[key] = (task, None)
+        self._running += 1
+        self.started += 1
+        task.add_done_callback(lambda task: self._finished(key, task))
+        return True
+
+    def _finished(self, key, task):
+        self._running -= 1
+        failed = task.cancelled() or task.exception() is not None
+        if failed:
+            print(f"Speculative run failed: {'cancelled' if task.cancelled() else task.exception()}")
+        if self._runs.get(key, (None,))[0] is not task:
+            return
+        if failed:
+            del self._runs[key]
+        else:
+            self._runs[key] = (task, time.time() + self.ttl)
+
+    async def take(self, key):
+        "The result of the speculative run for key, awaited if it is still going, or None if there is no usable run"
+        self._drop_expired()
+        run = self._runs.get(key)
+        if run is None:
+            self.misses += 1
+            return None
+        try:
+            # A request that goes away must not cancel the run for the others
+            result = await asyncio.shield(run[0])
+        except Exception:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def _drop_expired(self):
+        now = time.time()
+        for key in [key for key, (task, expires_at) in self._runs.items() if expires_at is not None and expires_at < now]:
+            del self._runs[key]
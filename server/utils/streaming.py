@@ -0,0 +1,52 @@
+import json
+import queue
+import threading
+from flask import Response
+from utils.guidebook import stream_llm_output
+from utils.tracing import in_current_context
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_sections(make_sections):
+    """
+    Streams a guidebook pipeline as Server-Sent Events.
+    `make_sections(relay)` must return an iterator of (section, result) pairs;
+    `relay(section, fn)` wraps a subtask so the LLM text it generates is sent
+    as it arrives. Events emitted:
+      - delta:   {"section": ..., "text": ...}   a piece of LLM output
+      - section: {"section": ..., "result": ...} a finished subtask, same shape as the JSON endpoint
+      - error:   {"error": ...}
+      - done:    {}
+    """
+    events = queue.Queue()
+
+    def relay(section, fn):
+        def relayed(*args, **kwargs):
+            with stream_llm_output(lambda text: events.put(("delta", {"section": section, "text": text}))):
+                return fn(*args, **kwargs)
+        return relayed
+
+    def run():
+        try:
+            for section, result in make_sections(relay):
+                events.put(("section", {"section": section, "result": result}))
+        except Exception as e:
+            print(f"Error while streaming sections: {e}")
+            events.put(("error", {"error": str(e)}))
+        events.put(("done", {}))
+
+    threading.Thread(target=in_current_context(run), daemon=True).start()
+
+    def generate():
+        while True:
+            event, data = events.get()
+            yield format_sse(event, data)
+            if event == "done":
+                break
+
+    return Response(generate(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # Stop proxies (e.g. nginx) from buffering the whole stream
+        "X-Accel-Buffering": "no"
+    })
@@ -0,0 +1,81 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from utils.tracing import in_current_context
+
+def call_sync(fn, *args):
+    "Runs a subtask on the blocking path (task builders take a `call` so they can also run as coroutines)"
+    return fn(*args)
+
+def iter_task_graph(tasks, max_workers=4):
+    """
+    Run a set of dependent subtasks concurrently on a bounded thread pool.
+    `tasks` maps a task name to (fn, deps): fn is called with the results of
+    the tasks named in deps as keyword arguments, as soon as all of them are done.
+    Yields (task name, result) pairs in the order the tasks finish.
+    The first exception raised by a task is re-raised.
+    """
+    for name, (_, deps) in tasks.items():
+        for dep in deps:
+            if dep not in tasks:
+                raise ValueError(f"Task '{name}' depends on unknown task '{dep}'")
+
+    results = {}
+    pending = dict(tasks)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            # Start every task whose dependencies have all finished
+            for name, (fn, deps) in list(pending.items()):
+                if all(dep in results for dep in deps):
+                    kwargs = {dep: results[dep] for dep in deps}
+                    running[executor.submit(in_current_context(fn), **kwargs)] = name
+                    del pending[name]
+
+            if not running:
+                raise ValueError(f"Dependency cycle between tasks: {sorted(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name] = future.result()
+                yield name, results[name]
+
+def run_task_graph(tasks, max_workers=4):
+    "Same as iter_task_graph, but waits for every task and returns a dict of task name -> result"
+    return dict(iter_task_graph(tasks, max_workers))
+
+async def iter_task_graph_async(tasks):
+    """
+    asyncio version of iter_task_graph: fn returns a coroutine and every ready
+    task runs concurrently on the event loop. Yields (task name, result) pairs
+    in the order the tasks finish; the remaining tasks are cancelled if one fails.
+    """
+    for name, (_, deps) in tasks.items():
+        for dep in deps:
+            if dep not in tasks:
+                raise ValueError(f"Task '{name}' depends on unknown task '{dep}'")
+
+    results = {}
+    pending = dict(tasks)
+    running = {}
+
+    try:
+        while pending or running:
+            for name, (fn, deps) in list(pending.items()):
+                if all(dep in results for dep in deps):
+                    kwargs = {dep: results[dep] for dep in deps}
+                    running[asyncio.ensure_future(fn(**kwargs))] = name
+                    del pending[name]
+
+            if not running:
+                raise ValueError(f"Dependency cycle between tasks: {sorted(pending)}")
+
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name] = future.result()
+                yield name, results[name]
+    finally:
+        for future in running:
+            future.cancel()
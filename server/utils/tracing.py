@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import uuid
+import logging
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+# Lightweight per-request tracing. A request starts a Trace, and span() records how long
+# each GitHub fetch, issue file read, LLM call and JSON parse inside it took.
+# The totals per span name go back in the Server-Timing header (visible in browser devtools),
+# and with TRACE_FILE set every full trace is appended as one JSON line to a rotating file.
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+TRACE_FILE_MAX_BYTES = int(os.getenv("TRACE_FILE_MAX_BYTES", 10 * 1024 * 1024))
+TRACE_FILE_BACKUPS = int(os.getenv("TRACE_FILE_BACKUPS", 5))
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+class Trace:
+    def __init__(self, name):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.started_at = time.time()
+        self._started = time.monotonic()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, name, started, duration, attributes):
+        with self._lock:
+            self.spans.append({
+                "name": name,
+                "start_ms": round((started - self._started) * 1000, 2),
+                "duration_ms": round(duration * 1000, 2),
+                "thread": threading.current_thread().name,
+                **attributes
+            })
+
+    def elapsed(self):
+        return time.monotonic() - self._started
+
+    def server_timing(self):
+        "Server-Timing header value: total time and count per span name, plus the time of the whole request so far"
+        totals = {}
+        with self._lock:
+            for span in self.spans:
+                duration, count = totals.get(span["name"], (0.0, 0))
+                totals[span["name"]] = (duration + span["duration_ms"], count + 1)
+        entries = [f'{name};dur={duration:.1f};desc="{count}x"' for name, (duration, count) in totals.items()]
+        entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(entries)
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["start_ms"])
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(self.elapsed() * 1000, 2),
+            "spans": spans
+        }
+
+def start_trace(name):
+    "Starts a trace that span() in the current context (and the threads it hands work to) records into"
+    trace = Trace(name)
+    current_trace.set(trace)
+    return trace
+
+@contextmanager
+def span(name, **attributes):
+    "Times the block as a span of the current trace (a no-op outside of a traced request)"
+    trace = current_trace.get()
+    if trace is None:
+        yield attributes
+        return
+    started = time.monotonic()
+    try:
+        # The block can add attributes it only knows at the end (e.g. a status code)
+        yield attributes
+    finally:
+        trace.add(name, started, time.monotonic() - started, attributes)
+
+def in_current_context(fn):
+    """
+    Wraps fn to run in a copy of the caller's context, so work handed to a thread pool
+    is still part of the request's trace. Each call gets its own copy, so the wrapper can
+    be used by several threads at once.
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+_trace_log = None
+_trace_log_lock = threading.Lock()
+
+def write_trace(trace):
+    "Appends the trace to TRACE_FILE as one JSON line, if a trace file is configured"
+    global _trace_log
+    if not TRACE_FILE:
+        return
+    with _trace_log_lock:
+        if _trace_log is None:
+            os.makedirs(os.path.dirname(os.path.abspath(TRACE_FILE)), exist_ok=True)
+            _trace_log = logging.getLogger("guidebook.traces")
+            _trace_log.setLevel(logging.INFO)
+            _trace_log.propagate = False
+            _trace_log.addHandler(RotatingFileHandler(TRACE_FILE, maxBytes=TRACE_FILE_MAX_BYTES, backupCount=TRACE_FILE_BACKUPS))
+    _trace_log.info(json.dumps(trace.to_dict()))